@@ -0,0 +1,309 @@
+import asyncio
+import math
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.responses import ORJSONResponse
+from jose import JWTError, jwt
+from loguru import logger
+from api.security import SECRET_KEY, ALGORITHM, get_current_user, User
+
+# Admission control. Every request takes a slot of its lane before reaching the routes: lanes have a
+# concurrency limit and a bounded queue where requests wait up to a deadline, after which (or when the
+# queue is full) they get a 503 with Retry-After instead of slowing everybody down. Non admin lanes
+# also share ADMISSION_MAX_CONCURRENCY, and freed slots go to the waiting lane with the highest
+# priority, so login and registrations get through before catalog polling when the schedule is
+# published. Requests from admins run in their own lane, outside the shared budget.
+#
+# Per lane settings override the defaults below, e.g.
+#   ADMISSION_LIMITS=polling=8,registration=48
+#   ADMISSION_QUEUES=polling=16
+#   ADMISSION_WAIT_SECONDS=polling=0.5
+#
+# Lanes and rate limit buckets are only touched from the event loop (the middleware and the async
+# dependencies below, never the threadpool), so no locking.
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "64"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "2"))
+
+# Token buckets: sustained attempts per minute and burst, per username and client address (login)
+# or per user (register). RATE_LIMITS_ENABLED=false turns them off, e.g. for the benchmark
+RATE_LIMITS_ENABLED = os.getenv("RATE_LIMITS_ENABLED", "true").lower() in ("1", "true", "yes")
+LOGIN_RATE_PER_MINUTE = float(os.getenv("LOGIN_RATE_PER_MINUTE", "10"))
+LOGIN_BURST = int(os.getenv("LOGIN_BURST", "5"))
+REGISTER_RATE_PER_MINUTE = float(os.getenv("REGISTER_RATE_PER_MINUTE", "30"))
+REGISTER_BURST = int(os.getenv("REGISTER_BURST", "10"))
+# Buckets kept per limiter, the least recently used ones are dropped (a dropped bucket is full again)
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+# name -> (priority, limit, queue size, wait seconds). Higher priority is served first
+LANE_DEFAULTS = {
+    "admin": (4, 8, 16, 10.0),
+    "auth": (3, 16, 64, 5.0),
+    "registration": (3, 32, 128, 5.0),
+    "default": (2, 32, 64, 3.0),
+    "polling": (1, 24, 32, 1.0),
+}
+
+# First match wins, admins are routed before these. (methods or None for any, path pattern, lane)
+LANE_RULES = [
+    (None, re.compile(r"^/auth/"), "auth"),
+    (None, re.compile(r"^/(events|classes)/\d+/(register|unregister|waitlist)$"), "registration"),
+    ({"GET", "HEAD"}, re.compile(r"^/(home|events|classes|announcements|standings|calendar|history|images)(/|$)"), "polling"),
+    # The launch screen reads of the app, in one request
+    ({"POST"}, re.compile(r"^/batch$"), "polling"),
+]
+
+# Never queued: health, docs and the metrics scraper
+EXEMPT_PATHS = {"/", "/docs", "/redoc", "/openapi.json", "/metrics"}
+
+
+def _setting(name: str) -> dict:
+    pairs = (item.split("=", 1) for item in os.getenv(name, "").split(",") if "=" in item)
+    return {lane.strip(): float(value) for lane, value in pairs}
+
+
+class Lane:
+    def __init__(self, name: str, priority: int, limit: int, queue_size: int, wait_seconds: float, shared: bool):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.queue_size = queue_size
+        self.wait_seconds = wait_seconds
+        # Counts against ADMISSION_MAX_CONCURRENCY
+        self.shared = shared
+        self.active = 0
+        self.waiting = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.shed_full = 0
+        self.shed_deadline = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "priority": self.priority,
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "wait_seconds": self.wait_seconds,
+            "active": self.active,
+            "queue_depth": len(self.waiting),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed_queue_full": self.shed_full,
+            "shed_deadline": self.shed_deadline,
+            "wait_avg_ms": round(self.wait_total / self.queued * 1000, 3) if self.queued else None,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.shared_active = 0
+        limits, queues, waits = _setting("ADMISSION_LIMITS"), _setting("ADMISSION_QUEUES"), _setting("ADMISSION_WAIT_SECONDS")
+        self.lanes = {
+            name: Lane(
+                name, priority,
+                int(limits.get(name, limit)), int(queues.get(name, queue_size)), waits.get(name, wait_seconds),
+                shared=name != "admin",
+            )
+            for name, (priority, limit, queue_size, wait_seconds) in LANE_DEFAULTS.items()
+        }
+        self._by_priority = sorted(self.lanes.values(), key=lambda lane: -lane.priority)
+
+    def lane_for(self, method: str, path: str, is_admin: bool) -> Lane:
+        if is_admin:
+            return self.lanes["admin"]
+        for methods, pattern, name in LANE_RULES:
+            if (methods is None or method in methods) and pattern.match(path):
+                return self.lanes[name]
+        return self.lanes["default"]
+
+    def _can_run(self, lane: Lane) -> bool:
+        return lane.active < lane.limit and (not lane.shared or self.shared_active < self.max_concurrency)
+
+    def _take(self, lane: Lane):
+        lane.active += 1
+        lane.admitted += 1
+        if lane.shared:
+            self.shared_active += 1
+
+    def _ahead(self, lane: Lane) -> bool:
+        # Waiting requests that would be served before this one. A higher lane held back by its own
+        # limit does not hold lower lanes, the slot could not go to it anyway
+        if lane.waiting:
+            return True
+        return lane.shared and any(
+            other.waiting and other.active < other.limit
+            for other in self._by_priority if other.shared and other.priority > lane.priority
+        )
+
+    async def acquire(self, lane: Lane) -> bool:
+        # True when the request may run, then release must be called. False when it is shed
+        if self._can_run(lane) and not self._ahead(lane):
+            self._take(lane)
+            return True
+        if len(lane.waiting) >= lane.queue_size:
+            lane.shed_full += 1
+            return False
+
+        ticket = asyncio.get_running_loop().create_future()
+        lane.waiting.append(ticket)
+        lane.queued += 1
+        started = time.perf_counter()
+        try:
+            # asyncio.wait does not cancel the ticket on timeout, so a slot granted at the last moment
+            # is seen here and not lost
+            await asyncio.wait({ticket}, timeout=lane.wait_seconds)
+        except asyncio.CancelledError:
+            # Client gone while waiting
+            if ticket.done():
+                self.release(lane)
+            else:
+                lane.waiting.remove(ticket)
+            raise
+        waited = time.perf_counter() - started
+        lane.wait_total += waited
+        lane.wait_max = max(lane.wait_max, waited)
+        if ticket.done():
+            return True
+        lane.waiting.remove(ticket)
+        lane.shed_deadline += 1
+        return False
+
+    def release(self, lane: Lane):
+        lane.active -= 1
+        if lane.shared:
+            self.shared_active -= 1
+        self._wake()
+
+    def _wake(self):
+        # Hands the free slots to the waiting requests, highest priority lanes first
+        for lane in self._by_priority:
+            while lane.waiting and self._can_run(lane):
+                self._take(lane)
+                lane.waiting.popleft().set_result(True)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "max_concurrency": self.max_concurrency,
+            "shared_active": self.shared_active,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+        }
+
+
+admission = AdmissionController()
+
+
+def _is_admin(scope) -> bool:
+    # From the token claims only, the routes still validate the token. A forged or revoked admin token
+    # gets at most a slot in the admin lane before its 401
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer" or not token:
+                return False
+            try:
+                return bool(jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("is_admin"))
+            except JWTError:
+                return False
+    return False
+
+
+class AdmissionMiddleware:
+    # Plain ASGI middleware, the slot is held until the response is fully sent
+    def __init__(self, app, controller: AdmissionController = admission):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_ENABLED or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        lane = self.controller.lane_for(scope["method"], scope["path"], _is_admin(scope))
+        if not await self.controller.acquire(lane):
+            logger.warning("Shed {} {} ({} lane, queue depth {})", scope["method"], scope["path"], lane.name, len(lane.waiting))
+            response = ORJSONResponse(
+                {"detail": "Server busy, retry later"},
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(lane)
+
+
+# --- Rate limits ---
+
+class RateLimiter:
+    # Token bucket per key: rate tokens per second up to burst, one token per attempt
+    def __init__(self, name: str, per_minute: float, burst: int, max_keys: int = RATE_LIMIT_MAX_KEYS, enabled: bool = RATE_LIMITS_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> (tokens, monotonic time of the last update), in least recently used order
+        self._buckets = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def take(self, key) -> float:
+        # 0 when allowed, otherwise the seconds until the next token
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / self.rate if self.rate > 0 else float("inf")
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        if wait:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    def check(self, key):
+        if not self.enabled:
+            return
+        wait = self.take(key)
+        if wait:
+            logger.warning("Rate limit {} reached for {}", self.name, key)
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many attempts, retry later",
+                headers={"Retry-After": str(math.ceil(wait)) if math.isfinite(wait) else "3600"},
+            )
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "keys": len(self._buckets), "allowed": self.allowed, "limited": self.limited, "per_minute": self.rate * 60, "burst": self.burst}
+
+
+login_limiter = RateLimiter("login", LOGIN_RATE_PER_MINUTE, LOGIN_BURST)
+register_limiter = RateLimiter("register", REGISTER_RATE_PER_MINUTE, REGISTER_BURST)
+rate_limiters = {limiter.name: limiter for limiter in (login_limiter, register_limiter)}
+
+# async def so they run on the event loop: a plain def dependency runs in the threadpool, where
+# concurrent take() calls on the same bucket would race
+async def login_rate_limit(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    # Per account and client address, so spamming an email only locks the spammer out of it. The form
+    # is parsed once and shared with the route
+    login_limiter.check((form_data.username.strip().lower(), request.client.host if request.client else None))
+
+async def register_rate_limit(current_user: User = Depends(get_current_user)):
+    register_limiter.check(current_user.id)
@@ -0,0 +1,289 @@
+import heapq
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import bindparam, delete, insert, tuple_, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.models import User, Class, UserClassLink, ClassWaitlist, RecoveryWindow
+
+# Batch allocation of recovery credits to open class slots, instead of a registration stampede.
+#
+# The assignment is a min cost max flow: source -> member -> class -> sink, with member capacity =
+# credits, class capacity = free slots and cost = how far below the member's level the class is, so
+# as many credits as possible are used and members land in classes of their own level, leaving the
+# easier ones to lower levels. Members and classes are grouped into interchangeable nodes, so the
+# graph grows with the number of distinct preference profiles and class slots, not with the number of
+# members and classes.
+
+# Cost units per level point (levels go in steps of 0.5)
+COST_SCALE = 10
+WRITE_CHUNK_SIZE = 1000
+
+
+class FlowNetwork:
+    # Successive shortest paths with Dijkstra and potentials, all costs are non negative
+    def __init__(self, size: int):
+        # Edges are [to, capacity, cost, index of the reverse edge]
+        self.graph = [[] for _ in range(size)]
+
+    def add_edge(self, source: int, target: int, capacity: int, cost: int) -> tuple:
+        self.graph[source].append([target, capacity, cost, len(self.graph[target])])
+        self.graph[target].append([source, 0, -cost, len(self.graph[source]) - 1])
+        return source, len(self.graph[source]) - 1
+
+    def flow(self, edge: tuple) -> int:
+        # Flow through an edge returned by add_edge, read from its reverse edge
+        node, index = edge
+        target, _, _, reverse = self.graph[node][index]
+        return self.graph[target][reverse][1]
+
+    def min_cost_flow(self, source: int, sink: int) -> tuple:
+        size = len(self.graph)
+        potential = [0] * size
+        total_flow = total_cost = 0
+        while True:
+            distance = [None] * size
+            distance[source] = 0
+            previous = [None] * size
+            heap = [(0, source)]
+            while heap:
+                dist, node = heapq.heappop(heap)
+                if dist > distance[node]:
+                    continue
+                for index, (target, capacity, cost, _) in enumerate(self.graph[node]):
+                    if capacity <= 0:
+                        continue
+                    candidate = dist + cost + potential[node] - potential[target]
+                    if distance[target] is None or candidate < distance[target]:
+                        distance[target] = candidate
+                        previous[target] = (node, index)
+                        heapq.heappush(heap, (candidate, target))
+            if distance[sink] is None:
+                return total_flow, total_cost
+            for node in range(size):
+                if distance[node] is not None:
+                    potential[node] += distance[node]
+
+            push, node = None, sink
+            while node != source:
+                parent, index = previous[node]
+                capacity = self.graph[parent][index][1]
+                push = capacity if push is None else min(push, capacity)
+                node = parent
+            node = sink
+            while node != source:
+                parent, index = previous[node]
+                edge = self.graph[parent][index]
+                edge[1] -= push
+                self.graph[node][edge[3]][1] += push
+                node = parent
+            total_flow += push
+            total_cost += push * (potential[sink] - potential[source])
+
+
+def _matches(window, schedule: datetime, gap: float) -> bool:
+    weekday, start_time, end_time, max_level_gap = window
+    return (
+        (weekday is None or schedule.weekday() == weekday)
+        and start_time <= schedule.time() < end_time
+        and (max_level_gap is None or gap <= max_level_gap)
+    )
+
+def plan_allocation(members: List[tuple], classes: List[tuple], windows: Dict[int, list], links: Dict[int, set]) -> tuple:
+    # members: (user id, level, credits), classes: (class id, schedule, level_required, free slots),
+    # windows: user id -> [(weekday, start_time, end_time, max_level_gap)], links: user id -> class ids
+    # the user is already in. Returns (user id -> assigned class ids, dropped seats)
+    #
+    # Classes with the same weekday, time and level are interchangeable for every member, so they are
+    # one slot node, and members with the same level, eligible slots, credits and current classes are
+    # one group node
+    slots, samples = defaultdict(list), {}
+    free = {}
+    for class_id, schedule, level_required, slots_left in classes:
+        key = (schedule.weekday(), schedule.time(), level_required)
+        slots[key].append(class_id)
+        samples.setdefault(key, schedule)
+        free[class_id] = slots_left
+    slot_keys = sorted(slots, key=repr)
+
+    eligible_by_profile = {}
+    groups = defaultdict(list)
+    for user_id, level, credits in members:
+        profile = (level, tuple(sorted(windows.get(user_id, []), key=repr)))
+        if profile not in eligible_by_profile:
+            eligible_by_profile[profile] = tuple(
+                number for number, key in enumerate(slot_keys)
+                if key[2] <= level and (
+                    not profile[1] or any(_matches(window, samples[key], level - key[2]) for window in profile[1])
+                )
+            )
+        eligible = eligible_by_profile[profile]
+        if eligible:
+            groups[(level, eligible, credits, tuple(sorted(links.get(user_id, ()))))].append(user_id)
+
+    group_keys = list(groups)
+    # Nodes: source, groups, slots, sink
+    source, sink = 0, 1 + len(group_keys) + len(slot_keys)
+    network = FlowNetwork(sink + 1)
+    for number, key in enumerate(slot_keys):
+        network.add_edge(1 + len(group_keys) + number, sink, sum(free[class_id] for class_id in slots[key]), 0)
+    group_edges = []
+    for number, key in enumerate(group_keys):
+        level, eligible, credits, linked = key
+        users = groups[key]
+        node = 1 + number
+        network.add_edge(source, node, credits * len(users), 0)
+        edges = []
+        for slot in eligible:
+            # Each member at most once per class, and not in the classes the group is already in
+            open_classes = sum(1 for class_id in slots[slot_keys[slot]] if class_id not in linked)
+            if not open_classes:
+                continue
+            cost = round((level - slot_keys[slot][2]) * COST_SCALE)
+            edges.append((slot, network.add_edge(node, 1 + len(group_keys) + slot, len(users) * open_classes, cost)))
+        group_edges.append(edges)
+    network.min_cost_flow(source, sink)
+
+    # Back to members and classes: the seats of a group in a slot are dealt round robin over its
+    # members, skipping the ones out of credits or already in the class. The slot node only bounds
+    # these per class constraints, so a seat that fits nobody is left unassigned and counted as
+    # dropped, apart from the credits no open slot could take
+    assignments = defaultdict(list)
+    dropped = 0
+    credits_left = {user_id: credits for user_id, _, credits in members}
+    for key, edges in zip(group_keys, group_edges):
+        users = groups[key]
+        turn = 0
+        for slot, edge in edges:
+            seats = network.flow(edge)
+            for class_id in slots[slot_keys[slot]]:
+                checked = 0
+                while seats and free[class_id] and checked < len(users):
+                    user_id = users[turn % len(users)]
+                    turn += 1
+                    checked += 1
+                    if credits_left[user_id] and class_id not in links.get(user_id, ()) and class_id not in assignments[user_id]:
+                        assignments[user_id].append(class_id)
+                        credits_left[user_id] -= 1
+                        free[class_id] -= 1
+                        seats -= 1
+            dropped += seats
+    return {user_id: class_ids for user_id, class_ids in assignments.items() if class_ids}, dropped
+
+def allocation_report(members, classes, assignments, dropped: int, include_assignments: bool) -> dict:
+    assigned_per_class = defaultdict(int)
+    for class_ids in assignments.values():
+        for class_id in class_ids:
+            assigned_per_class[class_id] += 1
+    by_level = defaultdict(lambda: {"classes": 0, "free_slots": 0, "assigned": 0})
+    for class_id, _, level_required, free in classes:
+        entry = by_level[level_required]
+        entry["classes"] += 1
+        entry["free_slots"] += free
+        entry["assigned"] += assigned_per_class[class_id]
+    credits = sum(credits for _, _, credits in members)
+    assigned = sum(assigned_per_class.values())
+    report = {
+        "members": len(members),
+        "credits": credits,
+        "assigned": assigned,
+        "unassigned_credits": credits - assigned,
+        # Of the unassigned credits, the ones the plan found a seat for but could not deal to a member
+        # (decomposition loss), the rest had no open slot
+        "dropped_seats": dropped,
+        "members_assigned": len(assignments),
+        "open_classes": len(classes),
+        "by_level": [{"level_required": level, **values} for level, values in sorted(by_level.items())],
+    }
+    if include_assignments:
+        report["assignments"] = [{"user_id": user_id, "class_ids": class_ids} for user_id, class_ids in sorted(assignments.items())]
+    return report
+
+
+async def load_candidates(session: AsyncSession, start: datetime, end: Optional[datetime]) -> tuple:
+    # Open classes, members with credits, their windows and current classes. Nothing is locked, the
+    # plan is checked again by revalidate_allocation before it is written
+    class_query = select(Class.id, Class.schedule, Class.level_required, Class.max_students - Class.student_count).where(
+        Class.schedule >= start, Class.student_count < Class.max_students
+    )
+    if end is not None:
+        class_query = class_query.where(Class.schedule < end)
+    member_query = select(User.id, User.level, User.classes_to_recover).where(User.classes_to_recover > 0)
+    classes = [tuple(row) for row in (await session.exec(class_query.order_by(Class.id))).all()]
+    members = [tuple(row) for row in (await session.exec(member_query.order_by(User.id))).all()]
+
+    windows = defaultdict(list)
+    for user_id, weekday, start_time, end_time, max_level_gap in (await session.exec(
+        select(RecoveryWindow.user_id, RecoveryWindow.weekday, RecoveryWindow.start_time, RecoveryWindow.end_time, RecoveryWindow.max_level_gap)
+        .join(User, User.id == RecoveryWindow.user_id)
+        .where(User.classes_to_recover > 0)
+    )).all():
+        windows[user_id].append((weekday, start_time, end_time, max_level_gap))
+    links = defaultdict(set)
+    if classes:
+        for user_id, class_id in (await session.exec(
+            select(UserClassLink.user_id, UserClassLink.class_id).where(UserClassLink.class_id.in_([row[0] for row in classes]))
+        )).all():
+            links[user_id].add(class_id)
+    return members, classes, windows, links
+
+async def revalidate_allocation(session: AsyncSession, assignments: Dict[int, List[int]]) -> Dict[int, List[int]]:
+    # Locks the planned classes then members, in id order (the lock order of the registration routes),
+    # and drops what the registrations made since the plan invalid: full classes, spent credits and
+    # members who joined the class meanwhile. Returns the assignments still valid
+    user_ids = sorted(assignments)
+    class_ids = sorted({class_id for ids in assignments.values() for class_id in ids})
+    if not class_ids:
+        return {}
+    free = {
+        class_id: slots_left for class_id, slots_left in (await session.exec(
+            select(Class.id, Class.max_students - Class.student_count).where(Class.id.in_(class_ids)).order_by(Class.id).with_for_update()
+        )).all()
+    }
+    credits_left = {
+        user_id: credits for user_id, credits in (await session.exec(
+            select(User.id, User.classes_to_recover).where(User.id.in_(user_ids)).order_by(User.id).with_for_update()
+        )).all()
+    }
+    linked = {
+        tuple(row) for row in (await session.exec(
+            select(UserClassLink.user_id, UserClassLink.class_id).where(UserClassLink.user_id.in_(user_ids), UserClassLink.class_id.in_(class_ids))
+        )).all()
+    }
+    valid = defaultdict(list)
+    for user_id in user_ids:
+        for class_id in assignments[user_id]:
+            if free.get(class_id, 0) > 0 and credits_left.get(user_id, 0) > 0 and (user_id, class_id) not in linked:
+                valid[user_id].append(class_id)
+                free[class_id] -= 1
+                credits_left[user_id] -= 1
+    return dict(valid)
+
+async def write_allocation(session: AsyncSession, assignments: Dict[int, List[int]]):
+    # Links, counters and credits in a few bulk statements, rows are locked by revalidate_allocation.
+    # The caller commits
+    pairs = [{"user_id": user_id, "class_id": class_id} for user_id, class_ids in assignments.items() for class_id in class_ids]
+    if not pairs:
+        return
+    for start in range(0, len(pairs), WRITE_CHUNK_SIZE):
+        chunk = pairs[start:start + WRITE_CHUNK_SIZE]
+        await session.exec(insert(UserClassLink), params=chunk)
+        # Assigned members leave the waitlists of those classes
+        await session.exec(delete(ClassWaitlist).where(
+            tuple_(ClassWaitlist.user_id, ClassWaitlist.class_id).in_([(pair["user_id"], pair["class_id"]) for pair in chunk])
+        ))
+
+    filled = defaultdict(int)
+    for pair in pairs:
+        filled[pair["class_id"]] += 1
+    # One executemany per table, on the Core tables so the statements run as plain batched UPDATEs
+    classes, users = Class.__table__, User.__table__
+    await session.exec(
+        update(classes).where(classes.c.id == bindparam("target_id")).values(student_count=classes.c.student_count + bindparam("added")),
+        params=[{"target_id": class_id, "added": count} for class_id, count in filled.items()],
+    )
+    await session.exec(
+        update(users).where(users.c.id == bindparam("target_id")).values(classes_to_recover=users.c.classes_to_recover - bindparam("spent")),
+        params=[{"target_id": user_id, "spent": len(class_ids)} for user_id, class_ids in assignments.items()],
+    )
@@ -0,0 +1,108 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Optional
+
+# In-process caches. Each worker has its own copy, invalidation only reaches the local one.
+# The listing and summary caches store (etag, value) and are only served when the tag matches the
+# current change markers (api/http_cache.py), so writes made through other workers are seen too
+
+class TTLCache:
+    # Size bounded LRU cache with a per-entry TTL. Only used from the event loop, so no locking
+    def __init__(self, name: str, ttl: float, maxsize: int):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        caches[name] = self
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        if self.ttl <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        if self._data.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def delete_many(self, keys: Iterable[Hashable]):
+        for key in keys:
+            self.delete(key)
+
+    def clear(self):
+        self.invalidations += len(self._data)
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# name -> cache
+caches = {}
+
+# Rendered /home/summary per user id. Dropped when the user registers or unregisters,
+# and for everyone when announcements change
+home_summary_cache = TTLCache(
+    "home_summary",
+    ttl=float(os.getenv("HOME_SUMMARY_CACHE_TTL_SECONDS", "30")),
+    maxsize=int(os.getenv("HOME_SUMMARY_CACHE_SIZE", "10000")),
+)
+
+# Level filtered /events and /classes listings, keyed by (level, limit). Shared by every user with
+# the same level. Cleared by the admin write routes and by registrations, since they change the counters
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "60"))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "256"))
+event_catalog_cache = TTLCache("event_catalog", ttl=CATALOG_CACHE_TTL_SECONDS, maxsize=CATALOG_CACHE_SIZE)
+class_catalog_cache = TTLCache("class_catalog", ttl=CATALOG_CACHE_TTL_SECONDS, maxsize=CATALOG_CACHE_SIZE)
+
+def catalog_window() -> int:
+    # Part of the listing tags. Registrations change the counters without bumping the event / class
+    # markers (db/changes.py), so a listing seen by other workers and clients is at most one window old
+    return int(time.time() // max(CATALOG_CACHE_TTL_SECONDS, 1))
+
+# Calendar feeds served by /calendar/{token}.ics: token -> user id, and user id -> rendered feed.
+# Calendar apps poll every few minutes, so most polls are answered from here without a query. Dropped
+# locally when the user's registrations change, other workers pick the change up when the entry expires
+CALENDAR_FEED_CACHE_TTL_SECONDS = float(os.getenv("CALENDAR_FEED_CACHE_TTL_SECONDS", "300"))
+CALENDAR_FEED_CACHE_SIZE = int(os.getenv("CALENDAR_FEED_CACHE_SIZE", "10000"))
+calendar_token_cache = TTLCache("calendar_token", ttl=CALENDAR_FEED_CACHE_TTL_SECONDS, maxsize=CALENDAR_FEED_CACHE_SIZE)
+calendar_feed_cache = TTLCache("calendar_feed", ttl=CALENDAR_FEED_CACHE_TTL_SECONDS, maxsize=CALENDAR_FEED_CACHE_SIZE)
+
+# Stored token_version per user id, checked against the token on the fast auth path (api/security.py).
+# The value is a 1-tuple, (None,) means the user was deleted. How long a version read from the
+# database is trusted before checking it again
+TOKEN_VERSION_TTL_SECONDS = float(os.getenv("TOKEN_VERSION_TTL_SECONDS", "30"))
+token_version_cache = TTLCache(
+    "token_version",
+    ttl=TOKEN_VERSION_TTL_SECONDS,
+    maxsize=int(os.getenv("TOKEN_VERSION_CACHE_SIZE", "100000")),
+)
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from sqlalchemy import String, cast, literal, null, or_, union_all, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.models import Event, Class, UserEventLink, UserClassLink, CalendarFeed
+
+# Per-user iCalendar feeds. The rendered feed is stored in calendarfeed and only rebuilt when it is
+# stale: the routes that change a user's registrations, or an event / class, call mark_feeds_stale
+# (through schedule_changed in api/registration.py) in their transaction, which bumps the version of the affected feeds. A rebuild is one query over both
+# link tables.
+
+CALENDAR_NAME = os.getenv("CALENDAR_NAME", "Padel Club")
+CALENDAR_UID_DOMAIN = os.getenv("CALENDAR_UID_DOMAIN", "padel-club")
+# Events and classes have no end time, these are their durations in the feed
+CALENDAR_EVENT_MINUTES = int(os.getenv("CALENDAR_EVENT_MINUTES", "120"))
+CALENDAR_CLASS_MINUTES = int(os.getenv("CALENDAR_CLASS_MINUTES", "60"))
+# Older entries are left out of the feed
+CALENDAR_PAST_DAYS = int(os.getenv("CALENDAR_PAST_DAYS", "90"))
+
+PRODID = "-//Padel Club//Calendar Feed//EN"
+
+
+def new_token() -> str:
+    return secrets.token_urlsafe(32)
+
+async def mark_feeds_stale(session: AsyncSession, user_ids: Iterable[int] = (), event_id: Optional[int] = None, class_id: Optional[int] = None):
+    # Feeds of user_ids and of the participants of event_id / class_id are rebuilt on their next poll.
+    # Call before the links are deleted and before commit. Users without a feed cost nothing
+    conditions = []
+    user_ids = list(user_ids)
+    if user_ids:
+        conditions.append(CalendarFeed.user_id.in_(user_ids))
+    if event_id is not None:
+        conditions.append(CalendarFeed.user_id.in_(select(UserEventLink.user_id).where(UserEventLink.event_id == event_id)))
+    if class_id is not None:
+        conditions.append(CalendarFeed.user_id.in_(select(UserClassLink.user_id).where(UserClassLink.class_id == class_id)))
+    if conditions:
+        await session.exec(update(CalendarFeed).where(or_(*conditions)).values(version=CalendarFeed.version + 1))
+
+
+def _entries(user_id: int, since: datetime):
+    # Events and classes of the user in one statement, ordered by start
+    events = (
+        select(
+            literal("event").label("kind"),
+            Event.id.label("id"),
+            Event.name.label("name"),
+            Event.type.label("type"),
+            Event.min_level.label("level"),
+            Event.date.label("start"),
+        )
+        .join(UserEventLink, UserEventLink.event_id == Event.id)
+        .where(UserEventLink.user_id == user_id, Event.date >= since)
+    )
+    classes = (
+        select(
+            literal("class"),
+            Class.id,
+            cast(null(), String),
+            cast(null(), String),
+            Class.level_required,
+            Class.schedule,
+        )
+        .join(UserClassLink, UserClassLink.class_id == Class.id)
+        .where(UserClassLink.user_id == user_id, Class.schedule >= since)
+    )
+    entries = union_all(events, classes).subquery()
+    return select(*entries.c).order_by(entries.c.start, entries.c.kind, entries.c.id)
+
+def _escape(text: str) -> str:
+    # Line breaks of any kind become \n, a bare CR would end the content line
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def _fold(line: str) -> str:
+    # Content lines are limited to 75 octets, longer ones continue on lines starting with a space
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line
+    parts, current, size = [], [], 0
+    for char in line:
+        width = len(char.encode())
+        if size + width > (75 if not parts else 74):
+            parts.append("".join(current))
+            current, size = [], 0
+        current.append(char)
+        size += width
+    parts.append("".join(current))
+    return "\r\n ".join(parts)
+
+def _timestamp(value: datetime) -> str:
+    # Dates are stored in UTC
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+def render_feed(rows, built_at: datetime) -> str:
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(CALENDAR_NAME)}",
+        "REFRESH-INTERVAL;VALUE=DURATION:PT15M",
+        "X-PUBLISHED-TTL:PT15M",
+    ]
+    for kind, entry_id, name, event_type, level, start in rows:
+        if kind == "event":
+            summary, description, minutes = name, f"{event_type}, minimum level {level}", CALENDAR_EVENT_MINUTES
+        else:
+            summary, description, minutes = "Padel class", f"Level {level}", CALENDAR_CLASS_MINUTES
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{kind}-{entry_id}@{CALENDAR_UID_DOMAIN}",
+            f"DTSTAMP:{_timestamp(built_at)}",
+            f"DTSTART:{_timestamp(start)}",
+            f"DTEND:{_timestamp(start + timedelta(minutes=minutes))}",
+            f"SUMMARY:{_escape(summary)}",
+            f"DESCRIPTION:{_escape(description)}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "".join(_fold(line) + "\r\n" for line in lines)
+
+def feed_entry(feed: CalendarFeed) -> dict:
+    # What the in-process cache keeps of a feed
+    return {"user_id": feed.user_id, "body": feed.body, "etag": feed.etag, "last_modified": feed.last_modified}
+
+async def build_feed(session: AsyncSession, feed: CalendarFeed) -> dict:
+    # Rebuilds a stale feed and stores it, returns its cache entry. The version read with the row is
+    # recorded as built, so a change committed during the rebuild leaves the feed stale for the next poll
+    version = feed.version
+    rows = (await session.exec(_entries(feed.user_id, datetime.utcnow() - timedelta(days=CALENDAR_PAST_DAYS)))).all()
+    # The tag covers the entries, not the DTSTAMP, so a rebuild with the same entries keeps it
+    etag = hashlib.blake2b(repr([tuple(row) for row in rows]).encode(), digest_size=16).hexdigest()
+    values = {"built_version": version}
+    if etag != feed.etag or feed.body is None:
+        now = datetime.utcnow().replace(microsecond=0)
+        values.update(body=render_feed(rows, now), etag=etag, last_modified=now)
+    await session.exec(
+        update(CalendarFeed)
+        .where(CalendarFeed.user_id == feed.user_id, CalendarFeed.built_version < version)
+        .values(**values)
+    )
+    await session.commit()
+    return {**feed_entry(feed), **values}
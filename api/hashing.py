@@ -0,0 +1,140 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException, status
+from loguru import logger
+from starlette.concurrency import run_in_threadpool
+from api.hashing_worker import BCRYPT_ROUNDS, _hash_job, _verify_job
+
+# Size of the process pool that runs bcrypt, 0 runs it in the threadpool instead
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hash / verify calls allowed in flight (running + queued) before answering 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+# Number of recent calls kept for the latency percentiles
+PASSWORD_HASH_SAMPLES = 1000
+
+
+class HashingStats:
+    # Per operation timings. "compute" is the bcrypt time inside the worker, "total" includes the queueing
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.rehashed = 0
+        self._samples = {
+            op: {"compute": deque(maxlen=PASSWORD_HASH_SAMPLES), "total": deque(maxlen=PASSWORD_HASH_SAMPLES)}
+            for op in ("hash", "verify")
+        }
+        self._counts = {"hash": 0, "verify": 0}
+
+    def observe(self, op: str, compute: float, total: float):
+        with self._lock:
+            self._counts[op] += 1
+            self._samples[op]["compute"].append(compute)
+            self._samples[op]["total"].append(total)
+
+    def incr(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @staticmethod
+    def _summary(samples) -> dict:
+        if not samples:
+            return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+        ordered = sorted(samples)
+        pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+        return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 2)}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+                "workers": PASSWORD_HASH_WORKERS,
+                "max_pending": PASSWORD_HASH_MAX_PENDING,
+                "pending": _pending,
+                "rejected": self.rejected,
+                "rehashed": self.rehashed,
+                **{
+                    op: {
+                        "count": self._counts[op],
+                        "compute": self._summary(samples["compute"]),
+                        "total": self._summary(samples["total"]),
+                    }
+                    for op, samples in self._samples.items()
+                },
+            }
+
+
+stats = HashingStats()
+_executor = None
+_pending = 0
+
+def _get_executor():
+    global _executor
+    if _executor is None and PASSWORD_HASH_WORKERS > 0:
+        # spawn so the workers do not inherit the event loop, the engine or open sockets
+        _executor = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+def _discard_executor(executor):
+    # Only the first of the calls failing on the same broken pool replaces it
+    global _executor
+    if executor is not None and _executor is executor:
+        logger.error("Password hashing pool is broken, starting a new one")
+        _executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def _run(op: str, job, *args):
+    # Fails fast with 503 instead of queueing without bound behind a login burst
+    global _pending
+    if _pending >= PASSWORD_HASH_MAX_PENDING:
+        stats.incr("rejected")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    _pending += 1
+    start = time.perf_counter()
+    try:
+        executor = _get_executor()
+        if executor is None:
+            result = await run_in_threadpool(job, *args)
+        else:
+            result = await asyncio.get_running_loop().run_in_executor(executor, job, *args)
+    except BrokenProcessPool:
+        # A worker died (OOM kill...), the pool takes no more jobs. The next call starts a new one
+        _discard_executor(executor)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication temporarily unavailable, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+    finally:
+        _pending -= 1
+    stats.observe(op, result[-1], time.perf_counter() - start)
+    return result[:-1]
+
+async def hash_password(password: str) -> str:
+    hashed, = await _run("hash", _hash_job, password, BCRYPT_ROUNDS)
+    return hashed
+
+async def verify_password(password: str, hashed_password: str):
+    # Returns (valid, new_hash). new_hash is set when the stored hash uses an outdated cost
+    valid, new_hash = await _run("verify", _verify_job, password, hashed_password, BCRYPT_ROUNDS)
+    if new_hash:
+        stats.incr("rehashed")
+    return valid, new_hash
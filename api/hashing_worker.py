@@ -0,0 +1,37 @@
+import os
+import time
+from passlib.context import CryptContext
+
+# The bcrypt jobs of api.hashing. The pool processes are spawned and import this module to unpickle
+# the jobs, so it must stay free of FastAPI, the engine and the models.
+
+# bcrypt cost factor. Hashes stored with a different cost are rehashed on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+def make_context(rounds: int = BCRYPT_ROUNDS) -> CryptContext:
+    # min and max rounds pinned to the configured cost so needs_update flags hashes made with any other cost
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
+
+
+_worker_contexts = {}
+
+def _worker_context(rounds: int) -> CryptContext:
+    if rounds not in _worker_contexts:
+        _worker_contexts[rounds] = make_context(rounds)
+    return _worker_contexts[rounds]
+
+def _hash_job(password: str, rounds: int):
+    start = time.perf_counter()
+    hashed = _worker_context(rounds).hash(password)
+    return hashed, time.perf_counter() - start
+
+def _verify_job(password: str, hashed_password: str, rounds: int):
+    start = time.perf_counter()
+    valid, new_hash = _worker_context(rounds).verify_and_update(password, hashed_password)
+    return valid, new_hash, time.perf_counter() - start
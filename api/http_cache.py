@@ -0,0 +1,140 @@
+import gzip
+import hashlib
+import os
+from typing import Optional, Sequence
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from db.changes import marker_versions
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# HTTP caching of the read endpoints: ETags computed from the change markers of the tables a response
+# reads (db/changes.py), so If-None-Match is answered with a 304 before the listing query runs, and
+# compression of large responses.
+#
+#   HTTP_COMPRESSION_MIN_BYTES=1024   smaller bodies are sent as is, 0 disables compression
+#   HTTP_GZIP_LEVEL=6
+#   HTTP_BROTLI_QUALITY=4             brotli is used when installed and accepted by the client
+
+HTTP_COMPRESSION_MIN_BYTES = int(os.getenv("HTTP_COMPRESSION_MIN_BYTES", "1024"))
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", "6"))
+HTTP_BROTLI_QUALITY = int(os.getenv("HTTP_BROTLI_QUALITY", "4"))
+# Bodies above this are compressed in the threadpool instead of on the event loop
+COMPRESSION_THREAD_MIN_BYTES = 256 * 1024
+
+# Tagged responses are per user: clients keep them but revalidate every time
+TAGGED_CACHE_CONTROL = "private, no-cache"
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/xml")
+
+
+async def etag_for(session, tables: Sequence[str], *keys) -> Optional[str]:
+    # ETag of a response built from tables, keys being whatever else it depends on (user, level,
+    # page). None when the markers are not available
+    versions = await marker_versions(session, tables)
+    if versions is None:
+        return None
+    digest = hashlib.blake2b(repr((sorted(versions.items()), keys)).encode(), digest_size=12).hexdigest()
+    # Weak, the same tag is used for the compressed and uncompressed bodies
+    return f'W/"{digest}"'
+
+async def check_etag(request: Request, session, tables: Sequence[str], *keys) -> Optional[str]:
+    # Raises a 304 when the client copy is current, otherwise returns the tag (see etag_for), which
+    # HttpCacheMiddleware puts on the response
+    tag = await etag_for(session, tables, *keys)
+    if tag is None:
+        return None
+    if _matches(request.headers.get("if-none-match"), tag):
+        raise HTTPException(status_code=304, headers={"ETag": tag, "Cache-Control": TAGGED_CACHE_CONTROL})
+    request.state.etag = tag
+    return tag
+
+def _matches(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Weak comparison, as If-None-Match requires
+    candidates = {value.strip().removeprefix("W/") for value in if_none_match.split(",")}
+    return "*" in candidates or tag.removeprefix("W/") in candidates
+
+def _pick_encoding(accept_encoding: str) -> Optional[str]:
+    # The supported encoding with the highest q, brotli on ties. "*" stands for the ones not listed
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    supported = ("br", "gzip") if brotli is not None else ("gzip",)
+    qualities = {encoding: accepted.get(encoding, accepted.get("*", 0.0)) for encoding in supported}
+    best = max(supported, key=lambda encoding: qualities[encoding])
+    return best if qualities[best] > 0 else None
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=HTTP_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=HTTP_GZIP_LEVEL)
+
+
+class HttpCacheMiddleware:
+    # Plain ASGI middleware. Adds the ETag set by check_etag to successful responses and compresses
+    # bodies sent in one message (the JSON responses). Streamed responses, like the exports, pass through
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = _pick_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                # Held until the first body message shows whether the response is sent in one piece
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=list(start.get("headers", [])))
+            etag = scope.get("state", {}).get("etag")
+            if etag and 200 <= start["status"] < 300 and "etag" not in headers:
+                headers["ETag"] = etag
+                headers["Cache-Control"] = TAGGED_CACHE_CONTROL
+
+            body = message.get("body", b"")
+            if (
+                0 < HTTP_COMPRESSION_MIN_BYTES <= len(body)
+                and not message.get("more_body", False)
+                and "content-encoding" not in headers
+                and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            ):
+                headers.add_vary_header("Accept-Encoding")
+                if encoding is not None:
+                    if len(body) >= COMPRESSION_THREAD_MIN_BYTES:
+                        body = await run_in_threadpool(_compress, body, encoding)
+                    else:
+                        body = _compress(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    message = {**message, "body": body}
+
+            await send({**start, "headers": headers.raw})
+            start = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,359 @@
+import asyncio
+import hashlib
+import io
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException, Request
+from PIL import Image, ImageOps
+from sqlalchemy import and_, or_, update
+from sqlmodel import select
+from loguru import logger
+from db.session import open_session
+from models.models import Announcement, AnnouncementImage
+from models.schemas import AnnouncementRead
+from api.cache import home_summary_cache
+from api.storage import storage
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Announcement images: streamed uploads, WebP variants made by a background worker and
+# content hashed URLs. Files are keyed by the SHA-256 of the original, and variants also by the
+# version of the settings they were made with, so a URL never changes meaning and can be cached
+# forever (see api/routers/images.py). Changing the settings makes the worker regenerate the variants
+# under new URLs.
+
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_PER_UPLOAD = int(os.getenv("IMAGE_MAX_PER_UPLOAD", "10"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+# Seconds after which the claim of a worker that died while resizing is taken over
+IMAGE_CLAIM_SECONDS = int(os.getenv("IMAGE_CLAIM_SECONDS", "600"))
+# Where clients fetch the files, a CDN in front of /images can be set here
+IMAGE_URL_PREFIX = os.getenv("IMAGE_URL_PREFIX", "/images").rstrip("/")
+
+# Variant name -> maximum width. Images are never upscaled
+VARIANTS = {
+    "thumb": int(os.getenv("IMAGE_THUMB_WIDTH", "320")),
+    "feed": int(os.getenv("IMAGE_FEED_WIDTH", "1080")),
+}
+
+# Bump when render_variants changes its output
+VARIANT_RENDER_REVISION = 1
+VARIANT_VERSION = hashlib.sha256(repr((VARIANT_RENDER_REVISION, sorted(VARIANTS.items()), IMAGE_WEBP_QUALITY)).encode()).hexdigest()[:8]
+
+MEDIA_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+
+# Columns of the announcement rows that get their images attached
+ANNOUNCEMENT_COLUMNS = [getattr(Announcement, name) for name in AnnouncementRead.model_fields if name != "images"]
+
+
+def sniff_extension(head: bytes):
+    # The type comes from the file signature, never from the client supplied content type
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def original_key(content_hash: str, extension: str) -> str:
+    return f"originals/{content_hash[:2]}/{content_hash}.{extension}"
+
+def variant_filename(name: str, version: Optional[str]) -> str:
+    # version None is the layout of the variants made before they were versioned
+    return f"{name}-{version}.webp" if version else f"{name}.webp"
+
+def variant_key(content_hash: str, name: str, version: Optional[str]) -> str:
+    return f"variants/{content_hash[:2]}/{content_hash}-{variant_filename(name, version)}"
+
+def image_urls(image: AnnouncementImage) -> dict:
+    # Variant URLs are None until the worker has generated them
+    ready = image.status == "ready"
+    base = f"{IMAGE_URL_PREFIX}/{image.content_hash}"
+    return {
+        "id": image.id,
+        "status": image.status,
+        "width": image.width,
+        "height": image.height,
+        "original": f"{base}/original.{image.extension}",
+        **{name: f"{base}/{variant_filename(name, image.variant_version)}" if ready else None for name in VARIANTS},
+    }
+
+async def attach_images(session, announcements) -> list:
+    # Announcement rows (selected with ANNOUNCEMENT_COLUMNS) to response dicts with their image URLs,
+    # one query for the whole page
+    images = defaultdict(list)
+    ids = [row.id for row in announcements]
+    if ids:
+        rows = (await session.exec(
+            select(AnnouncementImage)
+            .where(AnnouncementImage.announcement_id.in_(ids))
+            .order_by(AnnouncementImage.announcement_id, AnnouncementImage.position, AnnouncementImage.id)
+        )).all()
+        for image in rows:
+            images[image.announcement_id].append(image_urls(image))
+    return [
+        {**{column.key: getattr(row, column.key) for column in ANNOUNCEMENT_COLUMNS}, "images": images[row.id]}
+        for row in announcements
+    ]
+
+
+async def receive_images(request: Request) -> list:
+    # Reads a multipart/form-data body as it arrives and writes every file part to storage while
+    # hashing it, so memory stays flat whatever the file size. Returns one dict per stored file
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+
+    # The parser callbacks are synchronous, they only queue events that are handled after each write
+    events = []
+    header_field, header_value, headers = bytearray(), bytearray(), []
+
+    def on_header_end():
+        headers.append((bytes(header_field).lower(), bytes(header_value)))
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        events.append(("headers", dict(headers)))
+        headers.clear()
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_header_field": lambda data, start, end: header_field.extend(data[start:end]),
+        "on_header_value": lambda data, start, end: header_value.extend(data[start:end]),
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": lambda data, start, end: events.append(("data", bytes(data[start:end]))),
+        "on_part_end": lambda: events.append(("end", None)),
+    })
+
+    stored = []
+    current = None
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, value in events:
+                if kind == "headers":
+                    _, options = parse_options_header(value.get(b"content-disposition", b""))
+                    if b"filename" not in options:
+                        # Plain form fields are ignored
+                        current = None
+                        continue
+                    if len(stored) >= IMAGE_MAX_PER_UPLOAD:
+                        raise HTTPException(status_code=400, detail=f"At most {IMAGE_MAX_PER_UPLOAD} images per upload")
+                    current = {"upload": await storage.open_upload(), "hash": hashlib.sha256(), "size": 0, "head": b""}
+                elif kind == "data" and current is not None:
+                    current["size"] += len(value)
+                    if current["size"] > IMAGE_MAX_BYTES:
+                        raise HTTPException(status_code=413, detail=f"Images are limited to {IMAGE_MAX_BYTES} bytes")
+                    if len(current["head"]) < 16:
+                        current["head"] += value[:16]
+                    current["hash"].update(value)
+                    await current["upload"].write(value)
+                elif kind == "end" and current is not None:
+                    extension = sniff_extension(current["head"])
+                    if extension is None:
+                        raise HTTPException(status_code=415, detail="Only JPEG, PNG, GIF and WebP images are accepted")
+                    content_hash = current["hash"].hexdigest()
+                    await current["upload"].commit(original_key(content_hash, extension))
+                    stored.append({"content_hash": content_hash, "extension": extension, "size": current["size"]})
+                    current = None
+            events.clear()
+        parser.finalize()
+    except BaseException:
+        if current is not None:
+            await current["upload"].discard()
+        # The parts stored before the failure are not kept either
+        await discard_files(stored)
+        raise
+    if not stored:
+        raise HTTPException(status_code=400, detail="No image in the upload")
+    return stored
+
+async def release_files(session, files):
+    # Deletes the stored files of (content_hash, extension, variant_version) no announcement image
+    # uses anymore. Call after the rows are deleted and committed
+    for content_hash, extension, variant_version in files:
+        in_use = (await session.exec(
+            select(AnnouncementImage.id).where(AnnouncementImage.content_hash == content_hash).limit(1)
+        )).first()
+        if in_use is None:
+            await storage.delete(original_key(content_hash, extension))
+            for name in VARIANTS:
+                await storage.delete(variant_key(content_hash, name, variant_version))
+
+
+async def discard_files(files):
+    # Files written by receive_images that will get no row. Runs in its own short session, the
+    # request session holds no connection while an upload streams in
+    if not files:
+        return
+    try:
+        async with open_session() as session:
+            await release_files(session, {(file["content_hash"], file["extension"], None) for file in files})
+    except Exception:
+        logger.exception("Could not remove {} uploaded files", len(files))
+
+
+def needs_variants():
+    # Rows whose variants are missing or were made with other settings
+    return or_(
+        AnnouncementImage.status == "pending",
+        and_(
+            AnnouncementImage.status == "ready",
+            or_(AnnouncementImage.variant_version.is_(None), AnnouncementImage.variant_version != VARIANT_VERSION),
+        ),
+    )
+
+
+def render_variants(data: bytes):
+    # Runs in the worker threads, Pillow releases the GIL while resizing and encoding.
+    # Returns the original (width, height) and variant name -> WebP bytes
+    with Image.open(io.BytesIO(data)) as opened:
+        # Phone pictures are often stored rotated with an EXIF orientation
+        image = ImageOps.exif_transpose(opened)
+        size = image.size
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.mode in ("LA", "P", "PA") else "RGB")
+        variants = {}
+        for name, max_width in VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail((max_width, max_width * 4))
+            buffer = io.BytesIO()
+            variant.save(buffer, "WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+            variants[name] = buffer.getvalue()
+    return size, variants
+
+
+class ImageWorker:
+    # Generates the variants of uploaded originals off the request path. Jobs are content hashes,
+    # rows left pending by a restart, or made with older settings, are queued again on startup by
+    # every worker. The rows of a file are claimed before it is processed, so only one worker does it
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.queue = asyncio.Queue()
+        self.tasks = []
+        self.executor = None
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="images")
+        self.tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self._requeue_pending()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def enqueue(self, content_hash: str, extension: str):
+        self.queue.put_nowait((content_hash, extension))
+
+    async def _requeue_pending(self):
+        async with open_session() as session:
+            pending = (await session.exec(
+                select(AnnouncementImage.content_hash, AnnouncementImage.extension)
+                .where(needs_variants())
+                .distinct()
+            )).all()
+        for content_hash, extension in pending:
+            self.enqueue(content_hash, extension)
+        if pending:
+            logger.info("Queued {} pending images", len(pending))
+
+    async def _run(self):
+        while True:
+            content_hash, extension = await self.queue.get()
+            try:
+                await self.process(content_hash, extension)
+            except Exception:
+                logger.exception("Image {} could not be processed", content_hash)
+            finally:
+                self.queue.task_done()
+
+    async def _claim(self, content_hash: str, now: datetime) -> list:
+        # Conditional UPDATE: the rows still needing variants and not claimed by a live worker.
+        # Returns their (status, variant_version), empty when there is nothing to do here
+        async with open_session() as session:
+            claimed = (await session.exec(
+                update(AnnouncementImage)
+                .where(
+                    AnnouncementImage.content_hash == content_hash,
+                    needs_variants(),
+                    or_(
+                        AnnouncementImage.claimed_at.is_(None),
+                        AnnouncementImage.claimed_at < now - timedelta(seconds=IMAGE_CLAIM_SECONDS),
+                    ),
+                )
+                .values(claimed_at=now)
+                .returning(AnnouncementImage.status, AnnouncementImage.variant_version)
+            )).all()
+            await session.commit()
+        return claimed
+
+    async def process(self, content_hash: str, extension: str):
+        claimed = await self._claim(content_hash, datetime.utcnow())
+        if not claimed:
+            logger.debug("Image {} already processed or claimed", content_hash)
+            return
+        # Variants of older settings, deleted once the new ones are in place
+        outdated = {version for status, version in claimed if status == "ready"}
+
+        data = await storage.read(original_key(content_hash, extension))
+        width = height = None
+        try:
+            (width, height), variants = await asyncio.get_running_loop().run_in_executor(self.executor, render_variants, data)
+        except Exception as exc:
+            status = "failed"
+            self.failed += 1
+            logger.warning("Image {} is not a valid image: {}", content_hash, exc)
+        else:
+            for name, body in variants.items():
+                await storage.save(variant_key(content_hash, name, VARIANT_VERSION), body)
+            status = "ready"
+            self.processed += 1
+
+        async with open_session() as session:
+            if status == "ready":
+                # Rows of the same file added since the claim are ready too
+                await session.exec(
+                    update(AnnouncementImage)
+                    .where(AnnouncementImage.content_hash == content_hash, needs_variants())
+                    .values(status="ready", width=width, height=height, variant_version=VARIANT_VERSION)
+                )
+            else:
+                # Rows that were ready keep serving their older variants
+                await session.exec(
+                    update(AnnouncementImage)
+                    .where(AnnouncementImage.content_hash == content_hash, AnnouncementImage.status == "pending")
+                    .values(status="failed")
+                )
+            await session.exec(
+                update(AnnouncementImage).where(AnnouncementImage.content_hash == content_hash).values(claimed_at=None)
+            )
+            await session.commit()
+        if status == "ready":
+            for version in outdated:
+                for name in VARIANTS:
+                    await storage.delete(variant_key(content_hash, name, version))
+        # Summaries embed the image URLs
+        home_summary_cache.clear()
+        logger.info("Image {} processed: {}", content_hash, status)
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "processed": self.processed, "failed": self.failed, "workers": self.workers}
+
+
+image_worker = ImageWorker(IMAGE_WORKERS)
@@ -0,0 +1,92 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.models import User, Event, Class, UserEventLink, UserClassLink
+from models.schemas import EventRead, ClassRead, ParticipantRead, UserRead
+from api.responses import schema_columns, to_dicts
+
+# Per request loader, in the style of a dataloader: the lookups by id made by concurrent coroutines
+# in the same event loop turn are merged into one IN query per kind, and every key is fetched once
+# per request. The rosters of ten events are one query instead of ten event.participants loads.
+#
+# The session can only run one statement at a time, so the queries of the loader and of the callers
+# (holding loader.lock) take turns.
+
+Fetch = Callable[[AsyncSession, List[Hashable]], Awaitable[Dict[Hashable, Any]]]
+
+
+async def _rows_by_id(session: AsyncSession, model, schema, keys) -> dict:
+    rows = (await session.exec(select(*schema_columns(model, schema)).where(model.id.in_(keys)))).all()
+    return {row["id"]: row for row in to_dicts(rows, schema)}
+
+async def _roster(session: AsyncSession, link_key, link_user, schema, keys) -> dict:
+    rows = (await session.exec(
+        select(link_key.label("roster_key"), *schema_columns(User, schema))
+        .join(User, User.id == link_user)
+        .where(link_key.in_(keys))
+        .order_by(link_key, User.id)
+    )).all()
+    rosters = defaultdict(list)
+    for row in rows:
+        rosters[row.roster_key].append({name: getattr(row, name) for name in schema.model_fields})
+    # Every key gets a list, an empty roster is not a missing one
+    return {key: rosters[key] for key in keys}
+
+FETCHERS: Dict[str, Fetch] = {
+    "event": lambda session, keys: _rows_by_id(session, Event, EventRead, keys),
+    "class": lambda session, keys: _rows_by_id(session, Class, ClassRead, keys),
+    "event_participants": lambda session, keys: _roster(session, UserEventLink.event_id, UserEventLink.user_id, ParticipantRead, keys),
+    "class_students": lambda session, keys: _roster(session, UserClassLink.class_id, UserClassLink.user_id, UserRead, keys),
+}
+
+
+class Loader:
+    def __init__(self, session: AsyncSession, fetchers: Dict[str, Fetch] = FETCHERS):
+        self.session = session
+        self.fetchers = fetchers
+        # Held by whoever runs a statement on the session
+        self.lock = asyncio.Lock()
+        # kind -> key -> future, resolved ones are the per request cache
+        self._futures = defaultdict(dict)
+        # kind -> keys not dispatched yet
+        self._queued = defaultdict(list)
+        # One entry per IN query, (kind, number of keys)
+        self.batches = []
+
+    def load(self, kind: str, key: Hashable) -> Awaitable[Any]:
+        # The row (dict) or roster (list) of key, None when there is no such row
+        futures = self._futures[kind]
+        if key not in futures:
+            loop = asyncio.get_running_loop()
+            futures[key] = loop.create_future()
+            queued = self._queued[kind]
+            if not queued:
+                # Runs after the coroutines already scheduled in this turn, which queue their keys first
+                loop.create_task(self._dispatch(kind))
+            queued.append(key)
+        return asyncio.shield(futures[key])
+
+    async def load_many(self, kind: str, keys: List[Hashable]) -> List[Any]:
+        return list(await asyncio.gather(*(self.load(kind, key) for key in keys)))
+
+    async def _dispatch(self, kind: str):
+        async with self.lock:
+            keys = self._queued.pop(kind, [])
+            if not keys:
+                return
+            self.batches.append((kind, len(keys)))
+            try:
+                values = await self.fetchers[kind](self.session, keys)
+            except Exception as error:
+                values, failure = {}, error
+            else:
+                failure = None
+        futures = self._futures[kind]
+        for key in keys:
+            if failure is not None:
+                # Not cached, a later load tries again
+                futures.pop(key).set_exception(failure)
+            else:
+                futures[key].set_result(values.get(key))
@@ -0,0 +1,123 @@
+import os
+import random
+import sys
+import uuid
+from contextvars import ContextVar
+from loguru import logger
+
+# Logging setup of the API: one queued sink (a background thread does the I/O), JSON or text output,
+# a correlation id per request and level / sampling control per router.
+#
+#   LOG_LEVEL=INFO                           global minimum level
+#   LOG_FORMAT=json                          json or text
+#   LOG_ROUTER_LEVELS=home=WARNING,auth=DEBUG
+#   LOG_SAMPLE_RATES=home=0.01,events=0.1    fraction of the lines below WARNING that are kept
+#
+# Messages use loguru's "{}" arguments, so a line that is disabled or sampled out is never formatted.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_ENQUEUE = os.getenv("LOG_ENQUEUE", "true").lower() in ("1", "true", "yes")
+
+REQUEST_ID_HEADER = "x-request-id"
+
+request_id: ContextVar = ContextVar("request_id", default=None)
+
+
+def _parse_mapping(value: str) -> dict:
+    # "home=WARNING,events=0.1" -> {"home": "WARNING", "events": "0.1"}
+    pairs = (item.split("=", 1) for item in value.split(",") if "=" in item)
+    return {name.strip(): setting.strip() for name, setting in pairs}
+
+ROUTER_LEVELS = {name: logger.level(level.upper()).no for name, level in _parse_mapping(os.getenv("LOG_ROUTER_LEVELS", "")).items()}
+SAMPLE_RATES = {name: float(rate) for name, rate in _parse_mapping(os.getenv("LOG_SAMPLE_RATES", "")).items()}
+
+_WARNING = logger.level("WARNING").no
+
+
+class RouterLogger:
+    # Drop-in for loguru's logger in the routers. The level and the sampling decision are checked
+    # before anything reaches loguru, so a skipped line costs a comparison and, at most, one random()
+    def __init__(self, name: str):
+        self.name = name
+        self.min_level = ROUTER_LEVELS.get(name, logger.level(LOG_LEVEL).no)
+        self.sample_rate = SAMPLE_RATES.get(name, 1.0)
+
+    def _log(self, level: str, level_no: int, message: str, args, kwargs, exception: bool = False):
+        if level_no < self.min_level:
+            return
+        if level_no < _WARNING and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        # depth=2 so the record points at the route, not at this wrapper
+        logger.opt(depth=2, exception=exception).log(level, message, *args, **kwargs)
+
+    def debug(self, message, *args, **kwargs):
+        self._log("DEBUG", 10, message, args, kwargs)
+
+    def info(self, message, *args, **kwargs):
+        self._log("INFO", 20, message, args, kwargs)
+
+    def success(self, message, *args, **kwargs):
+        self._log("SUCCESS", 25, message, args, kwargs)
+
+    def warning(self, message, *args, **kwargs):
+        self._log("WARNING", 30, message, args, kwargs)
+
+    def error(self, message, *args, **kwargs):
+        self._log("ERROR", 40, message, args, kwargs)
+
+    def exception(self, message, *args, **kwargs):
+        self._log("ERROR", 40, message, args, kwargs, exception=True)
+
+
+def get_logger(name: str) -> RouterLogger:
+    return RouterLogger(name)
+
+def _add_request_id(record):
+    record["extra"]["request_id"] = request_id.get()
+
+def setup_logging():
+    # Replaces loguru's default synchronous stderr sink. Called once by api/main.py
+    logger.remove()
+    logger.configure(patcher=_add_request_id)
+    if LOG_FORMAT == "json":
+        logger.add(sys.stderr, level=LOG_LEVEL, serialize=True, enqueue=LOG_ENQUEUE, backtrace=False, diagnose=False)
+    else:
+        logger.add(
+            sys.stderr,
+            level=LOG_LEVEL,
+            enqueue=LOG_ENQUEUE,
+            backtrace=False,
+            diagnose=False,
+            format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {extra[request_id]} | {name}:{function}:{line} - {message}",
+        )
+
+async def flush_logging():
+    # Waits for the queued lines to be written, on shutdown
+    await logger.complete()
+
+
+class CorrelationIdMiddleware:
+    # Takes the X-Request-ID of the caller (or makes one), puts it on every log line of the request
+    # and returns it in the response
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = next((value for key, value in scope["headers"] if key == REQUEST_ID_HEADER.encode()), None)
+        current = incoming.decode("latin-1")[:128] if incoming else uuid.uuid4().hex
+        token = request_id.set(current)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (REQUEST_ID_HEADER.encode(), current.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
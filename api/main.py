@@ -1,15 +1,46 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from api.routers import home, events, classes, announcements, users, auth
-from db.session import init_db
+from fastapi.responses import ORJSONResponse
+from api.routers import home, events, classes, announcements, users, auth, admin, metrics, images, calendar, matches, standings, recovery, history, batch
+from api.metrics import QueryAccountingMiddleware
+from api.http_cache import HttpCacheMiddleware
+from api.admission import AdmissionMiddleware
+from api.log import setup_logging, flush_logging, CorrelationIdMiddleware
+from db.session import async_engine, replicas
+from db.replicas import PrimaryPinMiddleware
+from api import hashing
+from api.images import image_worker
+
+# Queued sink, JSON lines, per router levels and sampling (see api/log.py)
+setup_logging()
 
 app = FastAPI(
     title="Padel Club API",
     description="Backend for Padel Club Management App",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson encodes datetimes and floats natively and is several times faster than the stdlib json
+    default_response_class=ORJSONResponse
 )
 
-# Configure CORS
+# ETags of the read endpoints and gzip / brotli compression of large responses
+app.add_middleware(HttpCacheMiddleware)
+
+# Per lane concurrency limits, bounded queues and 503 shedding (see api/admission.py). Inside the
+# metrics middleware, so queueing time and shed requests show up in /metrics
+app.add_middleware(AdmissionMiddleware)
+
+# Read your writes across workers: the primary pin cookie of requests that wrote (see db/replicas.py)
+app.add_middleware(PrimaryPinMiddleware)
+
+# Statement count, database time and latency per route, served at /metrics
+app.add_middleware(QueryAccountingMiddleware)
+
+# Around the rest, so every log line of the request, including the query threshold warnings, carries its id
+app.add_middleware(CorrelationIdMiddleware)
+
+# Configure CORS. Added last so it is the outermost middleware: the 503s of admission control and the
+# 429s also get the CORS headers, and browsers can read them
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allows all origins
@@ -25,11 +56,33 @@ app.include_router(events.router)
 app.include_router(classes.router)
 app.include_router(announcements.router)
 app.include_router(users.router)
+app.include_router(admin.router)
+app.include_router(metrics.router)
+app.include_router(images.router)
+app.include_router(calendar.router)
+app.include_router(matches.router)
+app.include_router(standings.router)
+app.include_router(recovery.router)
+app.include_router(history.router)
+app.include_router(batch.router)
 
 @app.on_event("startup")
-def on_startup():
-    init_db()
-    # pass
+async def on_startup():
+    if replicas is not None:
+        # Marks replicas down when they fail or lag, and back up when they recover
+        app.state.replica_monitor = asyncio.create_task(replicas.monitor())
+    # Resizes uploaded announcement images in the background
+    image_worker.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if replicas is not None:
+        app.state.replica_monitor.cancel()
+    await image_worker.stop()
+    hashing.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
+    await flush_logging()
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,197 @@
+import os
+import time
+from collections import defaultdict
+from loguru import logger
+from db.queries import track_queries
+from db.pool import pool_status
+from api.cache import caches
+from api.admission import admission, rate_limiters
+
+# Per-route request metrics in Prometheus text format, and statement accounting per request.
+# Only touched from the event loop, so no locking
+
+# Adds X-DB-Queries to every response (statement count, time in the database, slowest statement, repeats)
+QUERY_DEBUG_HEADER = os.getenv("QUERY_DEBUG_HEADER", "false").lower() in ("1", "true", "yes")
+# A request is logged when it reaches any of these, 0 disables a check
+QUERY_COUNT_THRESHOLD = int(os.getenv("QUERY_COUNT_THRESHOLD", "20"))
+QUERY_TIME_THRESHOLD_MS = float(os.getenv("QUERY_TIME_THRESHOLD_MS", "200"))
+# Same statement executed this many times in one request: probably an N+1
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+# Upper bounds of the latency (seconds) and statements per request histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, float("inf"))
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+    def lines(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.buckets):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.statuses = defaultdict(int)
+        self.db_seconds = 0.0
+        self.slow_requests = 0
+        self.repeated_statements = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        # (method, route template) -> RouteMetrics
+        self.routes = defaultdict(RouteMetrics)
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats, flagged: bool, repeated: int):
+        metrics = self.routes[(method, route)]
+        metrics.latency.observe(seconds)
+        metrics.statements.observe(stats.count)
+        metrics.statuses[status] += 1
+        metrics.db_seconds += stats.total_time
+        metrics.slow_requests += flagged
+        metrics.repeated_statements += repeated
+
+    def render(self) -> str:
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        routes = sorted(self.routes.items())
+        labels = {key: f'method="{_escape(key[0])}",route="{_escape(key[1])}"' for key, _ in routes}
+
+        family("http_requests_total", "counter", "Requests by route and status code")
+        for key, metrics in routes:
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f'http_requests_total{{{labels[key]},status="{status}"}} {count}')
+        family("http_request_duration_seconds", "histogram", "Request latency by route")
+        for key, metrics in routes:
+            lines += metrics.latency.lines("http_request_duration_seconds", labels[key])
+        family("http_request_db_statements", "histogram", "SQL statements issued per request")
+        for key, metrics in routes:
+            lines += metrics.statements.lines("http_request_db_statements", labels[key])
+        family("http_request_db_seconds_total", "counter", "Time spent executing SQL statements")
+        for key, metrics in routes:
+            lines.append(f"http_request_db_seconds_total{{{labels[key]}}} {metrics.db_seconds}")
+        family("http_request_query_threshold_exceeded_total", "counter", "Requests over the statement count or time threshold")
+        for key, metrics in routes:
+            lines.append(f"http_request_query_threshold_exceeded_total{{{labels[key]}}} {metrics.slow_requests}")
+        family("http_request_repeated_statements_total", "counter", "Statements repeated past QUERY_REPEAT_THRESHOLD in one request (N+1)")
+        for key, metrics in routes:
+            lines.append(f"http_request_repeated_statements_total{{{labels[key]}}} {metrics.repeated_statements}")
+
+        pools = pool_status()
+        family("db_pool_checked_out", "gauge", "Connections in use")
+        for name, pool in pools.items():
+            lines.append(f'db_pool_checked_out{{pool="{name}"}} {pool["checked_out"]}')
+        family("db_pool_timeouts_total", "counter", "Checkouts that gave up waiting for a connection")
+        for name, pool in pools.items():
+            lines.append(f'db_pool_timeouts_total{{pool="{name}"}} {pool["timeouts"]}')
+
+        family("cache_lookups_total", "counter", "In-process cache lookups by result")
+        for name, cache in sorted(caches.items()):
+            lines.append(f'cache_lookups_total{{cache="{name}",result="hit"}} {cache.hits}')
+            lines.append(f'cache_lookups_total{{cache="{name}",result="miss"}} {cache.misses}')
+
+        lanes = sorted(admission.lanes.items())
+        family("admission_active_requests", "gauge", "Requests running per admission lane")
+        for name, lane in lanes:
+            lines.append(f'admission_active_requests{{lane="{name}"}} {lane.active}')
+        family("admission_queue_depth", "gauge", "Requests waiting for a slot per admission lane")
+        for name, lane in lanes:
+            lines.append(f'admission_queue_depth{{lane="{name}"}} {len(lane.waiting)}')
+        family("admission_shed_total", "counter", "Requests answered 503 by the admission control")
+        for name, lane in lanes:
+            lines.append(f'admission_shed_total{{lane="{name}",reason="queue_full"}} {lane.shed_full}')
+            lines.append(f'admission_shed_total{{lane="{name}",reason="deadline"}} {lane.shed_deadline}')
+        family("rate_limited_total", "counter", "Attempts rejected with 429 by the per user rate limits")
+        for name, limiter in sorted(rate_limiters.items()):
+            lines.append(f'rate_limited_total{{limiter="{name}"}} {limiter.limited}')
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def debug_header(stats) -> str:
+    repeated = stats.repeated(QUERY_REPEAT_THRESHOLD) if QUERY_REPEAT_THRESHOLD > 0 else []
+    return (
+        f"count={stats.count}; time_ms={stats.total_time * 1000:.3f}; "
+        f"slowest_ms={stats.slowest_time * 1000:.3f}; repeated={sum(count for _, count in repeated)}"
+    )
+
+def _check_thresholds(method: str, route: str, stats) -> tuple:
+    # Logs the request if it crosses a threshold, returns (over count or time threshold, repeated executions)
+    flagged = (0 < QUERY_COUNT_THRESHOLD <= stats.count) or (0 < QUERY_TIME_THRESHOLD_MS <= stats.total_time * 1000)
+    repeated = stats.repeated(QUERY_REPEAT_THRESHOLD) if QUERY_REPEAT_THRESHOLD > 0 else []
+    if flagged:
+        logger.warning(
+            "{} {}: {} statements, {:.1f} ms in the database, slowest {:.1f} ms: {}",
+            method, route, stats.count, stats.total_time * 1000, stats.slowest_time * 1000,
+            (stats.slowest_statement or "")[:300],
+        )
+    for statement, count in repeated[:3]:
+        logger.warning("{} {}: possible N+1, {} executions of: {}", method, route, count, statement[:300])
+    return flagged, sum(count for _, count in repeated)
+
+
+class QueryAccountingMiddleware:
+    # Plain ASGI middleware, so streamed responses are not buffered. The route template comes from
+    # the scope FastAPI fills in when it matches a route; the debug header is written when the response
+    # starts, for streamed exports it only counts the statements issued before the first chunk
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+        with track_queries() as stats:
+            async def send_with_stats(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    if QUERY_DEBUG_HEADER:
+                        headers = list(message.get("headers", []))
+                        headers.append((b"x-db-queries", debug_header(stats).encode()))
+                        message = {**message, "headers": headers}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_stats)
+            finally:
+                elapsed = time.perf_counter() - start
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                method = scope["method"]
+                flagged, repeated = _check_thresholds(method, route, stats)
+                registry.observe(method, route, status, elapsed, stats, flagged, repeated)
@@ -0,0 +1,62 @@
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Generic, List, Optional, Sequence, TypeVar
+from fastapi import HTTPException, Query
+from pydantic import BaseModel
+from sqlalchemy import tuple_
+
+# Keyset pagination: the cursor holds the sort key of the last row of the previous page, so every page
+# is an index range scan that starts where the previous one ended, whatever the depth
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+DEFAULT_PAGE_SIZE = min(100, MAX_PAGE_SIZE)
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    # Pass it back as ?cursor= to get the next page, None on the last page
+    next_cursor: Optional[str] = None
+
+
+def page_limit(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)) -> int:
+    return limit
+
+def encode_cursor(*values) -> str:
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    # types are the python types of the key columns, datetimes are parsed back from isoformat
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError("wrong cursor size")
+        return tuple(
+            datetime.fromisoformat(value) if kind is datetime else kind(value)
+            for kind, value in zip(types, payload)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def paginate(query, columns: Sequence, cursor: Optional[str], limit: int, descending: bool = False):
+    # Orders the query by the key columns, starts after the cursor and fetches one extra row
+    # to know whether there is a next page
+    if cursor:
+        after = decode_cursor(cursor, *(column.type.python_type for column in columns))
+        key = tuple_(*columns)
+        query = query.where(key < tuple_(*after) if descending else key > tuple_(*after))
+    order = [column.desc() if descending else column for column in columns]
+    return query.order_by(*order).limit(limit + 1)
+
+def make_page(rows: list, columns: Sequence, limit: int) -> dict:
+    # Builds the page from the limit + 1 rows returned by a paginated query
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(*(getattr(last, column.key) for column in columns))
+    return {"items": rows, "next_cursor": next_cursor}
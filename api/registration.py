@@ -0,0 +1,111 @@
+from typing import Iterable, Optional
+from sqlalchemy import delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.models import User, Event, Class, UserEventLink, UserClassLink
+from api.calendar import mark_feeds_stale
+
+# Registration runs as conditional UPDATEs on the participant counters, so the capacity check and
+# the increment are one statement and the row stays locked until the transaction ends.
+# Lock order is always event/class row, then user row, then link row.
+# None of these helpers commit, the caller owns the transaction.
+#
+# The counter updates run with track_changes=False: every registration would otherwise bump the
+# event / class change marker, one row all registrations queue on (db/changes.py). The users whose
+# schedule changed are marked with schedule_changed instead.
+
+async def claim_event_slot(session: AsyncSession, event_id: int) -> Optional[str]:
+    # Takes one slot if the event is not full. Returns the event name, or None if there was no slot
+    row = (await session.exec(
+        update(Event)
+        .where(Event.id == event_id, Event.participant_count < Event.max_slots)
+        .values(participant_count=Event.participant_count + 1)
+        .returning(Event.name)
+        .execution_options(track_changes=False)
+    )).first()
+    return row[0] if row else None
+
+async def claim_class_slot(session: AsyncSession, class_id: int) -> bool:
+    row = (await session.exec(
+        update(Class)
+        .where(Class.id == class_id, Class.student_count < Class.max_students)
+        .values(student_count=Class.student_count + 1)
+        .returning(Class.id)
+        .execution_options(track_changes=False)
+    )).first()
+    return row is not None
+
+async def take_recovery_credit(session: AsyncSession, user_id: int) -> Optional[int]:
+    # Spends one recovery credit. Returns the remaining credits, or None if the user had none
+    row = (await session.exec(
+        update(User)
+        .where(User.id == user_id, User.classes_to_recover > 0)
+        .values(classes_to_recover=User.classes_to_recover - 1)
+        .returning(User.classes_to_recover)
+    )).first()
+    return row[0] if row else None
+
+async def give_recovery_credit(session: AsyncSession, user_id: int) -> Optional[int]:
+    row = (await session.exec(
+        update(User)
+        .where(User.id == user_id)
+        .values(classes_to_recover=User.classes_to_recover + 1)
+        .returning(User.classes_to_recover)
+    )).first()
+    return row[0] if row else None
+
+async def add_link(session: AsyncSession, link) -> bool:
+    # Inserts a link row. Returns False if it already exists (the primary key rejects it),
+    # in that case the transaction is no longer usable and the caller must roll back
+    session.add(link)
+    try:
+        await session.flush()
+    except IntegrityError:
+        return False
+    return True
+
+async def release_event_slot(session: AsyncSession, user_id: int, event_id: int) -> bool:
+    # Removes the registration and frees its slot. Returns False if the user was not registered
+    removed = await session.exec(
+        delete(UserEventLink).where(UserEventLink.user_id == user_id, UserEventLink.event_id == event_id)
+    )
+    if removed.rowcount == 0:
+        return False
+    await session.exec(
+        update(Event).where(Event.id == event_id).values(participant_count=Event.participant_count - 1)
+        .execution_options(track_changes=False)
+    )
+    return True
+
+async def release_class_slot(session: AsyncSession, user_id: int, class_id: int) -> bool:
+    removed = await session.exec(
+        delete(UserClassLink).where(UserClassLink.user_id == user_id, UserClassLink.class_id == class_id)
+    )
+    if removed.rowcount == 0:
+        return False
+    await session.exec(
+        update(Class).where(Class.id == class_id).values(student_count=Class.student_count - 1)
+        .execution_options(track_changes=False)
+    )
+    return True
+
+async def schedule_changed(session: AsyncSession, user_ids: Iterable[int] = (), event_id: Optional[int] = None, class_id: Optional[int] = None):
+    # The events or classes of user_ids, or of the participants of event_id / class_id, changed: bumps
+    # their schedule_version, which the per user ETags are built from, and marks their calendar feeds
+    # stale. Call before the links are deleted and before commit
+    user_ids = list(user_ids)
+    conditions = []
+    if user_ids:
+        conditions.append(User.id.in_(user_ids))
+    if event_id is not None:
+        conditions.append(User.id.in_(select(UserEventLink.user_id).where(UserEventLink.event_id == event_id)))
+    if class_id is not None:
+        conditions.append(User.id.in_(select(UserClassLink.user_id).where(UserClassLink.class_id == class_id)))
+    if conditions:
+        await session.exec(update(User).where(or_(*conditions)).values(schedule_version=User.schedule_version + 1))
+    await mark_feeds_stale(session, user_ids, event_id=event_id, class_id=class_id)
+
+async def schedule_version(session: AsyncSession, user_id: int) -> Optional[int]:
+    # Part of the ETags of the responses built from the user's own registrations
+    return (await session.exec(select(User.schedule_version).where(User.id == user_id))).first()
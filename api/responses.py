@@ -0,0 +1,37 @@
+import os
+from typing import Any, Type
+from fastapi.responses import ORJSONResponse
+from sqlmodel import SQLModel
+
+# ORM rows read by the routers are trusted: their columns already have the right types.
+# When enabled, list and detail responses are built by picking the read schema fields and encoding
+# them with orjson directly, skipping the pydantic validation FastAPI runs against response_model
+TRUST_ORM_OUTPUT = os.getenv("RESPONSE_TRUST_ORM_OUTPUT", "true").lower() in ("1", "true", "yes")
+
+
+def schema_columns(model, schema: Type[SQLModel]) -> list:
+    # Columns of model that back the schema fields, so list queries load nothing else
+    return [getattr(model, name) for name in schema.model_fields]
+
+def to_dict(row: Any, schema: Type[SQLModel]) -> dict:
+    # Only the schema fields, without validation. Dicts are assumed to be already converted
+    if isinstance(row, dict):
+        return row
+    return {name: getattr(row, name) for name in schema.model_fields}
+
+def to_dicts(rows, schema: Type[SQLModel]) -> list:
+    fields = list(schema.model_fields)
+    return [row if isinstance(row, dict) else {name: getattr(row, name) for name in fields} for row in rows]
+
+def read_response(data: Any, schema: Type[SQLModel]):
+    # data is one ORM row, a list of rows or a page {"items": [...], "next_cursor": ...}
+    if not TRUST_ORM_OUTPUT:
+        # FastAPI validates and serializes it against the route response_model
+        return data
+    if isinstance(data, list):
+        content = to_dicts(data, schema)
+    elif isinstance(data, dict) and "items" in data:
+        content = {**data, "items": to_dicts(data["items"], schema)}
+    else:
+        content = to_dict(data, schema)
+    return ORJSONResponse(content)
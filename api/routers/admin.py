@@ -0,0 +1,40 @@
+from fastapi import APIRouter, Depends
+from db.pool import pool_status
+from db.session import replicas
+from api import hashing
+from api.cache import caches
+from api.images import image_worker
+from api.admission import admission, rate_limiters
+from api.security import get_admin_user, User
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+@router.get("/pool")
+async def get_pool_status(current_user: User = Depends(get_admin_user)):
+    # Checked out / idle connections, overflow in use, checkout wait histogram and connection churn
+    return pool_status()
+
+@router.get("/hashing")
+async def get_hashing_status(current_user: User = Depends(get_admin_user)):
+    # bcrypt timings per operation, to tune BCRYPT_ROUNDS against the login latency budget
+    return hashing.stats.snapshot()
+
+@router.get("/caches")
+async def get_cache_status(current_user: User = Depends(get_admin_user)):
+    # Size, hit/miss counters and evictions of the in-process caches of this worker
+    return {name: cache.stats() for name, cache in caches.items()}
+
+@router.get("/replicas")
+async def get_replica_status(current_user: User = Depends(get_admin_user)):
+    # Health and replication lag of the read replicas, empty when none are configured
+    return replicas.status() if replicas is not None else {}
+
+@router.get("/images")
+async def get_image_worker_status(current_user: User = Depends(get_admin_user)):
+    # Backlog and totals of the image resizing worker
+    return image_worker.stats()
+
+@router.get("/admission")
+async def get_admission_status(current_user: User = Depends(get_admin_user)):
+    # Active requests, queue depth and shed counts per lane, and the login / register rate limits
+    return {**admission.stats(), "rate_limits": {name: limiter.stats() for name, limiter in rate_limiters.items()}}
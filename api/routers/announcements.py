@@ -1,41 +1,141 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import delete, func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import List, Optional
 from db.session import get_session
-from models.models import Announcement
-from loguru import logger
+from models.models import Announcement, AnnouncementImage
+from models.schemas import AnnouncementRead, AnnouncementCreate, ImageRead
+from api.log import get_logger
 from api.security import get_current_user, get_admin_user, User
+from api.cache import home_summary_cache
+from api.pagination import Page, page_limit, paginate, make_page
+from api.responses import read_response
+from api.http_cache import check_etag
+from api.images import ANNOUNCEMENT_COLUMNS, VARIANT_VERSION, attach_images, discard_files, image_urls, image_worker, receive_images, release_files
 
 router = APIRouter(prefix="/announcements", tags=["announcements"])
+logger = get_logger("announcements")
 
-@router.get("", response_model=List[Announcement])
-def list_announcements(
-    session: Session = Depends(get_session), 
+ANNOUNCEMENT_PAGE_KEY = (Announcement.created_at, Announcement.id)
+# Image rows change when the worker finishes the variants
+ANNOUNCEMENT_TABLES = ("announcement", "announcementimage")
+
+@router.get("", response_model=Page[AnnouncementRead])
+async def list_announcements(
+    request: Request,
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
-    limit: int = 100
+    limit: int = Depends(page_limit),
+    cursor: Optional[str] = None
 ):
-    logger.info(f"Listing announcements with limit={limit}")
-    announcements = session.exec(select(Announcement).order_by(Announcement.created_at.desc()).limit(limit)).all()
-    logger.success(f"Retrieved {len(announcements)} announcements")
-    return announcements
-
-@router.post("")
-def create_announcement(announcement: Announcement, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Creating new announcement: {announcement.title}")
+    logger.info("Listing announcements with limit={}", limit)
+    await check_etag(request, session, ANNOUNCEMENT_TABLES, limit, cursor)
+    page = await announcements_page(session, limit, cursor)
+    logger.success("Retrieved {} announcements", len(page["items"]))
+    return read_response(page, AnnouncementRead)
+
+async def announcements_page(session: AsyncSession, limit: int, cursor: Optional[str]) -> dict:
+    # Newest first, also used by /batch
+    query = paginate(select(*ANNOUNCEMENT_COLUMNS), ANNOUNCEMENT_PAGE_KEY, cursor, limit, descending=True)
+    announcements = (await session.exec(query)).all()
+    page = make_page(announcements, ANNOUNCEMENT_PAGE_KEY, limit)
+    # Variant URLs of the images of the whole page in one query, instead of the raw bucket string
+    page["items"] = await attach_images(session, page["items"])
+    return page
+
+@router.post("", response_model=AnnouncementRead)
+async def create_announcement(announcement_data: AnnouncementCreate, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Creating new announcement: {}", announcement_data.title)
+    announcement = Announcement(
+        **announcement_data.model_dump(exclude={"author_id"}),
+        author_id=announcement_data.author_id or current_user.id,
+        images="",
+    )
     session.add(announcement)
-    session.commit()
-    session.refresh(announcement)
-    logger.success(f"Announcement created with ID: {announcement.id}")
-    return announcement
+    await session.commit()
+    await session.refresh(announcement)
+    # Every summary shows the latest announcements
+    home_summary_cache.clear()
+    logger.success("Announcement created with ID: {}", announcement.id)
+    return read_response((await attach_images(session, [announcement]))[0], AnnouncementRead)
+
+@router.post("/{announcement_id}/images", response_model=List[ImageRead])
+async def upload_images(announcement_id: int, request: Request, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    # multipart/form-data with one or more file parts, read as a stream (the body is not spooled first)
+    if not await session.get(Announcement, announcement_id):
+        raise HTTPException(status_code=404, detail="Announcement not found")
+    # Ends the transaction so no connection is held while the body streams in
+    await session.commit()
+    files = await receive_images(request)
+    logger.info("Received {} images for announcement {}", len(files), announcement_id)
+
+    # The rows are written in a short transaction. The announcement is locked, it may have been
+    # deleted during the upload
+    if (await session.exec(select(Announcement.id).where(Announcement.id == announcement_id).with_for_update())).first() is None:
+        await session.rollback()
+        await discard_files(files)
+        raise HTTPException(status_code=404, detail="Announcement not found")
+
+    # Files already processed with the current settings for another announcement are ready right away
+    hashes = list({file["content_hash"] for file in files})
+    processed = {
+        content_hash: (width, height)
+        for content_hash, width, height in (await session.exec(
+            select(AnnouncementImage.content_hash, AnnouncementImage.width, AnnouncementImage.height)
+            .where(
+                AnnouncementImage.content_hash.in_(hashes),
+                AnnouncementImage.status == "ready",
+                AnnouncementImage.variant_version == VARIANT_VERSION,
+            )
+        )).all()
+    }
+    position = (await session.exec(
+        select(func.coalesce(func.max(AnnouncementImage.position), -1)).where(AnnouncementImage.announcement_id == announcement_id)
+    )).one()
+    images = []
+    for file in files:
+        position += 1
+        width, height = processed.get(file["content_hash"], (None, None))
+        ready = file["content_hash"] in processed
+        images.append(AnnouncementImage(
+            announcement_id=announcement_id,
+            position=position,
+            status="ready" if ready else "pending",
+            variant_version=VARIANT_VERSION if ready else None,
+            width=width,
+            height=height,
+            **file,
+        ))
+    session.add_all(images)
+    await session.commit()
+
+    queued = set()
+    for image in images:
+        if image.status == "pending" and image.content_hash not in queued:
+            queued.add(image.content_hash)
+            image_worker.enqueue(image.content_hash, image.extension)
+    home_summary_cache.clear()
+    logger.success("Stored {} images for announcement {}, {} queued for resizing", len(images), announcement_id, len(queued))
+    return read_response([image_urls(image) for image in images], ImageRead)
 
 @router.delete("/{announcement_id}")
-def delete_announcement(announcement_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Attempting to delete announcement ID: {announcement_id}")
-    announcement = session.get(Announcement, announcement_id)
+async def delete_announcement(announcement_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Attempting to delete announcement ID: {}", announcement_id)
+    announcement = await session.get(Announcement, announcement_id)
     if not announcement:
-        logger.warning(f"Announcement ID {announcement_id} not found for deletion")
+        logger.warning("Announcement ID {} not found for deletion", announcement_id)
         raise HTTPException(status_code=404, detail="Announcement not found")
-    session.delete(announcement)
-    session.commit()
-    logger.success(f"Announcement ID {announcement_id} deleted successfully")
+    files = (await session.exec(
+        select(AnnouncementImage.content_hash, AnnouncementImage.extension, AnnouncementImage.variant_version)
+        .where(AnnouncementImage.announcement_id == announcement_id)
+        .distinct()
+    )).all()
+    await session.exec(delete(AnnouncementImage).where(AnnouncementImage.announcement_id == announcement_id))
+    await session.delete(announcement)
+    await session.commit()
+    # Files shared with other announcements are kept
+    await release_files(session, files)
+    home_summary_cache.clear()
+    logger.success("Announcement ID {} deleted successfully", announcement_id)
     return {"message": "Announcement deleted"}
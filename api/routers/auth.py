@@ -1,31 +1,48 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import timedelta
 from db.session import get_session
 from models.models import User
-from api.security import verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
-from loguru import logger
+from api.security import create_access_token, user_token_claims, ACCESS_TOKEN_EXPIRE_MINUTES
+from api.hashing import verify_password
+from api.log import get_logger
+from api.admission import login_rate_limit
 
 router = APIRouter(prefix="/auth", tags=["auth"])
+logger = get_logger("auth")
 
-@router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    logger.info(f"Login attempt for user: {form_data.username}")
-    user = session.exec(select(User).where(User.email == form_data.username)).first()
-    
-    if not user or not verify_password(form_data.password, user.hashed_password):
-        logger.warning(f"Invalid login credentials for user: {form_data.username}")
+# Attempts per account and client address are rate limited before any bcrypt work
+@router.post("/login", dependencies=[Depends(login_rate_limit)])
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_session)):
+    logger.info("Login attempt for user: {}", form_data.username)
+    user = (await session.exec(select(User).where(User.email == form_data.username))).first()
+
+    valid, new_hash = False, None
+    if user:
+        # bcrypt runs in the hashing process pool, a 503 is raised if its queue is full
+        valid, new_hash = await verify_password(form_data.password, user.hashed_password)
+
+    if not valid:
+        logger.warning("Invalid login credentials for user: {}", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    if new_hash:
+        # The stored hash was made with a different bcrypt cost
+        user.hashed_password = new_hash
+        session.add(user)
+        await session.commit()
+        logger.info("Password rehashed for user: {}", user.email)
+
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data=user_token_claims(user), expires_delta=access_token_expires
     )
-    
-    logger.success(f"Successful login for user: {user.email}")
+
+    logger.success("Successful login for user: {}", user.email)
     return {"access_token": access_token, "token_type": "bearer"}
@@ -0,0 +1,128 @@
+import asyncio
+import time
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.session import get_session
+from models.models import User
+from models.schemas import BatchQuery, BatchRequest, BatchResponse
+from api.log import get_logger
+from api.security import get_current_db_user
+from api.http_cache import etag_for
+from api.cache import catalog_window
+from api.registration import schedule_version
+from api.loader import Loader
+from api.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from api.routers.home import SUMMARY_TABLES, HOME_SUMMARY_ETAG_WINDOW_SECONDS, build_summary
+from api.routers.events import events_page
+from api.routers.classes import classes_page
+from api.routers.announcements import announcements_page
+
+router = APIRouter(prefix="/batch", tags=["batch"])
+logger = get_logger("batch")
+
+# The launch screen of the app in one round trip: the token is checked and the user loaded once, the
+# queries run concurrently and their lookups by id go through one Loader, so the rosters of several
+# events are one IN query. Each query gets its own status, a failing one does not fail the others.
+# The listings share the caches of their routes, under the same tags.
+
+
+def _limit(query: BatchQuery) -> int:
+    limit = DEFAULT_PAGE_SIZE if query.limit is None else query.limit
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=422, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+def _id(query: BatchQuery) -> int:
+    if query.id is None:
+        raise HTTPException(status_code=422, detail=f"{query.op} needs an id")
+    return query.id
+
+async def _home_summary(loader: Loader, user: User, query: BatchQuery):
+    async with loader.lock:
+        window = int(time.time()) // HOME_SUMMARY_ETAG_WINDOW_SECONDS
+        tag = await etag_for(loader.session, SUMMARY_TABLES, user.id, await schedule_version(loader.session, user.id), window)
+        return await build_summary(loader.session, user.id, tag)
+
+async def _events(loader: Loader, user: User, query: BatchQuery):
+    limit = _limit(query)
+    async with loader.lock:
+        tag = await etag_for(loader.session, ("event",), user.level, limit, query.cursor, catalog_window())
+        return await events_page(loader.session, user.level, limit, query.cursor, tag)
+
+async def _classes(loader: Loader, user: User, query: BatchQuery):
+    limit = _limit(query)
+    has_credits = user.classes_to_recover > 0
+    if not has_credits:
+        return {"items": [], "next_cursor": None}
+    async with loader.lock:
+        tag = await etag_for(loader.session, ("class",), user.level, has_credits, limit, query.cursor, catalog_window())
+        return await classes_page(loader.session, user.level, limit, query.cursor, tag)
+
+async def _announcements(loader: Loader, user: User, query: BatchQuery):
+    limit = _limit(query)
+    async with loader.lock:
+        return await announcements_page(loader.session, limit, query.cursor)
+
+async def _event(loader: Loader, user: User, query: BatchQuery):
+    event = await loader.load("event", _id(query))
+    if event is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return event
+
+async def _class(loader: Loader, user: User, query: BatchQuery):
+    lesson = await loader.load("class", _id(query))
+    if lesson is None:
+        raise HTTPException(status_code=404, detail="Class not found")
+    return lesson
+
+async def _event_participants(loader: Loader, user: User, query: BatchQuery):
+    # Same as /events/{id}/get_users
+    event_id = _id(query)
+    event, participants = await asyncio.gather(loader.load("event", event_id), loader.load("event_participants", event_id))
+    if event is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return participants
+
+async def _class_students(loader: Loader, user: User, query: BatchQuery):
+    # Same as /classes/{id}/class_users, admins only
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="The user does not have enough privileges")
+    class_id = _id(query)
+    lesson, students = await asyncio.gather(loader.load("class", class_id), loader.load("class_students", class_id))
+    if lesson is None:
+        raise HTTPException(status_code=404, detail="Class not found")
+    return students
+
+RESOLVERS = {
+    "home_summary": _home_summary,
+    "events": _events,
+    "classes": _classes,
+    "announcements": _announcements,
+    "event": _event,
+    "class": _class,
+    "event_participants": _event_participants,
+    "class_students": _class_students,
+}
+
+async def _run(loader: Loader, user: User, query: BatchQuery) -> dict:
+    try:
+        body = await RESOLVERS[query.op](loader, user, query)
+    except HTTPException as error:
+        return {"key": query.key, "status": error.status_code, "body": {"detail": error.detail}}
+    except Exception:
+        # A failed lookup reaches every query waiting on it, each of them gets its own 500
+        logger.exception("Batch query {} ({}) failed for user {}", query.key, query.op, user.id)
+        return {"key": query.key, "status": 500, "body": {"detail": "Internal server error"}}
+    return {"key": query.key, "status": 200, "body": body}
+
+@router.post("", response_model=BatchResponse)
+async def run_batch(batch: BatchRequest, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_db_user)):
+    loader = Loader(session)
+    results = await asyncio.gather(*(_run(loader, current_user, query) for query in batch.queries))
+    logger.info(
+        "Batch of {} queries for user {}, {} merged lookups: {}",
+        len(batch.queries), current_user.id, len(loader.batches), loader.batches,
+    )
+    # Plain dicts of trusted columns, encoded by orjson directly
+    return ORJSONResponse({"results": results})
@@ -0,0 +1,86 @@
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.session import get_session
+from models.models import CalendarFeed
+from api.log import get_logger
+from api.security import get_current_user, User
+from api.cache import calendar_token_cache, calendar_feed_cache
+from api.calendar import new_token, feed_entry, build_feed
+from api.registration import add_link
+
+router = APIRouter(prefix="/calendar", tags=["calendar"])
+logger = get_logger("calendar")
+
+# Calendar apps cannot send a bearer token, the feed URL carries a secret token instead
+FEED_CACHE_CONTROL = "private, max-age=300"
+
+def _feed_url(request: Request, token: str) -> dict:
+    return {"url": str(request.url_for("get_calendar_feed", token=token))}
+
+@router.get("/link")
+async def get_calendar_link(request: Request, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    # URL to subscribe to in a calendar app, created on first use
+    feed = await session.get(CalendarFeed, current_user.id)
+    if feed is None:
+        if await add_link(session, CalendarFeed(user_id=current_user.id, token=new_token())):
+            await session.commit()
+            logger.info("Calendar feed created for user {}", current_user.id)
+        else:
+            # Created by a concurrent request
+            await session.rollback()
+        feed = await session.get(CalendarFeed, current_user.id)
+    return _feed_url(request, feed.token)
+
+@router.post("/link/rotate")
+async def rotate_calendar_link(request: Request, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    # Invalidates the current URL, for a link that was shared by mistake. Other workers may accept
+    # the old token until their cache entry expires
+    feed = await session.get(CalendarFeed, current_user.id)
+    if feed is None:
+        raise HTTPException(status_code=404, detail="No calendar feed for this user")
+    calendar_token_cache.delete(feed.token)
+    feed.token = new_token()
+    session.add(feed)
+    await session.commit()
+    logger.success("Calendar link rotated for user {}", current_user.id)
+    return _feed_url(request, feed.token)
+
+@router.get("/{token}.ics", name="get_calendar_feed")
+async def get_calendar_feed(
+    token: str,
+    session: AsyncSession = Depends(get_session),
+    if_none_match: str = Header(None),
+    if_modified_since: str = Header(None),
+):
+    # Cached polls cost no query. Otherwise one lookup by token, plus the rebuild when the feed is stale
+    user_id = calendar_token_cache.get(token)
+    entry = calendar_feed_cache.get(user_id) if user_id is not None else None
+    if entry is None:
+        feed = (await session.exec(select(CalendarFeed).where(CalendarFeed.token == token))).first()
+        if feed is None:
+            raise HTTPException(status_code=404, detail="Calendar not found")
+        if feed.built_version < feed.version or feed.body is None:
+            entry = await build_feed(session, feed)
+            logger.info("Calendar feed of user {} rebuilt", feed.user_id)
+        else:
+            entry = feed_entry(feed)
+        calendar_token_cache.set(token, feed.user_id)
+        calendar_feed_cache.set(feed.user_id, entry)
+
+    etag = f'W/"{entry["etag"]}"'
+    last_modified = entry["last_modified"].replace(tzinfo=timezone.utc)
+    headers = {"ETag": etag, "Last-Modified": format_datetime(last_modified, usegmt=True), "Cache-Control": FEED_CACHE_CONTROL}
+    if if_none_match is not None:
+        # If-None-Match wins over If-Modified-Since when both are sent
+        if etag.removeprefix("W/") in {value.strip().removeprefix("W/") for value in if_none_match.split(",")}:
+            return Response(status_code=304, headers=headers)
+    elif if_modified_since is not None:
+        try:
+            if last_modified <= parsedate_to_datetime(if_modified_since):
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+    return Response(entry["body"], media_type="text/calendar; charset=utf-8", headers=headers)
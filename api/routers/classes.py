@@ -1,137 +1,325 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
+import os
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import delete, insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List, Optional
 from db.session import get_session
-from models.models import User, Class
-from loguru import logger
-from api.security import get_current_user, get_admin_user
+from models.models import User, Class, UserClassLink, ClassWaitlist
+from models.schemas import RecurringClasses, ClassRead, ClassCreate, ClassUpdate, UserRead
+from api.log import get_logger
+from api.security import get_current_user, get_current_db_user, get_admin_user
+from api.export import export_response, user_columns
+from api.pagination import Page, page_limit, paginate, make_page
+from api.registration import claim_class_slot, take_recovery_credit, give_recovery_credit, add_link, release_class_slot, schedule_changed
+from api.responses import read_response, schema_columns, to_dicts
+from api.cache import home_summary_cache, class_catalog_cache, calendar_feed_cache, catalog_window
+from api.http_cache import check_etag
+from api.admission import register_rate_limit
+from api.waitlist import join_class_waitlist, leave_class_waitlist, class_waitlist_position, promote_class_waitlist
 
 router = APIRouter(prefix="/classes", tags=["classes"])
+logger = get_logger("classes")
+
+# Upper bound of classes generated by one /classes/bulk call
+MAX_BULK_CLASSES = int(os.getenv("MAX_BULK_CLASSES", "5000"))
 
 # --- User Endpoints ---
 
-@router.get("", response_model=List[Class])
-def list_classes(
-    session: Session = Depends(get_session), 
-    current_user: User = Depends(get_current_user),
-    limit: int = 100
+CLASS_PAGE_KEY = (Class.schedule, Class.id)
+
+@router.get("", response_model=Page[ClassRead])
+async def list_classes(
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_db_user),
+    limit: int = Depends(page_limit),
+    cursor: Optional[str] = None
 ):
-    logger.info(f"Listing classes for user: {current_user.email}")
-    
-    if current_user.classes_to_recover <= 0:
-        logger.info(f"User {current_user.id} has no recovery classes available")
-        return []
+    logger.info("Listing classes for user: {}", current_user.email)
 
-    query = select(Class)
     level = current_user.level
-    if level is not None: 
+    has_credits = current_user.classes_to_recover > 0
+    tag = await check_etag(request, session, ("class",), level, has_credits, limit, cursor, catalog_window())
+
+    if not has_credits:
+        logger.info("User {} has no recovery classes available", current_user.id)
+        return {"items": [], "next_cursor": None}
+
+    page = await classes_page(session, level, limit, cursor, tag)
+    logger.success("Retrieved {} classes", len(page['items']))
+    return read_response(page, ClassRead)
+
+async def classes_page(session: AsyncSession, level: Optional[float], limit: int, cursor: Optional[str], tag: Optional[str]) -> dict:
+    # Also used by /batch. The listing only depends on the level, so users with the same level share
+    # it. Entries cached under an older tag are not served, as in events_page
+    cached = class_catalog_cache.get((level, limit, cursor))
+    if cached is not None and cached[0] == tag:
+        return cached[1]
+
+    query = select(*schema_columns(Class, ClassRead))
+    if level is not None:
         query = query.where(Class.level_required <= level)
-    
-    classes = session.exec(query.limit(limit)).all()
-    logger.success(f"Retrieved {len(classes)} classes")
-    return classes
-
-@router.post("/{class_id}/register")
-def register_for_class(class_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    logger.info(f"User {current_user.id} attempting to register for class {class_id}")
+
+    classes = (await session.exec(paginate(query, CLASS_PAGE_KEY, cursor, limit))).all()
+    page = make_page(classes, CLASS_PAGE_KEY, limit)
+    # Cached as plain dicts so no ORM instance outlives its session
+    page["items"] = to_dicts(page["items"], ClassRead)
+    class_catalog_cache.set((level, limit, cursor), (tag, page))
+    return page
+
+@router.post("/{class_id}/register", dependencies=[Depends(register_rate_limit)])
+async def register_for_class(class_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    logger.info("User {} attempting to register for class {}", current_user.id, class_id)
     user = current_user
-    lesson = session.get(Class, class_id)
-    
-    if not user or not lesson:
-        logger.warning(f"Registration failed: User {user_id} or Class {class_id} not found")
-        raise HTTPException(status_code=404, detail="User or Class not found")
-    
-    if user.classes_to_recover <= 0:
-        logger.warning(f"Registration failed: User {user_id} has no classes to recover")
-        raise HTTPException(status_code=400, detail="User has no classes to recover")
 
-    if len(lesson.students) >= lesson.max_students:
-        logger.warning(f"Registration failed: Class {class_id} is full")
+    # Slot, credit and link are taken in one transaction with conditional updates,
+    # any failed step rolls the whole registration back
+    if not await claim_class_slot(session, class_id):
+        await session.rollback()
+        if not await session.get(Class, class_id):
+            logger.warning("Registration failed: User {} or Class {} not found", user.id, class_id)
+            raise HTTPException(status_code=404, detail="User or Class not found")
+        logger.warning("Registration failed: Class {} is full", class_id)
         raise HTTPException(status_code=400, detail="Class is full")
-    
-    if lesson in user.classes:
-        logger.warning(f"Registration failed: User {user_id} is already registered for class {class_id}")
+
+    remaining_credits = await take_recovery_credit(session, user.id)
+    if remaining_credits is None:
+        await session.rollback()
+        logger.warning("Registration failed: User {} has no classes to recover", user.id)
+        raise HTTPException(status_code=400, detail="User has no classes to recover")
+
+    if not await add_link(session, UserClassLink(user_id=user.id, class_id=class_id)):
+        await session.rollback()
+        logger.warning("Registration failed: User {} is already registered for class {}", user.id, class_id)
         raise HTTPException(status_code=400, detail="User is already registered for this class")
 
-    else:
-        user.classes.append(lesson)
-        user.classes_to_recover -= 1
-        session.add(user)
-        session.commit()
-    
-    logger.success(f"User {user_id} registered for class {class_id}. Remaining credits: {user.classes_to_recover}")
-    return {"status": "success", "class": class_id, "remaining_credits": user.classes_to_recover}
+    await leave_class_waitlist(session, user.id, class_id)
+    await schedule_changed(session, [user.id])
+    await session.commit()
+    home_summary_cache.delete(user.id)
+    calendar_feed_cache.delete(user.id)
+    class_catalog_cache.clear()
+
+    logger.success("User {} registered for class {}. Remaining credits: {}", user.id, class_id, remaining_credits)
+    return {"status": "success", "class": class_id, "remaining_credits": remaining_credits}
 
 @router.delete("/{class_id}/unregister")
-def unregister_from_class(class_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    logger.info(f"User {current_user.id} attempting to unregister from class {class_id}")
+async def unregister_from_class(class_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    logger.info("User {} attempting to unregister from class {}", current_user.id, class_id)
     user = current_user
-    lesson = session.get(Class, class_id)
-    
-    if not user or not lesson:
-        logger.warning(f"Unregistration failed: User {user_id} or Class {class_id} not found")
+
+    if await release_class_slot(session, user.id, class_id):
+        new_credits = await give_recovery_credit(session, user.id)
+        # The freed slot goes to the next eligible user in the waitlist, in the same transaction
+        promoted = await promote_class_waitlist(session, class_id)
+        await schedule_changed(session, [user.id, *promoted])
+        await session.commit()
+        home_summary_cache.delete_many([user.id, *promoted])
+        calendar_feed_cache.delete_many([user.id, *promoted])
+        class_catalog_cache.clear()
+        if promoted:
+            logger.info("Promoted users {} from the waitlist of class {}", promoted, class_id)
+        logger.success("User {} unregistered from class {}. New credits: {}", user.id, class_id, new_credits)
+        return {"message": "Unregistered from class", "new_credits": new_credits}
+
+    if not await session.get(Class, class_id):
+        logger.warning("Unregistration failed: User {} or Class {} not found", user.id, class_id)
         raise HTTPException(status_code=404, detail="User or Class not found")
-    
-    if lesson in user.classes:
-        user.classes.remove(lesson)
-        user.classes_to_recover += 1
-        session.add(user)
-        session.commit()
-        logger.success(f"User {user_id} unregistered from class {class_id}. New credits: {user.classes_to_recover}")
-        return {"message": "Unregistered from class", "new_credits": user.classes_to_recover}
-    
-    logger.info(f"User {user_id} was not registered for class {class_id}")
+
+    logger.info("User {} was not registered for class {}", user.id, class_id)
     return {"message": "User was not registered for this class"}
 
+@router.post("/{class_id}/waitlist")
+async def join_waitlist(class_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    logger.info("User {} attempting to join the waitlist of class {}", current_user.id, class_id)
+    user = current_user
+    lesson = await session.get(Class, class_id)
+    if not lesson:
+        raise HTTPException(status_code=404, detail="Class not found")
+
+    if user.level is not None and user.level < lesson.level_required:
+        raise HTTPException(status_code=400, detail="User level is too low for this class")
+
+    if await session.get(UserClassLink, (user.id, class_id)):
+        raise HTTPException(status_code=400, detail="User is already registered for this class")
+
+    if not await join_class_waitlist(session, user.id, class_id):
+        await session.rollback()
+        raise HTTPException(status_code=400, detail="User is already in the waitlist for this class")
+
+    # If a slot is free and nobody eligible is ahead, the user is registered right away
+    promoted = await promote_class_waitlist(session, class_id)
+    await schedule_changed(session, promoted)
+    await session.commit()
+    home_summary_cache.delete_many(promoted)
+    calendar_feed_cache.delete_many(promoted)
+    if promoted:
+        class_catalog_cache.clear()
+
+    if user.id in promoted:
+        logger.success("User {} registered for class {} from the waitlist", user.id, class_id)
+        return {"status": "registered", "class": class_id}
+
+    position = await class_waitlist_position(session, user.id, class_id)
+    logger.success("User {} joined the waitlist of class {} at position {}", user.id, class_id, position['position'])
+    return {"status": "waiting", "class": class_id, **position}
+
+@router.get("/{class_id}/waitlist")
+async def get_waitlist_position(class_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    position = await class_waitlist_position(session, current_user.id, class_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="User is not in the waitlist for this class")
+    return position
+
+@router.delete("/{class_id}/waitlist")
+async def leave_waitlist(class_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    if not await leave_class_waitlist(session, current_user.id, class_id):
+        raise HTTPException(status_code=404, detail="User is not in the waitlist for this class")
+    await session.commit()
+    return {"message": "Left the waitlist"}
+
 # --- Admin Endpoints ---
 
-@router.post("/", response_model=Class)
-def create_class(lesson: Class, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
+@router.post("/", response_model=ClassRead)
+async def create_class(lesson_data: ClassCreate, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
     logger.info("Creating new class")
-    # Clear ID to let database handle it
-    lesson.id = None
+    lesson = Class(**lesson_data.model_dump())
     session.add(lesson)
-    session.commit()
-    session.refresh(lesson)
-    logger.success(f"Class created with ID: {lesson.id}")
-    return lesson
+    await session.commit()
+    await session.refresh(lesson)
+    class_catalog_cache.clear()
+    logger.success("Class created with ID: {}", lesson.id)
+    return read_response(lesson, ClassRead)
+
+@router.post("/bulk")
+async def create_recurring_classes(rule: RecurringClasses, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Generating classes for coach {} from {} to {}", rule.coach_id, rule.start_date, rule.end_date)
+    schedules = []
+    day = rule.start_date
+    while day <= rule.end_date:
+        if day.weekday() in rule.weekdays:
+            schedules.append(datetime.combine(day, rule.start_time))
+        day += timedelta(days=1)
+    if len(schedules) > MAX_BULK_CLASSES:
+        raise HTTPException(status_code=400, detail=f"The rule generates {len(schedules)} classes, the limit is {MAX_BULK_CLASSES}")
+
+    # Slots the coach already has are reported and skipped, so the same rule can be applied twice
+    existing = set((await session.exec(
+        select(Class.schedule).where(Class.coach_id == rule.coach_id, Class.schedule.in_(schedules))
+    )).all()) if schedules else set()
+    rows = [
+        {
+            "coach_id": rule.coach_id,
+            "schedule": schedule,
+            "level_required": rule.level_required,
+            "max_students": rule.max_students,
+            "student_count": 0,
+        }
+        for schedule in schedules if schedule not in existing
+    ]
+
+    # One batched INSERT for the whole season, in a single transaction
+    created = {}
+    if rows:
+        result = await session.exec(insert(Class).returning(Class.id, Class.schedule, sort_by_parameter_order=True), params=rows)
+        created = {schedule: class_id for class_id, schedule in result.all()}
+    await session.commit()
+    class_catalog_cache.clear()
+
+    results = [
+        {"schedule": schedule, "status": "created", "id": created[schedule]} if schedule in created
+        else {"schedule": schedule, "status": "skipped", "detail": "Coach already has a class at this time"}
+        for schedule in schedules
+    ]
+    logger.success("Created {} classes, skipped {}", len(created), len(schedules) - len(created))
+    return {"created": len(created), "skipped": len(schedules) - len(created), "results": results}
 
 @router.delete("/{class_id}")
-def delete_class(class_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Attempting to delete class ID: {class_id}")
-    lesson = session.get(Class, class_id)
+async def delete_class(class_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Attempting to delete class ID: {}", class_id)
+    lesson = await session.get(Class, class_id)
     if not lesson:
-        logger.warning(f"Class ID {class_id} not found for deletion")
+        logger.warning("Class ID {} not found for deletion", class_id)
         raise HTTPException(status_code=404, detail="Class not found")
-    session.delete(lesson)
-    session.commit()
-    logger.success(f"Class ID {class_id} deleted successfully")
+    # Remove the links explicitly instead of letting the ORM lazy load lesson.students
+    # Participants are read by schedule_changed, so before their links go
+    await schedule_changed(session, class_id=class_id)
+    await session.exec(delete(UserClassLink).where(UserClassLink.class_id == class_id))
+    await session.exec(delete(ClassWaitlist).where(ClassWaitlist.class_id == class_id))
+    await session.delete(lesson)
+    await session.commit()
+    # The class may be in anyone's summary
+    home_summary_cache.clear()
+    calendar_feed_cache.clear()
+    class_catalog_cache.clear()
+    logger.success("Class ID {} deleted successfully", class_id)
     return {"message": "Class deleted successfully"}
 
- 
-@router.patch("/{class_id}")
-def update_class(class_id: int, lesson_data: Class, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Attempting to update class ID: {class_id}")
-    db_lesson = session.get(Class, class_id)
+
+@router.patch("/{class_id}", response_model=ClassRead)
+async def update_class(class_id: int, lesson_data: ClassUpdate, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Attempting to update class ID: {}", class_id)
+    # Locked so a registration cannot take a slot between the max_students check and the commit
+    db_lesson = await session.get(Class, class_id, with_for_update=True)
     if not db_lesson:
-        logger.warning(f"Class ID {class_id} not found for update")
+        logger.warning("Class ID {} not found for update", class_id)
         raise HTTPException(status_code=404, detail="Class not found")
-    
+
     # Update fields from the class data
-    data = lesson_data.dict(exclude_unset=True)
+    data = lesson_data.model_dump(exclude_unset=True)
     for key, value in data.items():
-        if key != "id":
-            setattr(db_lesson, key, value)
-        
+        if key == "max_students" and db_lesson.student_count > value:
+            logger.warning("Class ID {} update failed: Class has too many students", class_id)
+            raise HTTPException(status_code=400, detail="Class has too many students")
+
+        setattr(db_lesson, key, value)
+
     session.add(db_lesson)
-    session.commit()
-    session.refresh(db_lesson)
-    logger.success(f"Class ID {class_id} updated successfully")
-    return db_lesson
-
-@router.get("/{class_id}/class_users",response_model=List[User])
-def get_class_users(class_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    lesson = session.get(Class, class_id)
+    if "max_students" in data or "level_required" in data:
+        # New slots (or a lower level requirement) can let waiting users in
+        await session.flush()
+        promoted = await promote_class_waitlist(session, class_id)
+        if promoted:
+            logger.info("Promoted users {} from the waitlist of class {}", promoted, class_id)
+    # Promoted users are participants by now
+    await schedule_changed(session, class_id=class_id)
+    await session.commit()
+    home_summary_cache.clear()
+    calendar_feed_cache.clear()
+    class_catalog_cache.clear()
+    await session.refresh(db_lesson)
+    logger.success("Class ID {} updated successfully", class_id)
+    return read_response(db_lesson, ClassRead)
+
+@router.get("/{class_id}/class_users",response_model=List[UserRead])
+async def get_class_users(class_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    lesson = await session.get(Class, class_id)
     if not lesson:
         raise HTTPException(status_code=404, detail="Class not found")
-    return lesson.students
\ No newline at end of file
+    students = await session.exec(
+        select(*schema_columns(User, UserRead))
+        .join(UserClassLink, UserClassLink.user_id == User.id)
+        .where(UserClassLink.class_id == class_id)
+    )
+    return read_response(students.all(), UserRead)
+
+@router.get("/{class_id}/export")
+async def export_students(
+    class_id: int,
+    format: str = "csv",
+    columns: Optional[str] = None,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_admin_user)
+):
+    if not await session.get(Class, class_id):
+        raise HTTPException(status_code=404, detail="Class not found")
+    logger.info("Exporting students of class {} as {}", class_id, format)
+    return export_response(
+        user_columns(columns),
+        UserClassLink.class_id == class_id,
+        f"class_{class_id}_students",
+        format,
+        join=(UserClassLink, UserClassLink.user_id == User.id),
+    )
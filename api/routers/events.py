@@ -1,79 +1,192 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import delete
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import List, Optional
 from db.session import get_session
-from models.models import User, Event
-from loguru import logger
+from models.models import User, Event, UserEventLink, EventWaitlist
+from models.schemas import EventRead, EventCreate, EventUpdate, ParticipantRead
+from api.log import get_logger
 from api.security import get_current_user, get_admin_user
+from api.export import export_response, user_columns
+from api.pagination import Page, page_limit, paginate, make_page
+from api.registration import claim_event_slot, add_link, release_event_slot, schedule_changed
+from api.responses import read_response, schema_columns, to_dicts
+from api.cache import home_summary_cache, event_catalog_cache, calendar_feed_cache, catalog_window
+from api.http_cache import check_etag
+from api.admission import register_rate_limit
+from api.waitlist import join_event_waitlist, leave_event_waitlist, event_waitlist_position, promote_event_waitlist
 
 router = APIRouter(prefix="/events", tags=["events"])
+logger = get_logger("events")
 
 # --- User Endpoints ---
 
-@router.get("", response_model=List[Event])
-def list_events(
-    session: Session = Depends(get_session), 
+EVENT_PAGE_KEY = (Event.date, Event.id)
+
+@router.get("", response_model=Page[EventRead])
+async def list_events(
+    request: Request,
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
-    limit: int = 100
+    limit: int = Depends(page_limit),
+    cursor: Optional[str] = None
 ):
-    logger.info(f"Listing events for user: {current_user.email}")
+    logger.info("Listing events for user: {}", current_user.email)
     level = current_user.level
-    query = select(Event)
+    # 304 before any listing work when the client copy is current
+    tag = await check_etag(request, session, ("event",), level, limit, cursor, catalog_window())
+    page = await events_page(session, level, limit, cursor, tag)
+    logger.success("Retrieved {} events", len(page['items']))
+    return read_response(page, EventRead)
+
+async def events_page(session: AsyncSession, level: Optional[float], limit: int, cursor: Optional[str], tag: Optional[str]) -> dict:
+    # Also used by /batch. The listing only depends on the level, so users with the same level share
+    # it. The tag is checked too, so a page cached before another worker's write is not served under
+    # the new tag
+    cached = event_catalog_cache.get((level, limit, cursor))
+    if cached is not None and cached[0] == tag:
+        return cached[1]
+
+    query = select(*schema_columns(Event, EventRead))
     if level is not None:
         query = query.where(Event.min_level <= level)
-    
-    events = session.exec(query.limit(limit)).all()
-    logger.success(f"Retrieved {len(events)} events")
-    return events
-
-@router.post("/{event_id}/register")
-def register_for_event(event_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    logger.info(f"User {current_user.id} attempting to register for event {event_id}")
+
+    events = (await session.exec(paginate(query, EVENT_PAGE_KEY, cursor, limit))).all()
+    page = make_page(events, EVENT_PAGE_KEY, limit)
+    # Cached as plain dicts so no ORM instance outlives its session
+    page["items"] = to_dicts(page["items"], EventRead)
+    event_catalog_cache.set((level, limit, cursor), (tag, page))
+    return page
+
+@router.post("/{event_id}/register", dependencies=[Depends(register_rate_limit)])
+async def register_for_event(event_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    logger.info("User {} attempting to register for event {}", current_user.id, event_id)
     user = current_user
-    event = session.get(Event, event_id)
-    
-    if not user or not event:
-        logger.warning(f"Registration failed: User {user_id} or Event {event_id} not found")
-        raise HTTPException(status_code=404, detail="User or Event not found")
-    
-    if len(event.participants) >= event.max_slots:
-        logger.warning(f"Registration failed: Event {event_id} is full")
+
+    # Capacity check and slot increment in one statement, the event row stays locked until commit
+    event_name = await claim_event_slot(session, event_id)
+    if event_name is None:
+        await session.rollback()
+        if not await session.get(Event, event_id):
+            logger.warning("Registration failed: User {} or Event {} not found", user.id, event_id)
+            raise HTTPException(status_code=404, detail="User or Event not found")
+        logger.warning("Registration failed: Event {} is full", event_id)
         raise HTTPException(status_code=400, detail="Event is full")
-    
-    if event in user.events:
-        logger.info(f"User {user_id} already registered for event {event_id}")
+
+    if not await add_link(session, UserEventLink(user_id=user.id, event_id=event_id)):
+        await session.rollback()
+        logger.info("User {} already registered for event {}", user.id, event_id)
         raise HTTPException(status_code=400, detail="User is already registered for this event")
-        
-    user.events.append(event)
-    session.add(user)
-    session.commit()
-    
-    logger.success(f"User {user_id} registered for event {event_id} ({event.name})")
-    return {"status": "success", "event": event.name}
+
+    await leave_event_waitlist(session, user.id, event_id)
+    await schedule_changed(session, [user.id])
+    await session.commit()
+    home_summary_cache.delete(user.id)
+    calendar_feed_cache.delete(user.id)
+    event_catalog_cache.clear()
+
+    logger.success("User {} registered for event {} ({})", user.id, event_id, event_name)
+    return {"status": "success", "event": event_name}
 
 @router.delete("/{event_id}/unregister")
-def unregister_from_event(event_id: int, user_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+async def unregister_from_event(event_id: int, user_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
     user = current_user
-    event = session.get(Event, event_id)
-    
-    if not user or not event:
-        raise HTTPException(status_code=404, detail="User or Event not found")
-    
-    if event in user.events:
-        user.events.remove(event)
-        session.add(user)
-        session.commit()
+
+    if await release_event_slot(session, user.id, event_id):
+        # The freed slot goes to the next user in the waitlist, in the same transaction
+        promoted = await promote_event_waitlist(session, event_id)
+        await schedule_changed(session, [user.id, *promoted])
+        await session.commit()
+        home_summary_cache.delete_many([user.id, *promoted])
+        calendar_feed_cache.delete_many([user.id, *promoted])
+        event_catalog_cache.clear()
+        if promoted:
+            logger.info("Promoted users {} from the waitlist of event {}", promoted, event_id)
         return {"message": "Unregistered from event"}
-    
+
+    if not await session.get(Event, event_id):
+        raise HTTPException(status_code=404, detail="User or Event not found")
+
     return {"message": "User was not registered for this event"}
 
 
-@router.get("/{event_id}/get_users", response_model=List[User])
-def get_users(event_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    event = session.get(Event, event_id)
+@router.get("/{event_id}/get_users", response_model=List[ParticipantRead])
+async def get_users(event_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    event = await session.get(Event, event_id)
     if not event:
             raise HTTPException(status_code=404, detail="Event not found")
-    return event.participants
+    participants = await session.exec(
+        select(*schema_columns(User, ParticipantRead))
+        .join(UserEventLink, UserEventLink.user_id == User.id)
+        .where(UserEventLink.event_id == event_id)
+    )
+    return read_response(participants.all(), ParticipantRead)
+
+@router.get("/{event_id}/export")
+async def export_participants(
+    event_id: int,
+    format: str = "csv",
+    columns: Optional[str] = None,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_admin_user)
+):
+    if not await session.get(Event, event_id):
+        raise HTTPException(status_code=404, detail="Event not found")
+    logger.info("Exporting participants of event {} as {}", event_id, format)
+    return export_response(
+        user_columns(columns),
+        UserEventLink.event_id == event_id,
+        f"event_{event_id}_participants",
+        format,
+        join=(UserEventLink, UserEventLink.user_id == User.id),
+    )
+
+@router.post("/{event_id}/waitlist")
+async def join_waitlist(event_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    logger.info("User {} attempting to join the waitlist of event {}", current_user.id, event_id)
+    user = current_user
+    event = await session.get(Event, event_id)
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+
+    if await session.get(UserEventLink, (user.id, event_id)):
+        raise HTTPException(status_code=400, detail="User is already registered for this event")
+
+    if not await join_event_waitlist(session, user.id, event_id):
+        await session.rollback()
+        raise HTTPException(status_code=400, detail="User is already in the waitlist for this event")
+
+    # If a slot is free and nobody is ahead, the user is registered right away
+    promoted = await promote_event_waitlist(session, event_id)
+    await schedule_changed(session, promoted)
+    await session.commit()
+    home_summary_cache.delete_many(promoted)
+    calendar_feed_cache.delete_many(promoted)
+    if promoted:
+        event_catalog_cache.clear()
+
+    if user.id in promoted:
+        logger.success("User {} registered for event {} from the waitlist", user.id, event_id)
+        return {"status": "registered", "event": event.name}
+
+    position = await event_waitlist_position(session, user.id, event_id)
+    logger.success("User {} joined the waitlist of event {} at position {}", user.id, event_id, position['position'])
+    return {"status": "waiting", "event": event.name, **position}
+
+@router.get("/{event_id}/waitlist")
+async def get_waitlist_position(event_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    position = await event_waitlist_position(session, current_user.id, event_id)
+    if position is None:
+        raise HTTPException(status_code=404, detail="User is not in the waitlist for this event")
+    return position
+
+@router.delete("/{event_id}/waitlist")
+async def leave_waitlist(event_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    if not await leave_event_waitlist(session, current_user.id, event_id):
+        raise HTTPException(status_code=404, detail="User is not in the waitlist for this event")
+    await session.commit()
+    return {"message": "Left the waitlist"}
 
 
 
@@ -82,52 +195,70 @@ def get_users(event_id: int, session: Session = Depends(get_session), current_us
 
 # --- Admin Endpoints ---
 
-@router.post("/", response_model=Event)
-def create_event(event: Event, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Creating new event: {event.name}")
-    event.id = None
+@router.post("/", response_model=EventRead)
+async def create_event(event_data: EventCreate, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Creating new event: {}", event_data.name)
+    event = Event(**event_data.model_dump())
     session.add(event)
-    session.commit()
-    session.refresh(event)
-    logger.success(f"Event created with ID: {event.id}")
-    return event
+    await session.commit()
+    await session.refresh(event)
+    event_catalog_cache.clear()
+    logger.success("Event created with ID: {}", event.id)
+    return read_response(event, EventRead)
 
 @router.delete("/{event_id}")
-def delete_event(event_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Attempting to delete event ID: {event_id}")
-    event = session.get(Event, event_id)
+async def delete_event(event_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Attempting to delete event ID: {}", event_id)
+    event = await session.get(Event, event_id)
     if not event:
-        logger.warning(f"Event ID {event_id} not found for deletion")
+        logger.warning("Event ID {} not found for deletion", event_id)
         raise HTTPException(status_code=404, detail="Event not found")
-    session.delete(event)
-    session.commit()
-    logger.success(f"Event ID {event_id} deleted successfully")
+    # Remove the links explicitly instead of letting the ORM lazy load event.participants
+    # Participants are read by schedule_changed, so before their links go
+    await schedule_changed(session, event_id=event_id)
+    await session.exec(delete(UserEventLink).where(UserEventLink.event_id == event_id))
+    await session.exec(delete(EventWaitlist).where(EventWaitlist.event_id == event_id))
+    await session.delete(event)
+    await session.commit()
+    # The event may be in anyone's summary
+    home_summary_cache.clear()
+    calendar_feed_cache.clear()
+    event_catalog_cache.clear()
+    logger.success("Event ID {} deleted successfully", event_id)
     return {"message": "Event deleted successfully"}
 
 
-@router.patch("/{event_id}")
-def update_event(event_id: int, event_data: Event, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Attempting to update event ID: {event_id}")
-    db_event = session.get(Event, event_id)
+@router.patch("/{event_id}", response_model=EventRead)
+async def update_event(event_id: int, event_data: EventUpdate, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Attempting to update event ID: {}", event_id)
+    # Locked so a registration cannot take a slot between the max_slots check and the commit
+    db_event = await session.get(Event, event_id, with_for_update=True)
     if not db_event:
-        session.close()
-        logger.warning(f"Event ID {event_id} not found for update")
+        logger.warning("Event ID {} not found for update", event_id)
         raise HTTPException(status_code=404, detail="Event not found")
-    
-    data = event_data.dict(exclude_unset=True)
+
+    data = event_data.model_dump(exclude_unset=True)
     for key, value in data.items():
         if key=='max_slots':
-            if len(db_event.participants) > value:
-                logger.warning(f"Event ID {event_id} update failed: Event has too many participants")
+            if db_event.participant_count > value:
+                logger.warning("Event ID {} update failed: Event has too many participants", event_id)
                 raise HTTPException(status_code=400, detail="Event has too many participants")
-                
-        if key != "id":
-            setattr(db_event, key, value)
-            
-    session.add(db_event)
-    session.commit()
-    session.refresh(db_event)
-    logger.success(f"Event ID {event_id} updated successfully")
-    return db_event
 
+        setattr(db_event, key, value)
 
+    session.add(db_event)
+    if "max_slots" in data:
+        # Raising max_slots hands the new slots to the waitlist
+        await session.flush()
+        promoted = await promote_event_waitlist(session, event_id)
+        if promoted:
+            logger.info("Promoted users {} from the waitlist of event {}", promoted, event_id)
+    # Promoted users are participants by now
+    await schedule_changed(session, event_id=event_id)
+    await session.commit()
+    home_summary_cache.clear()
+    calendar_feed_cache.clear()
+    event_catalog_cache.clear()
+    await session.refresh(db_event)
+    logger.success("Event ID {} updated successfully", event_id)
+    return read_response(db_event, EventRead)
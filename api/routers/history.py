@@ -0,0 +1,85 @@
+import os
+import time
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, Query, Request
+from sqlalchemy import String, cast, literal, null, union_all
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.session import get_session
+from models.models import (
+    User, Event, Class, UserEventLink, UserClassLink,
+    ArchivedEvent, ArchivedClass, ArchivedUserEventLink, ArchivedUserClassLink,
+)
+from models.schemas import HistoryEntry
+from api.log import get_logger
+from api.security import get_current_user
+from api.http_cache import check_etag
+from api.registration import schedule_version
+from api.pagination import Page, page_limit, paginate, make_page
+from api.responses import read_response
+
+router = APIRouter(prefix="/history", tags=["history"])
+logger = get_logger("history")
+
+# Past entries live in both the live and the archive tables (see db/archive.py). The user's own
+# registrations are covered by their schedule_version, archive runs by the archive markers
+HISTORY_TABLES = ("event", "class", "archivedevent", "archivedclass")
+# Entries join the history when they start, without any write, so the tag also changes every window
+HISTORY_ETAG_WINDOW_SECONDS = int(os.getenv("HISTORY_ETAG_WINDOW_SECONDS", "300"))
+
+
+def _history(user_id: int, now: datetime, kind: Optional[str]):
+    # Past events and classes of the user, live and archived, in one statement
+    parts = []
+    if kind in (None, "event"):
+        for model, link, archived in ((Event, UserEventLink, False), (ArchivedEvent, ArchivedUserEventLink, True)):
+            parts.append(
+                select(
+                    literal("event").label("kind"),
+                    model.id.label("id"),
+                    model.date.label("start"),
+                    model.name.label("name"),
+                    model.type.label("type"),
+                    model.min_level.label("level"),
+                    literal(archived).label("archived"),
+                )
+                .join(link, link.event_id == model.id)
+                .where(link.user_id == user_id, model.date < now)
+            )
+    if kind in (None, "class"):
+        for model, link, archived in ((Class, UserClassLink, False), (ArchivedClass, ArchivedUserClassLink, True)):
+            parts.append(
+                select(
+                    literal("class").label("kind"),
+                    model.id.label("id"),
+                    model.schedule.label("start"),
+                    cast(null(), String).label("name"),
+                    cast(null(), String).label("type"),
+                    model.level_required.label("level"),
+                    literal(archived).label("archived"),
+                )
+                .join(link, link.class_id == model.id)
+                .where(link.user_id == user_id, model.schedule < now)
+            )
+    return union_all(*parts).subquery()
+
+@router.get("", response_model=Page[HistoryEntry])
+async def get_history(
+    request: Request,
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+    kind: Optional[str] = Query(None, pattern="^(event|class)$"),
+    limit: int = Depends(page_limit),
+    cursor: Optional[str] = None,
+):
+    # Most recent first. Archived entries are only read here, the other routes see the live tables
+    window = int(time.time()) // HISTORY_ETAG_WINDOW_SECONDS
+    await check_etag(request, session, HISTORY_TABLES, current_user.id, await schedule_version(session, current_user.id), kind, limit, cursor, window)
+
+    entries = _history(current_user.id, datetime.utcnow(), kind)
+    page_key = (entries.c.start, entries.c.kind, entries.c.id)
+    rows = (await session.exec(paginate(select(*entries.c), page_key, cursor, limit, descending=True))).all()
+    page = make_page(rows, page_key, limit)
+    logger.info("Retrieved {} history entries for user {}", len(page["items"]), current_user.id)
+    return read_response(page, HistoryEntry)
@@ -1,30 +1,89 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
+import os
+import time
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from db.session import get_session
-from models.models import User, Announcement, Match
-from loguru import logger
+from models.models import User, Announcement, Match, Event, Class, UserEventLink, UserClassLink, UserTeamLink
+from api.log import get_logger
 from api.security import get_current_user
+from api.cache import home_summary_cache
+from api.registration import schedule_version
+from api.http_cache import check_etag
+from api.responses import schema_columns, to_dicts
+from models.schemas import EventRead, ClassRead, MatchRead
+from api.images import ANNOUNCEMENT_COLUMNS, attach_images
 
 router = APIRouter(prefix="/home", tags=["home"])
+logger = get_logger("home")
+
+# Shared tables the summary reads. The user's own registrations are covered by their schedule_version,
+# so another member registering does not change this user's tag
+SUMMARY_TABLES = ("announcement", "announcementimage", "event", "class", "match")
+# Events and classes leave the summary when they start, without any write, so the tag also
+# changes every window
+HOME_SUMMARY_ETAG_WINDOW_SECONDS = int(os.getenv("HOME_SUMMARY_ETAG_WINDOW_SECONDS", "60"))
 
 @router.get("/summary")
-def get_home_summary(session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    logger.info(f"Generating home summary for user ID: {current_user.id}")
+async def get_home_summary(request: Request, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    logger.info("Generating home summary for user ID: {}", current_user.id)
     user = current_user
 
+    window = int(time.time()) // HOME_SUMMARY_ETAG_WINDOW_SECONDS
+    tag = await check_etag(request, session, SUMMARY_TABLES, user.id, await schedule_version(session, user.id), window)
+
+    summary = await build_summary(session, user.id, tag)
+    logger.success("Home summary ready for user ID: {}", user.id)
+    # Plain dicts of trusted columns, encoded by orjson without another jsonable_encoder pass
+    return ORJSONResponse(summary)
+
+async def build_summary(session: AsyncSession, user_id: int, tag: Optional[str]) -> dict:
+    # Also used by /batch. Served from the cache while the tag is unchanged
+    cached = home_summary_cache.get(user_id)
+    if cached is not None and cached[0] == tag:
+        return cached[1]
+
+    now = datetime.utcnow()
+
     # 1. Club Announcements
-    announcements = session.exec(
-        select(Announcement).order_by(Announcement.created_at.desc()).limit(5)
-    ).all()
-    
-    # 2. Upcoming Events & Classes (from many-to-many relationships)
+    announcements = (await session.exec(
+        select(*ANNOUNCEMENT_COLUMNS).order_by(Announcement.created_at.desc()).limit(5)
+    )).all()
+
+    # 2. Upcoming Events & Classes, filtered, ordered and limited in SQL through the link tables
+    events = (await session.exec(
+        select(*schema_columns(Event, EventRead))
+        .join(UserEventLink, UserEventLink.event_id == Event.id)
+        .where(UserEventLink.user_id == user_id, Event.date >= now)
+        .order_by(Event.date, Event.id)
+        .limit(5)
+    )).all()
+    classes = (await session.exec(
+        select(*schema_columns(Class, ClassRead))
+        .join(UserClassLink, UserClassLink.class_id == Class.id)
+        .where(UserClassLink.user_id == user_id, Class.schedule >= now)
+        .order_by(Class.schedule, Class.id)
+        .limit(5)
+    )).all()
+
+    # 3. Latest results of the user's teams
+    results = (await session.exec(
+        select(*schema_columns(Match, MatchRead))
+        .join(UserTeamLink, UserTeamLink.team_id == Match.team_id)
+        .where(UserTeamLink.user_id == user_id)
+        .order_by(Match.date.desc())
+        .limit(3)
+    )).all()
+
+    # Cached as plain data so no ORM instance outlives its session
     summary = {
-        "announcements": announcements,
-        "upcoming_events": user.events[:5],
-        "upcoming_classes": user.classes[:5],
-        "recent_results": session.exec(
-            select(Match).where(Match.team_id.in_([t.id for t in user.teams])).order_by(Match.date.desc()).limit(3)
-        ).all()
+        "announcements": await attach_images(session, announcements),
+        "upcoming_events": to_dicts(events, EventRead),
+        "upcoming_classes": to_dicts(classes, ClassRead),
+        "recent_results": to_dicts(results, MatchRead),
     }
-    logger.success(f"Home summary generated for user ID: {user_id}")
+    home_summary_cache.set(user_id, (tag, summary))
     return summary
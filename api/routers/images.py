@@ -0,0 +1,72 @@
+import re
+from fastapi import APIRouter, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from api.images import MEDIA_TYPES, VARIANTS, original_key, variant_key
+from api.storage import storage
+
+router = APIRouter(prefix="/images", tags=["images"])
+
+# Public, the URLs are unguessable content hashes and the files never change, so clients and any
+# CDN in front can keep them forever. No database access on this path
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# Variants carry the version of the settings they were made with, the unversioned form is the older layout
+FILENAME_PATTERN = re.compile(r"^(?:original\.(?P<extension>jpg|png|gif|webp)|(?P<variant>[a-z]+)(?:-(?P<version>[0-9a-f]{8}))?\.webp)$")
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def _parse_range(value: str, size: int):
+    # Single "bytes=start-end" range to (start, end) included, None when it cannot be served.
+    # Multiple ranges are not supported, clients then fall back to the full file
+    match = RANGE_PATTERN.match(value.strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+@router.get("/{content_hash}/{filename}")
+async def get_image(
+    content_hash: str,
+    filename: str,
+    range_header: str = Header(None, alias="range"),
+    if_range: str = Header(None),
+    if_none_match: str = Header(None),
+):
+    match = FILENAME_PATTERN.match(filename)
+    if not HASH_PATTERN.match(content_hash) or not match or (match["variant"] and match["variant"] not in VARIANTS):
+        raise HTTPException(status_code=404, detail="Image not found")
+    if match["extension"]:
+        key, media_type = original_key(content_hash, match["extension"]), MEDIA_TYPES[match["extension"]]
+    else:
+        key, media_type = variant_key(content_hash, match["variant"], match["version"]), MEDIA_TYPES["webp"]
+
+    etag = f'"{content_hash}-{filename}"'
+    headers = {"Cache-Control": CACHE_CONTROL, "ETag": etag, "Accept-Ranges": "bytes"}
+    if if_none_match and etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+
+    size = await storage.size(key)
+    if size is None:
+        # Variants do not exist until the worker has processed the original
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    start, end = 0, size - 1
+    status_code = 200
+    # A stale If-Range means the client's partial copy is of another file: send it whole
+    if range_header and (if_range is None or if_range == etag):
+        requested = _parse_range(range_header, size)
+        if requested is None:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = requested
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(storage.iter_range(key, start, end), status_code=status_code, media_type=media_type, headers=headers)
@@ -0,0 +1,70 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.session import get_session
+from models.models import Match, Team
+from models.schemas import MatchRead, MatchCreate, MatchUpdate
+from api.log import get_logger
+from api.security import get_admin_user, User
+from api.responses import read_response
+from api.standings import parse_score, replace_result
+
+router = APIRouter(prefix="/matches", tags=["matches"])
+logger = get_logger("matches")
+
+# Recording, correcting or deleting a match updates its team standing in the same transaction
+
+def _parse(score):
+    if score is None:
+        return None
+    try:
+        return parse_score(score)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=f"Invalid score: {exc}")
+
+@router.post("/", response_model=MatchRead)
+async def record_match(match_data: MatchCreate, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Recording match of team {}", match_data.team_id)
+    result = _parse(match_data.score)
+    if not await session.get(Team, match_data.team_id):
+        raise HTTPException(status_code=404, detail="Team not found")
+    match = Match(**match_data.model_dump())
+    session.add(match)
+    await session.flush()
+    await replace_result(session, match.id, None, match.team_id, result)
+    await session.commit()
+    logger.success("Match {} recorded", match.id)
+    return read_response(match, MatchRead)
+
+@router.patch("/{match_id}", response_model=MatchRead)
+async def correct_match(match_id: int, match_data: MatchUpdate, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Correcting match {}", match_id)
+    # Locked so two corrections of the same match cannot both subtract its old result
+    match = await session.get(Match, match_id, with_for_update=True)
+    if not match:
+        raise HTTPException(status_code=404, detail="Match not found")
+
+    data = match_data.model_dump(exclude_unset=True)
+    old_team_id = match.team_id
+    if data.get("team_id") is not None and data["team_id"] != old_team_id and not await session.get(Team, data["team_id"]):
+        raise HTTPException(status_code=404, detail="Team not found")
+    for key, value in data.items():
+        setattr(match, key, value)
+    session.add(match)
+
+    if "score" in data or "team_id" in data:
+        await replace_result(session, match_id, old_team_id, match.team_id, _parse(match.score))
+    await session.commit()
+    logger.success("Match {} corrected", match_id)
+    return read_response(match, MatchRead)
+
+@router.delete("/{match_id}")
+async def delete_match(match_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Attempting to delete match {}", match_id)
+    match = await session.get(Match, match_id, with_for_update=True)
+    if not match:
+        raise HTTPException(status_code=404, detail="Match not found")
+    await replace_result(session, match_id, match.team_id, None, None)
+    await session.delete(match)
+    await session.commit()
+    logger.success("Match {} deleted", match_id)
+    return {"message": "Match deleted successfully"}
@@ -0,0 +1,17 @@
+import hmac
+import os
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from api.metrics import registry
+
+router = APIRouter(tags=["metrics"])
+
+# Bearer token the scraper must send, /metrics is open when unset
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(authorization: str = Header(None)):
+    if METRICS_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    # Prometheus text exposition format 0.0.4
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
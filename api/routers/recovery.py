@@ -0,0 +1,81 @@
+import time
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import delete
+from starlette.concurrency import run_in_threadpool
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db.session import get_session
+from models.models import RecoveryWindow
+from models.schemas import RecoveryPreferences, RecoveryAllocation
+from api.log import get_logger
+from api.security import get_current_user, get_admin_user, User
+from api.cache import home_summary_cache, class_catalog_cache, calendar_feed_cache
+from api.registration import schedule_changed
+from api.allocation import load_candidates, plan_allocation, allocation_report, revalidate_allocation, write_allocation
+
+router = APIRouter(prefix="/recovery", tags=["recovery"])
+logger = get_logger("recovery")
+
+WINDOW_FIELDS = ("weekday", "start_time", "end_time", "max_level_gap")
+
+
+async def _windows(session: AsyncSession, user_id: int) -> dict:
+    rows = (await session.exec(
+        select(*(getattr(RecoveryWindow, name) for name in WINDOW_FIELDS))
+        .where(RecoveryWindow.user_id == user_id)
+        .order_by(RecoveryWindow.id)
+    )).all()
+    return {"windows": [dict(zip(WINDOW_FIELDS, row)) for row in rows]}
+
+@router.get("/preferences")
+async def get_recovery_preferences(session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    # When the user wants the classes of the batch allocation, no windows means any class
+    return await _windows(session, current_user.id)
+
+@router.put("/preferences")
+async def set_recovery_preferences(preferences: RecoveryPreferences, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    await session.exec(delete(RecoveryWindow).where(RecoveryWindow.user_id == current_user.id))
+    session.add_all([RecoveryWindow(user_id=current_user.id, **window.model_dump()) for window in preferences.windows])
+    await session.commit()
+    logger.info("User {} set {} recovery windows", current_user.id, len(preferences.windows))
+    return await _windows(session, current_user.id)
+
+@router.post("/allocate")
+async def allocate_recovery_classes(allocation: RecoveryAllocation, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    # Assigns the open slots of the classes in the period to the members with credits, as a whole.
+    # dry_run (the default) only returns the report. The plan runs on unlocked rows, then the classes
+    # and members it uses are locked and checked again, so the registration routes only wait for the
+    # write, never for the planner
+    start = allocation.start or datetime.utcnow()
+    if allocation.end is not None and allocation.end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    started = time.perf_counter()
+    members, classes, windows, links = await load_candidates(session, start, allocation.end)
+    # Ends the read transaction, nothing is held while planning
+    await session.rollback()
+    # CPU bound, kept off the event loop
+    assignments, dropped = await run_in_threadpool(plan_allocation, members, classes, windows, links)
+    planned = time.perf_counter() - started
+
+    if allocation.dry_run:
+        report = allocation_report(members, classes, assignments, dropped, allocation.include_assignments)
+    else:
+        planned_seats = sum(len(class_ids) for class_ids in assignments.values())
+        assignments = await revalidate_allocation(session, assignments)
+        report = allocation_report(members, classes, assignments, dropped, allocation.include_assignments)
+        # Assignments the registrations made since the plan invalidated
+        report["stale_assignments"] = planned_seats - report["assigned"]
+        await write_allocation(session, assignments)
+        await schedule_changed(session, assignments)
+        await session.commit()
+        home_summary_cache.delete_many(assignments)
+        calendar_feed_cache.delete_many(assignments)
+        class_catalog_cache.clear()
+        logger.success("Allocated {} recovery classes to {} members", report["assigned"], report["members_assigned"])
+    logger.info(
+        "Recovery allocation {}: {} members, {} open classes, planned in {:.2f}s",
+        "dry run" if allocation.dry_run else "applied", len(members), len(classes), planned,
+    )
+    return {"dry_run": allocation.dry_run, **report}
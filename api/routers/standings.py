@@ -0,0 +1,81 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import List
+from db.session import get_session
+from models.models import Match, MatchResult, Team, TeamStanding
+from models.schemas import StandingRead, FormEntry, TeamForm
+from api.log import get_logger
+from api.security import get_current_user, User
+from api.http_cache import check_etag
+from api.responses import read_response, to_dicts
+from api.standings import TOTAL_FIELDS, points_column, table_order
+
+router = APIRouter(prefix="/standings", tags=["standings"])
+logger = get_logger("standings")
+
+# Read side of the materialized standings, one indexed query per table
+
+@router.get("")
+async def list_competitions(request: Request, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    await check_etag(request, session, ("teamstanding",))
+    rows = (await session.exec(
+        select(TeamStanding.competition_name, func.count())
+        .where(TeamStanding.played > 0)
+        .group_by(TeamStanding.competition_name)
+        .order_by(TeamStanding.competition_name)
+    )).all()
+    return [{"competition_name": name, "teams": teams} for name, teams in rows]
+
+@router.get("/teams/{team_id}/form", response_model=TeamForm)
+async def get_team_form(
+    team_id: int,
+    request: Request,
+    limit: int = Query(5, ge=1, le=50),
+    session: AsyncSession = Depends(get_session),
+    current_user: User = Depends(get_current_user)
+):
+    await check_etag(request, session, ("match", "matchresult"), team_id, limit)
+    if not await session.get(Team, team_id):
+        raise HTTPException(status_code=404, detail="Team not found")
+    # Latest results through the (team_id, date) index of match
+    rows = (await session.exec(
+        select(
+            Match.id.label("match_id"),
+            Match.date,
+            Match.opponent_name,
+            Match.score,
+            MatchResult.won,
+            MatchResult.sets_won,
+            MatchResult.sets_lost,
+            MatchResult.games_won,
+            MatchResult.games_lost,
+        )
+        .join(MatchResult, MatchResult.match_id == Match.id)
+        .where(Match.team_id == team_id)
+        .order_by(Match.date.desc(), Match.id.desc())
+        .limit(limit)
+    )).all()
+    matches = to_dicts(rows, FormEntry)
+    return {"team_id": team_id, "form": "".join("W" if match["won"] else "L" for match in matches), "matches": matches}
+
+@router.get("/{competition_name}", response_model=List[StandingRead])
+async def get_league_table(competition_name: str, request: Request, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    logger.info("League table of {}", competition_name)
+    await check_etag(request, session, ("teamstanding",), competition_name)
+    rows = (await session.exec(
+        select(
+            TeamStanding.team_id,
+            Team.name.label("team_name"),
+            TeamStanding.competition_name,
+            *(getattr(TeamStanding, name) for name in TOTAL_FIELDS),
+            points_column().label("points"),
+        )
+        .join(Team, Team.id == TeamStanding.team_id)
+        .where(TeamStanding.competition_name == competition_name, TeamStanding.played > 0)
+        .order_by(*table_order())
+    )).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="Competition not found")
+    return read_response(rows, StandingRead)
@@ -1,93 +1,215 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session, select
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy import delete, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import Optional
 from db.session import get_session
-from models.models import User
-from loguru import logger
-from api.security import get_password_hash, get_admin_user, get_current_user
+from models.models import User, Event, Class, UserClassLink, UserEventLink, UserTeamLink, EventWaitlist, ClassWaitlist, CalendarFeed, RecoveryWindow, ArchivedUserEventLink, ArchivedUserClassLink
+from models.schemas import RecoveryCreditGrant, UserRead, UserCreate, UserUpdate
+from api.log import get_logger
+from api.hashing import hash_password
+from api.cache import home_summary_cache, event_catalog_cache, class_catalog_cache, calendar_feed_cache
+from api.registration import schedule_changed
+from api.waitlist import promote_event_waitlist, promote_class_waitlist
+from api.export import export_response, user_columns
+from api.pagination import Page, page_limit, paginate, make_page
+from api.responses import read_response, schema_columns
+from api.security import get_admin_user, get_current_user, bump_token_version, remember_token_version
 
 router = APIRouter(prefix="/users", tags=["users"])
+logger = get_logger("users")
 
-@router.get("", response_model=List[User])
-def list_users(
-    session: Session = Depends(get_session), 
+USER_PAGE_KEY = (User.id,)
+
+@router.get("", response_model=Page[UserRead])
+async def list_users(
+    session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_admin_user),
-    limit: int = 100
+    limit: int = Depends(page_limit),
+    cursor: Optional[str] = None
+):
+    logger.info("Listing users with limit={}", limit)
+    users = (await session.exec(paginate(select(*schema_columns(User, UserRead)), USER_PAGE_KEY, cursor, limit))).all()
+    logger.success("Retrieved {} users", len(users))
+    return read_response(make_page(users, USER_PAGE_KEY, limit), UserRead)
+
+@router.get("/export")
+async def export_users(
+    format: str = "csv",
+    columns: Optional[str] = None,
+    current_user: User = Depends(get_admin_user)
 ):
-    logger.info(f"Listing users with limit={limit}")
-    users = session.exec(select(User).limit(limit)).all()
-    logger.success(f"Retrieved {len(users)} users")
-    return users
-
-@router.get("/{user_id}", response_model=User)
-def get_user(user_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
-    logger.info(f"Fetching user ID: {user_id}")
-    user = session.get(User, user_id)
+    # Streams the member list through a server side cursor, memory stays flat whatever the row count
+    logger.info("Exporting users as {}", format)
+    return export_response(user_columns(columns), None, "users", format)
+
+@router.get("/{user_id}", response_model=UserRead)
+async def get_user(user_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_current_user)):
+    logger.info("Fetching user ID: {}", user_id)
+    user = await session.get(User, user_id)
     if not user:
-        logger.warning(f"User ID {user_id} not found")
+        logger.warning("User ID {} not found", user_id)
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    logger.success(f"User ID {user_id} retrieved")
-    return user
+    logger.success("User ID {} retrieved", user_id)
+    return read_response(user, UserRead)
 
-@router.post("", response_model=User, status_code=status.HTTP_201_CREATED)
-def create_user(user: User, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Attempting to create user with email: {user.email}")
+@router.post("", response_model=UserRead, status_code=status.HTTP_201_CREATED)
+async def create_user(user_data: UserCreate, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Attempting to create user with email: {}", user_data.email)
     # Check if email already exists
-    existing_user = session.exec(select(User).where(User.email == user.email)).first()
+    existing_user = (await session.exec(select(User.id).where(User.email == user_data.email))).first()
     if existing_user:
-        logger.warning(f"Create user failed: Email {user.email} already registered")
+        logger.warning("Create user failed: Email {} already registered", user_data.email)
         raise HTTPException(status_code=400, detail="Email already registered")
-    
-    user.id = None
-    # Use password as is from the User object (plain text at this point in the request)
-    user.hashed_password = get_password_hash(user.hashed_password)
+
+    user = User(
+        **user_data.model_dump(exclude={"password"}),
+        hashed_password=await hash_password(user_data.password),
+    )
     session.add(user)
-    session.commit()
-    session.refresh(user)
-    logger.success(f"User created with ID: {user.id}")
-    return user
-
-@router.patch("/{user_id}", response_model=User)
-def update_user(user_id: int, user_data: dict, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Attempting to update user ID: {user_id}")
-    db_user = session.get(User, user_id)
+    await session.commit()
+    await session.refresh(user)
+    logger.success("User created with ID: {}", user.id)
+    return read_response(user, UserRead)
+
+@router.patch("/{user_id}", response_model=UserRead)
+async def update_user(user_id: int, user_data: UserUpdate, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Attempting to update user ID: {}", user_id)
+    db_user = await session.get(User, user_id)
     if not db_user:
-        logger.warning(f"User ID {user_id} not found for update")
+        logger.warning("User ID {} not found for update", user_id)
         raise HTTPException(status_code=404, detail="User not found")
-    
-    for key, value in user_data.items():
-        if hasattr(db_user, key):
-            setattr(db_user, key, value)
-    
+
+    data = user_data.model_dump(exclude_unset=True)
+    if "password" in data:
+        db_user.hashed_password = await hash_password(data.pop("password"))
+    for key, value in data.items():
+        setattr(db_user, key, value)
+
+    bump_token_version(db_user)
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
-    logger.success(f"User ID {user_id} updated successfully")
-    return db_user
+    await session.commit()
+    await session.refresh(db_user)
+    remember_token_version(db_user.id, db_user.token_version)
+    logger.success("User ID {} updated successfully", user_id)
+    return read_response(db_user, UserRead)
 
 @router.delete("/{user_id}")
-def delete_user(user_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Attempting to delete user ID: {user_id}")
-    user = session.get(User, user_id)
+async def delete_user(user_id: int, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Attempting to delete user ID: {}", user_id)
+    user = await session.get(User, user_id)
     if not user:
-        logger.warning(f"User ID {user_id} not found for deletion")
+        logger.warning("User ID {} not found for deletion", user_id)
         raise HTTPException(status_code=404, detail="User not found")
-    session.delete(user)
-    session.commit()
-    logger.success(f"User ID {user_id} deleted successfully")
+    # Free the user's slots, then remove the links explicitly instead of letting the ORM lazy load the user relationships
+    event_ids = (await session.exec(select(UserEventLink.event_id).where(UserEventLink.user_id == user_id))).all()
+    class_ids = (await session.exec(select(UserClassLink.class_id).where(UserClassLink.user_id == user_id))).all()
+    if event_ids:
+        await session.exec(update(Event).where(Event.id.in_(event_ids)).values(participant_count=Event.participant_count - 1))
+    if class_ids:
+        await session.exec(update(Class).where(Class.id.in_(class_ids)).values(student_count=Class.student_count - 1))
+    for link_model in (
+        UserClassLink, UserEventLink, UserTeamLink, EventWaitlist, ClassWaitlist, CalendarFeed, RecoveryWindow,
+        ArchivedUserEventLink, ArchivedUserClassLink,
+    ):
+        await session.exec(delete(link_model).where(link_model.user_id == user_id))
+    await session.delete(user)
+    promoted = []
+    for event_id in sorted(event_ids):
+        promoted += await promote_event_waitlist(session, event_id)
+    for class_id in sorted(class_ids):
+        promoted += await promote_class_waitlist(session, class_id)
+    await schedule_changed(session, promoted)
+    await session.commit()
+    home_summary_cache.delete_many([user_id, *promoted])
+    calendar_feed_cache.delete_many([user_id, *promoted])
+    if event_ids:
+        event_catalog_cache.clear()
+    if class_ids:
+        class_catalog_cache.clear()
+    remember_token_version(user_id, None)
+    logger.success("User ID {} deleted successfully", user_id)
     return {"message": "User deleted successfully"}
 
 @router.post("/{user_id}/add_recovery_classes")
-def add_recovery_classes(user_id: int, amount: int, session: Session = Depends(get_session), current_user: User = Depends(get_admin_user)):
-    logger.info(f"Adding {amount} recovery classes to user ID: {user_id}")
-    user = session.get(User, user_id)
-    if not user:
-        logger.warning(f"User ID {user_id} not found for adding recovery classes")
+async def add_recovery_classes(user_id: int, amount: int = Query(gt=0), session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    logger.info("Adding {} recovery classes to user ID: {}", amount, user_id)
+    # Increment in the database, concurrent grants and registrations all count. Tokens are revoked
+    # like on any admin change of the user
+    updated = (await session.exec(
+        update(User)
+        .where(User.id == user_id)
+        .values(classes_to_recover=User.classes_to_recover + amount, token_version=User.token_version + 1)
+        .returning(User.token_version)
+    )).first()
+    if updated is None:
+        logger.warning("User ID {} not found for adding recovery classes", user_id)
         raise HTTPException(status_code=404, detail="User not found")
-    
-    user.classes_to_recover += amount
-    session.add(user)
-    session.commit()
-    session.refresh(user)
-    logger.success(f"Added {amount} classes to user {user_id}. New balance: {user.classes_to_recover}")
-    return {"status": "success", "new_balance": user.classes_to_recover}
+    await session.commit()
+    remember_token_version(user_id, updated.token_version)
+
+    # New credits can make the user eligible in the class waitlists they are in.
+    # Separate transaction, promotion locks the class row before the user row
+    waiting_for = (await session.exec(
+        select(ClassWaitlist.class_id).where(ClassWaitlist.user_id == user_id).order_by(ClassWaitlist.id)
+    )).all()
+    promoted = []
+    for class_id in waiting_for:
+        promoted += await promote_class_waitlist(session, class_id)
+    await schedule_changed(session, promoted)
+    await session.commit()
+    home_summary_cache.delete_many(promoted)
+    calendar_feed_cache.delete_many(promoted)
+    if promoted:
+        class_catalog_cache.clear()
+    # After the promotions, which spend credits
+    balance = (await session.exec(select(User.classes_to_recover).where(User.id == user_id))).first()
+    logger.success("Added {} classes to user {}. New balance: {}", amount, user_id, balance)
+    return {"status": "success", "new_balance": balance}
+
+@router.post("/bulk/add_recovery_classes")
+async def grant_recovery_classes(grant: RecoveryCreditGrant, session: AsyncSession = Depends(get_session), current_user: User = Depends(get_admin_user)):
+    target = f"{len(grant.user_ids)} users" if grant.user_ids is not None else f"level {grant.level}"
+    logger.info("Adding {} recovery classes to {}", grant.amount, target)
+
+    # One set based UPDATE for every target user, tokens are revoked as in add_recovery_classes
+    condition = User.id.in_(grant.user_ids) if grant.user_ids is not None else User.level == grant.level
+    updated = (await session.exec(
+        update(User)
+        .where(condition)
+        .values(
+            classes_to_recover=User.classes_to_recover + grant.amount,
+            token_version=User.token_version + 1,
+        )
+        .returning(User.id, User.classes_to_recover, User.token_version)
+    )).all()
+    await session.commit()
+    for user_id, _, token_version in updated:
+        remember_token_version(user_id, token_version)
+
+    balances = {user_id: balance for user_id, balance, _ in updated}
+    requested = grant.user_ids if grant.user_ids is not None else sorted(balances)
+    results = [
+        {"user_id": user_id, "status": "success", "new_balance": balances[user_id]} if user_id in balances
+        else {"user_id": user_id, "status": "not_found"}
+        for user_id in requested
+    ]
+
+    # New credits can make these users eligible in class waitlists, promoted in a second transaction
+    # like in add_recovery_classes
+    promoted = []
+    if balances:
+        waiting_for = (await session.exec(
+            select(ClassWaitlist.class_id).distinct().where(ClassWaitlist.user_id.in_(list(balances))).order_by(ClassWaitlist.class_id)
+        )).all()
+        for class_id in waiting_for:
+            promoted += await promote_class_waitlist(session, class_id)
+        await schedule_changed(session, promoted)
+        await session.commit()
+    home_summary_cache.delete_many(promoted)
+    calendar_feed_cache.delete_many(promoted)
+    if promoted:
+        class_catalog_cache.clear()
+
+    logger.success("Added {} classes to {} users", grant.amount, len(balances))
+    return {"updated": len(balances), "not_found": len(requested) - len(balances), "results": results}
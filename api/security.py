@@ -2,12 +2,14 @@ import os
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlmodel import Session, select
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from db.session import get_session
 from models.models import User
+from api.hashing_worker import make_context
+from api.cache import token_version_cache
 from loguru import logger
 
 # Configuration
@@ -15,20 +17,34 @@ SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key-change-it-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 1 day
 
-#ALgorithm to hash passwords
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+#When enabled, the user is built from the token claims instead of being queried on every request
+AUTH_FAST_PATH = os.getenv("AUTH_FAST_PATH", "true").lower() in ("1", "true", "yes")
+
+#ALgorithm to hash passwords. The routes hash through api.hashing, which runs it in a process pool
+pwd_context = make_context()
 
 #This schema will specify the endpoints that in order to use the endpoint,
-#the request must include a token obtained from the auth/login endpoint 
+#the request must include a token obtained from the auth/login endpoint
 #
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
+
+class TokenUser(SQLModel):
+    #Lightweight user built from the token claims.
+    #It only has the fields the routes read, use get_current_db_user when the full row is needed
+    id: int
+    email: str
+    is_admin: bool = False
+    level: float
+    token_version: int = 0
+
+
 def verify_password(plain_password, hashed_password):
     #Method that hashes password to compare it with its stored hash
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    
+
     #Method that hashes password to store it in the database
     return pwd_context.hash(password)
 
@@ -45,11 +61,42 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+def user_token_claims(user: User) -> dict:
+    #Claims embedded in the access token so most requests do not need to load the user
+    return {
+        "sub": user.email,
+        "id": user.id,
+        "is_admin": user.is_admin,
+        "level": user.level,
+        "ver": user.token_version,
+    }
+
+def bump_token_version(user: User):
+    #Invalidates every token issued to the user. Call remember_token_version after the commit
+    user.token_version = (user.token_version or 0) + 1
+
+def remember_token_version(user_id: int, version: Optional[int]):
+    #Stores the committed version so this worker rejects stale tokens right away
+    token_version_cache.set(user_id, (version,))
+
+async def _current_token_version(user_id: int, session: AsyncSession) -> Optional[int]:
+    cached = token_version_cache.get(user_id)
+    if cached is not None:
+        return cached[0]
+    # Always read on the primary, a lagging replica would reject tokens issued after a version bump
+    version = (await session.exec(
+        select(User.token_version).where(User.id == user_id).execution_options(use_primary=True)
+    )).first()
+    token_version_cache.set(user_id, (version,))
+    return version
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_session)):
     #The flow is the following, the requests includes a token, which is decoded.
-    #From the decoding of the token, an email is obtained, which is used to query the database
+    #In fast path mode the user is built from the token claims, and the token version is checked
+    #against a cached copy of the stored one, so revoked tokens are still rejected.
+    #Otherwise (or for old tokens without claims) the email is used to query the database
     #If the user is not found, a 401 error is raised
-    
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -62,15 +109,42 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: Session
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
-    user = session.exec(select(User).where(User.email == email)).first()
+    #Read replica routing keeps the user on the primary right after they write (db/replicas.py)
+    request.state.user_id = payload.get("id")
+
+    if AUTH_FAST_PATH and payload.get("id") is not None and payload.get("ver") is not None:
+        version = await _current_token_version(payload["id"], session)
+        if version is None or version != payload["ver"]:
+            raise credentials_exception
+        return TokenUser(
+            id=payload["id"],
+            email=email,
+            is_admin=payload.get("is_admin", False),
+            level=payload.get("level"),
+            token_version=payload["ver"],
+        )
+
+    user = (await session.exec(select(User).where(User.email == email))).first()
     if user is None:
         raise credentials_exception
     return user
 
-async def get_admin_user(current_user: User = Depends(get_current_user)):
+async def get_current_db_user(current_user: TokenUser = Depends(get_current_user), session: AsyncSession = Depends(get_session)):
+    #Loads the full User row for routes that read fields or relationships not carried in the token
+    if isinstance(current_user, User):
+        return current_user
+    user = await session.get(User, current_user.id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+async def get_admin_user(current_user: TokenUser = Depends(get_current_user)):
     if not current_user.is_admin:
-        logger.warning(f"Unauthorized admin access attempt by user: {current_user.email}")
+        logger.warning("Unauthorized admin access attempt by user: {}", current_user.email)
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="The user does not have enough privileges"
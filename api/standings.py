@@ -0,0 +1,139 @@
+import os
+import re
+from typing import List, NamedTuple, Optional, Tuple
+from sqlalchemy import update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.models import Team, MatchResult, TeamStanding
+
+# Team standings. Match.score is parsed into a MatchResult row, and TeamStanding holds the sum of the
+# results of each team, changed by deltas when a match is recorded, corrected or deleted.
+# db/standings.py rebuilds both tables from the match history with the same parse_score and totals.
+#
+# Writers lock the match row, then the team rows in id order, then the standing rows. The team lock
+# also makes the "create the standing row if missing" step safe.
+
+# League points, applied when the table is read so changing them needs no recompute
+STANDINGS_WIN_POINTS = int(os.getenv("STANDINGS_WIN_POINTS", "3"))
+STANDINGS_LOSS_POINTS = int(os.getenv("STANDINGS_LOSS_POINTS", "0"))
+
+# "6-4", "7-6(5)" (tiebreak points are informative) or a match tiebreak "10-8" as deciding set
+_SET = re.compile(r"^(\d{1,2})-(\d{1,2})(?:\(\d{1,2}\))?$")
+
+TOTAL_FIELDS = ("played", "won", "lost", "sets_won", "sets_lost", "games_won", "games_lost")
+
+
+class ParsedScore(NamedTuple):
+    # From the side of the match's team
+    sets: Tuple[Tuple[int, int], ...]
+    won: bool
+    sets_won: int
+    sets_lost: int
+    games_won: int
+    games_lost: int
+
+
+def _valid_set(a: int, b: int) -> bool:
+    high, low = max(a, b), min(a, b)
+    return (high == 6 and low <= 4) or (high == 7 and low in (5, 6))
+
+def _valid_match_tiebreak(a: int, b: int) -> bool:
+    high, low = max(a, b), min(a, b)
+    return high >= 10 and high - low >= 2 and (high == 10 or high - low == 2)
+
+def parse_score(score: Optional[str]) -> ParsedScore:
+    # Best of three sets, separated by spaces or commas. Raises ValueError when the score is not a
+    # finished padel match. A match tiebreak counts as one game for its winner
+    tokens = [token for token in re.split(r"[,\s]+", (score or "").strip()) if token]
+    if not 2 <= len(tokens) <= 3:
+        raise ValueError("A score has two or three sets, e.g. '6-4 3-6 7-5'")
+    sets = []
+    for token in tokens:
+        match = _SET.match(token)
+        if not match:
+            raise ValueError(f"Invalid set '{token}'")
+        sets.append((int(match[1]), int(match[2])))
+
+    sets_won = sets_lost = games_won = games_lost = 0
+    for index, (a, b) in enumerate(sets):
+        if sets_won == 2 or sets_lost == 2:
+            raise ValueError("Sets after the match was decided")
+        deciding = index == 2
+        if _valid_set(a, b):
+            games_won += a
+            games_lost += b
+        elif deciding and _valid_match_tiebreak(a, b):
+            games_won += a > b
+            games_lost += b > a
+        else:
+            raise ValueError(f"Invalid set '{tokens[index]}'")
+        sets_won += a > b
+        sets_lost += b > a
+    if max(sets_won, sets_lost) != 2:
+        raise ValueError("The match is not finished")
+    return ParsedScore(tuple(sets), sets_won == 2, sets_won, sets_lost, games_won, games_lost)
+
+def totals(result: ParsedScore) -> dict:
+    # Contribution of one result to a TeamStanding row
+    return {
+        "played": 1,
+        "won": int(result.won),
+        "lost": int(not result.won),
+        "sets_won": result.sets_won,
+        "sets_lost": result.sets_lost,
+        "games_won": result.games_won,
+        "games_lost": result.games_lost,
+    }
+
+def _result_score(row: MatchResult) -> ParsedScore:
+    return ParsedScore((), row.won, row.sets_won, row.sets_lost, row.games_won, row.games_lost)
+
+def points_column():
+    return TeamStanding.won * STANDINGS_WIN_POINTS + TeamStanding.lost * STANDINGS_LOSS_POINTS
+
+def table_order() -> List:
+    # Points, then set difference, then game difference
+    return [
+        points_column().desc(),
+        (TeamStanding.sets_won - TeamStanding.sets_lost).desc(),
+        (TeamStanding.games_won - TeamStanding.games_lost).desc(),
+        TeamStanding.team_id,
+    ]
+
+
+async def lock_teams(session: AsyncSession, team_ids) -> dict:
+    # team id -> competition name, rows locked in id order
+    rows = (await session.exec(
+        select(Team.id, Team.competition_name).where(Team.id.in_(sorted(set(team_ids)))).order_by(Team.id).with_for_update()
+    )).all()
+    return {team_id: competition for team_id, competition in rows}
+
+async def _apply(session: AsyncSession, team_id: int, competition: str, delta: dict, sign: int):
+    values = {name: getattr(TeamStanding, name) + sign * delta[name] for name in TOTAL_FIELDS}
+    updated = await session.exec(update(TeamStanding).where(TeamStanding.team_id == team_id).values(**values))
+    if updated.rowcount == 0:
+        # First result of the team. The team row is locked, so nobody else inserts it meanwhile
+        session.add(TeamStanding(team_id=team_id, competition_name=competition, **{name: sign * delta[name] for name in TOTAL_FIELDS}))
+        await session.flush()
+
+async def replace_result(session: AsyncSession, match_id: int, old_team_id: Optional[int], new_team_id: Optional[int], result: Optional[ParsedScore]):
+    # Moves the standings from the stored result of the match (if any) to result (None removes it).
+    # The match row must be locked by the caller, which commits
+    old = await session.get(MatchResult, match_id)
+    teams = await lock_teams(session, [team_id for team_id in (old_team_id, new_team_id) if team_id is not None])
+    if old is not None and old_team_id in teams:
+        await _apply(session, old_team_id, teams[old_team_id], totals(_result_score(old)), -1)
+    if old is not None:
+        await session.delete(old)
+        await session.flush()
+    if result is not None and new_team_id in teams:
+        await _apply(session, new_team_id, teams[new_team_id], totals(result), 1)
+        session.add(MatchResult(
+            match_id=match_id,
+            won=result.won,
+            sets_won=result.sets_won,
+            sets_lost=result.sets_lost,
+            games_won=result.games_won,
+            games_lost=result.games_lost,
+        ))
+        await session.flush()
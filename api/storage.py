@@ -0,0 +1,154 @@
+import os
+import uuid
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Optional
+from starlette.concurrency import run_in_threadpool
+
+# Blob storage behind a small interface, so images can move to an object store without touching
+# the routes. Keys are relative paths like "originals/ab/abcdef....jpg".
+#
+#   IMAGE_STORAGE_BACKEND=local         only backend shipped, files under IMAGE_STORAGE_ROOT
+#   IMAGE_STORAGE_ROOT=media
+
+IMAGE_STORAGE_BACKEND = os.getenv("IMAGE_STORAGE_BACKEND", "local")
+IMAGE_STORAGE_ROOT = os.getenv("IMAGE_STORAGE_ROOT", "media")
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class Upload(ABC):
+    # A blob being written. commit() publishes it under its final key, discard() drops it
+    @abstractmethod
+    async def write(self, chunk: bytes):
+        ...
+
+    @abstractmethod
+    async def commit(self, key: str):
+        ...
+
+    @abstractmethod
+    async def discard(self):
+        ...
+
+
+class Storage(ABC):
+    # A backend missing any of these fails when it is constructed, not in the middle of an upload
+    @abstractmethod
+    async def open_upload(self) -> Upload:
+        ...
+
+    @abstractmethod
+    async def save(self, key: str, data: bytes):
+        ...
+
+    @abstractmethod
+    async def read(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    async def size(self, key: str) -> Optional[int]:
+        # None when the key does not exist
+        ...
+
+    @abstractmethod
+    def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        # Bytes start..end (both included)
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+
+class LocalUpload(Upload):
+    def __init__(self, storage: "LocalStorage", path: str):
+        self.storage = storage
+        self.path = path
+        self.file = open(path, "wb")
+
+    async def write(self, chunk: bytes):
+        await run_in_threadpool(self.file.write, chunk)
+
+    async def commit(self, key: str):
+        target = self.storage.path(key)
+
+        def publish():
+            self.file.close()
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Atomic, readers never see a partial file. Same key means same content, replacing is harmless
+            os.replace(self.path, target)
+
+        await run_in_threadpool(publish)
+
+    async def discard(self):
+        def remove():
+            self.file.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+        await run_in_threadpool(remove)
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.tmp = os.path.join(self.root, "tmp")
+
+    def path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    async def open_upload(self) -> Upload:
+        def create():
+            os.makedirs(self.tmp, exist_ok=True)
+            return LocalUpload(self, os.path.join(self.tmp, uuid.uuid4().hex))
+
+        return await run_in_threadpool(create)
+
+    async def save(self, key: str, data: bytes):
+        upload = await self.open_upload()
+        await upload.write(data)
+        await upload.commit(key)
+
+    async def read(self, key: str) -> bytes:
+        def read_file():
+            with open(self.path(key), "rb") as file:
+                return file.read()
+
+        return await run_in_threadpool(read_file)
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            return (await run_in_threadpool(os.stat, self.path(key))).st_size
+        except FileNotFoundError:
+            return None
+
+    async def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        file = await run_in_threadpool(open, self.path(key), "rb")
+        try:
+            await run_in_threadpool(file.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await run_in_threadpool(file.read, min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            await run_in_threadpool(file.close)
+
+    async def delete(self, key: str):
+        try:
+            await run_in_threadpool(os.remove, self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+def _make_storage() -> Storage:
+    if IMAGE_STORAGE_BACKEND == "local":
+        return LocalStorage(IMAGE_STORAGE_ROOT)
+    raise RuntimeError(f"Unknown IMAGE_STORAGE_BACKEND: {IMAGE_STORAGE_BACKEND}")
+
+storage = _make_storage()
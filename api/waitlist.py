@@ -0,0 +1,147 @@
+from typing import List, Optional
+from sqlalchemy import delete, exists, func, insert, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from models.models import User, Event, Class, UserEventLink, UserClassLink, EventWaitlist, ClassWaitlist
+from api.registration import add_link
+
+# Waitlists for full events and classes. Promotion takes the event/class row lock first, like the
+# registration helpers, so it is serialized with registrations and unregistrations of the same item.
+# None of these helpers commit, the caller owns the transaction. As in api/registration.py the counter
+# updates do not bump the change markers.
+
+async def join_event_waitlist(session: AsyncSession, user_id: int, event_id: int) -> bool:
+    # Returns False if the user is already waiting for this event
+    return await add_link(session, EventWaitlist(event_id=event_id, user_id=user_id))
+
+async def join_class_waitlist(session: AsyncSession, user_id: int, class_id: int) -> bool:
+    return await add_link(session, ClassWaitlist(class_id=class_id, user_id=user_id))
+
+async def leave_event_waitlist(session: AsyncSession, user_id: int, event_id: int) -> bool:
+    removed = await session.exec(
+        delete(EventWaitlist).where(EventWaitlist.event_id == event_id, EventWaitlist.user_id == user_id)
+    )
+    return removed.rowcount > 0
+
+async def leave_class_waitlist(session: AsyncSession, user_id: int, class_id: int) -> bool:
+    removed = await session.exec(
+        delete(ClassWaitlist).where(ClassWaitlist.class_id == class_id, ClassWaitlist.user_id == user_id)
+    )
+    return removed.rowcount > 0
+
+async def event_waitlist_position(session: AsyncSession, user_id: int, event_id: int) -> Optional[dict]:
+    # 1-based position of the user in the queue and the queue length, None if the user is not waiting
+    entry = (await session.exec(
+        select(EventWaitlist.id).where(EventWaitlist.event_id == event_id, EventWaitlist.user_id == user_id)
+    )).first()
+    if entry is None:
+        return None
+    position, waiting = (await session.exec(
+        select(
+            func.count().filter(EventWaitlist.id <= entry),
+            func.count(),
+        ).where(EventWaitlist.event_id == event_id)
+    )).one()
+    return {"position": position, "waiting": waiting}
+
+async def class_waitlist_position(session: AsyncSession, user_id: int, class_id: int) -> Optional[dict]:
+    entry = (await session.exec(
+        select(ClassWaitlist.id).where(ClassWaitlist.class_id == class_id, ClassWaitlist.user_id == user_id)
+    )).first()
+    if entry is None:
+        return None
+    position, waiting = (await session.exec(
+        select(
+            func.count().filter(ClassWaitlist.id <= entry),
+            func.count(),
+        ).where(ClassWaitlist.class_id == class_id)
+    )).one()
+    return {"position": position, "waiting": waiting}
+
+async def promote_event_waitlist(session: AsyncSession, event_id: int) -> List[int]:
+    # Fills the free slots of the event with the oldest waiting users. Returns the promoted user ids
+    free = (await session.exec(
+        select(Event.max_slots - Event.participant_count).where(Event.id == event_id).with_for_update()
+    )).first()
+    if not free or free <= 0:
+        return []
+
+    # Users that registered directly while waiting just leave the queue
+    await session.exec(
+        delete(EventWaitlist).where(
+            EventWaitlist.event_id == event_id,
+            exists().where(UserEventLink.event_id == event_id, UserEventLink.user_id == EventWaitlist.user_id),
+        )
+    )
+    user_ids = (await session.exec(
+        select(EventWaitlist.user_id).where(EventWaitlist.event_id == event_id).order_by(EventWaitlist.id).limit(free)
+    )).all()
+    if not user_ids:
+        return []
+
+    await session.exec(insert(UserEventLink), params=[{"user_id": user_id, "event_id": event_id} for user_id in user_ids])
+    await session.exec(
+        delete(EventWaitlist).where(EventWaitlist.event_id == event_id, EventWaitlist.user_id.in_(user_ids))
+    )
+    await session.exec(
+        update(Event).where(Event.id == event_id).values(participant_count=Event.participant_count + len(user_ids))
+        .execution_options(track_changes=False)
+    )
+    return list(user_ids)
+
+async def promote_class_waitlist(session: AsyncSession, class_id: int) -> List[int]:
+    # Same as promote_event_waitlist, but only users with the required level and a recovery credit
+    # are promoted. Users that do not qualify keep their place until they do
+    lesson = (await session.exec(
+        select(Class.max_students - Class.student_count, Class.level_required).where(Class.id == class_id).with_for_update()
+    )).first()
+    if not lesson or lesson[0] <= 0:
+        return []
+    free, level_required = lesson
+
+    await session.exec(
+        delete(ClassWaitlist).where(
+            ClassWaitlist.class_id == class_id,
+            exists().where(UserClassLink.class_id == class_id, UserClassLink.user_id == ClassWaitlist.user_id),
+        )
+    )
+    # Candidates are read unlocked and their credits taken with a conditional UPDATE. A candidate who
+    # spent their last credit in between is skipped, and the next qualifying users fill the slot
+    promoted, skipped = [], set()
+    while free > 0:
+        candidates = (await session.exec(
+            select(ClassWaitlist.user_id)
+            .join(User, User.id == ClassWaitlist.user_id)
+            .where(
+                ClassWaitlist.class_id == class_id,
+                ClassWaitlist.user_id.not_in(skipped),
+                User.level >= level_required,
+                User.classes_to_recover > 0,
+            )
+            .order_by(ClassWaitlist.id)
+            .limit(free)
+        )).all()
+        if not candidates:
+            break
+        user_ids = (await session.exec(
+            update(User)
+            .where(User.id.in_(candidates), User.classes_to_recover > 0)
+            .values(classes_to_recover=User.classes_to_recover - 1)
+            .returning(User.id)
+        )).scalars().all()
+        skipped.update(set(candidates) - set(user_ids))
+        if not user_ids:
+            continue
+        await session.exec(insert(UserClassLink), params=[{"user_id": user_id, "class_id": class_id} for user_id in user_ids])
+        await session.exec(
+            delete(ClassWaitlist).where(ClassWaitlist.class_id == class_id, ClassWaitlist.user_id.in_(user_ids))
+        )
+        promoted.extend(user_ids)
+        free -= len(user_ids)
+
+    if promoted:
+        await session.exec(
+            update(Class).where(Class.id == class_id).values(student_count=Class.student_count + len(promoted))
+            .execution_options(track_changes=False)
+        )
+    return promoted
@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+import httpx
+from loguru import logger
+from sqlalchemy import func
+from sqlmodel import Session, select
+from bench.stats import Recorder
+from bench.workloads import BenchContext, SCENARIOS, DEFAULT_SCENARIOS
+from db.seed import SEED_PASSWORD, seed
+from models.models import User, Event, Class
+
+# Load and latency benchmark of the API.
+#
+#   python -m bench.run --seed                      # migrate and seed an empty database, then run
+#   python -m bench.run --save-baseline             # run and store the result as the new baseline
+#   python -m bench.run                             # run and fail on a regression against the baseline
+#   python -m bench.run --url http://localhost:8000 # drive a running server instead of the app in process
+#
+# The database comes from the usual DATABASE_* variables. In process, the SQL statements of every request
+# are counted through db/queries.py; against a server they are read from the X-DB-Queries header
+# when the server runs with QUERY_DEBUG_HEADER=true.
+# Every run is written to bench/results/, the baseline is bench/baseline.json.
+
+BENCH_DIR = Path(__file__).resolve().parent
+RESULTS_DIR = BENCH_DIR / "results"
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+
+# Volumes of a large club over a few seasons, --scale shrinks them for quick SQLite runs
+VOLUMES = {
+    "users": 50000,
+    "events": 5000,
+    "classes": 5000,
+    "teams": 500,
+    "matches": 50000,
+    "announcements": 20000,
+    "events_per_user": 10,
+    "classes_per_user": 10,
+    "years": 3,
+}
+
+
+def seed_database(engine, scale: float):
+    from db.session import init_db
+    init_db()
+    with Session(engine) as session:
+        if session.exec(select(func.count()).select_from(User)).one():
+            logger.info("The database already has data, seeding skipped")
+            return
+    volumes = {
+        key: value if key in ("events_per_user", "classes_per_user", "years") else max(1, int(value * scale))
+        for key, value in VOLUMES.items()
+    }
+    logger.info("Seeding {}", volumes)
+    seed(engine, **volumes)
+
+def load_fixture(engine, members: int, hot: int) -> dict:
+    # Ids the workloads pick from, read straight from the database
+    with Session(engine) as session:
+        admin_email = session.exec(select(User.email).where(User.is_admin).order_by(User.id)).first()
+        if admin_email is None:
+            raise RuntimeError("No admin user, seed the database first (python -m bench.run --seed)")
+        users = session.exec(select(User.id, User.email).where(User.is_admin == False).order_by(User.id).limit(5000)).all()
+        event_ids = session.exec(select(Event.id).order_by(Event.date.desc()).limit(1000)).all()
+        class_ids = session.exec(select(Class.id).order_by(Class.schedule.desc()).limit(1000)).all()
+        # The smallest ones fill up first, so the rush also exercises the full and waitlist paths
+        hot_event_ids = session.exec(select(Event.id).order_by(Event.max_slots, Event.id).limit(hot)).all()
+        hot_class_ids = session.exec(select(Class.id).order_by(Class.max_students, Class.id).limit(hot)).all()
+    return {
+        "admin_email": admin_email,
+        "member_emails": [email for _, email in users[:members]],
+        "user_ids": [user_id for user_id, _ in users],
+        "event_ids": event_ids,
+        "class_ids": class_ids,
+        "hot_event_ids": hot_event_ids,
+        "hot_class_ids": hot_class_ids,
+    }
+
+async def login_all(client: httpx.AsyncClient, emails: list, batch: int = 8) -> list:
+    tokens = []
+    for start in range(0, len(emails), batch):
+        responses = await asyncio.gather(*(
+            client.post("/auth/login", data={"username": email, "password": SEED_PASSWORD})
+            for email in emails[start:start + batch]
+        ))
+        for email, response in zip(emails[start:start + batch], responses):
+            if response.status_code != 200:
+                raise RuntimeError(f"Login of {email} failed with {response.status_code}: {response.text}")
+            tokens.append(response.json()["access_token"])
+    return tokens
+
+async def run_scenario(ctx: BenchContext, name: str, concurrency: int, duration: float, warmup: float) -> dict:
+    weights, operations = zip(*SCENARIOS[name])
+
+    async def drive(seconds: float):
+        deadline = time.monotonic() + seconds
+
+        async def worker(index: int):
+            rng = random.Random(f"{name}-{index}")
+            while time.monotonic() < deadline:
+                await rng.choices(operations, weights)[0](ctx, index, rng)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(index) for index in range(concurrency)))
+        return time.perf_counter() - start
+
+    if warmup > 0:
+        ctx.recorder = Recorder()
+        await drive(warmup)
+    ctx.recorder = Recorder()
+    elapsed = await drive(duration)
+    summary = ctx.recorder.summary(elapsed)
+    total = summary["total"]
+    logger.success(
+        "{}: {} requests, {} req/s, p50 {} ms, p95 {} ms, p99 {} ms, {} errors, {} queries/request",
+        name, total["count"], total["throughput_rps"], total["p50_ms"], total["p95_ms"], total["p99_ms"],
+        total["errors"], total["queries_per_request"],
+    )
+    return summary
+
+async def run(args) -> dict:
+    from db.session import engine, DATABASE_ASYNC
+    if args.seed:
+        seed_database(engine, args.scale)
+    fixture = load_fixture(engine, args.members, args.hot)
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        from api.main import app
+        from api.admission import rate_limiters
+        # The workloads log in and register the same members over and over, the per account limits
+        # would turn the storms into timings of the 429 path. A server under test should run with
+        # RATE_LIMITS_ENABLED=false for the same reason
+        for limiter in rate_limiters.values():
+            limiter.enabled = False
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=args.timeout)
+
+    async with client:
+        logger.info("Logging in the admin and {} members", len(fixture['member_emails']))
+        admin_token = (await login_all(client, [fixture["admin_email"]]))[0]
+        member_tokens = await login_all(client, fixture["member_emails"])
+        ctx = BenchContext(
+            client=client,
+            admin_token=admin_token,
+            member_tokens=member_tokens,
+            member_emails=fixture["member_emails"],
+            user_ids=fixture["user_ids"],
+            event_ids=fixture["event_ids"],
+            class_ids=fixture["class_ids"],
+            hot_event_ids=fixture["hot_event_ids"],
+            hot_class_ids=fixture["hot_class_ids"],
+            count_queries=not args.url,
+        )
+        scenarios = {}
+        for name in args.scenarios:
+            logger.info("Running {} with {} workers for {}s", name, args.concurrency, args.duration)
+            scenarios[name] = await run_scenario(ctx, name, args.concurrency, args.duration, args.warmup)
+
+    return {
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "target": args.url or "in-process",
+        "database": engine.dialect.name,
+        "database_async": DATABASE_ASYNC,
+        "concurrency": args.concurrency,
+        "duration_seconds": args.duration,
+        "scenarios": scenarios,
+    }
+
+
+def compare(result: dict, baseline: dict, latency_tolerance: float, throughput_tolerance: float, min_latency_ms: float) -> list:
+    # Regressions of result against baseline, as readable lines. Scenarios or operations
+    # missing from either side are ignored
+    regressions = []
+    for name, scenario in result["scenarios"].items():
+        base_scenario = baseline.get("scenarios", {}).get(name)
+        if base_scenario is None:
+            continue
+        total, base_total = scenario["total"], base_scenario["total"]
+        if base_total["throughput_rps"] and total["throughput_rps"] is not None \
+                and total["throughput_rps"] < base_total["throughput_rps"] * (1 - throughput_tolerance):
+            regressions.append(f"{name}: throughput {total['throughput_rps']} req/s, baseline {base_total['throughput_rps']} req/s")
+        base_error_rate = base_total["errors"] / base_total["count"] if base_total["count"] else 0
+        error_rate = total["errors"] / total["count"] if total["count"] else 0
+        if error_rate > base_error_rate + 0.01:
+            regressions.append(f"{name}: error rate {error_rate:.2%}, baseline {base_error_rate:.2%}")
+
+        for operation, stats in scenario["operations"].items():
+            base = base_scenario["operations"].get(operation)
+            if base is None:
+                continue
+            for metric in ("p95_ms", "p99_ms"):
+                value, reference = stats[metric], base[metric]
+                if value is not None and reference is not None \
+                        and value > reference * (1 + latency_tolerance) and value - reference > min_latency_ms:
+                    regressions.append(f"{name}/{operation}: {metric} {value}, baseline {reference}")
+            value, reference = stats["queries_per_request"], base["queries_per_request"]
+            # Query counts are nearly deterministic, cache hit ratios make them move a little
+            if value is not None and reference is not None and value > reference * 1.1 + 0.5:
+                regressions.append(f"{name}/{operation}: {value} queries/request, baseline {reference}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Load and latency benchmark of the API")
+    parser.add_argument("--scenarios", nargs="+", default=DEFAULT_SCENARIOS, choices=sorted(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients per scenario")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before each scenario")
+    parser.add_argument("--members", type=int, default=64, help="members logged in for the workloads")
+    parser.add_argument("--hot", type=int, default=5, help="events and classes of the registration rush")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--url", help="benchmark a running server instead of the app in process")
+    parser.add_argument("--seed", action="store_true", help="migrate and seed the database if it is empty")
+    parser.add_argument("--scale", type=float, default=1.0, help="fraction of the seed volumes")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--latency-tolerance", type=float, default=0.2, help="allowed p95/p99 increase (fraction)")
+    parser.add_argument("--throughput-tolerance", type=float, default=0.2, help="allowed throughput drop (fraction)")
+    parser.add_argument("--min-latency-ms", type=float, default=2.0, help="latency increases below this are noise")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    output = RESULTS_DIR / f"{datetime.utcnow():%Y%m%d-%H%M%S}.json"
+    output.write_text(json.dumps(result, indent=2))
+    logger.info("Results written to {}", output)
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(result, indent=2))
+        logger.success("Baseline saved to {}", args.baseline)
+        return
+    if not args.baseline.exists():
+        logger.info("No baseline at {}, run with --save-baseline to create one", args.baseline)
+        return
+    regressions = compare(
+        result, json.loads(args.baseline.read_text()),
+        args.latency_tolerance, args.throughput_tolerance, args.min_latency_ms,
+    )
+    for line in regressions:
+        logger.error("Regression: {}", line)
+    if regressions:
+        sys.exit(1)
+    logger.success("No regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import math
+from collections import Counter, defaultdict
+from typing import Optional
+
+# Latency samples per operation and the summary written to the results file
+
+
+def percentile(sorted_values: list, q: float) -> Optional[float]:
+    # Nearest rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def _summarize(latencies: list, errors: int, statuses: Counter, queries: list, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "statuses": dict(sorted(statuses.items())),
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1] if ordered else None),
+        "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed > 0 else None,
+        # None when the queries could not be counted (benchmark against a remote server)
+        "queries_per_request": round(sum(queries) / len(queries), 3) if queries else None,
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(Counter)
+        self.queries = defaultdict(list)
+
+    def record(self, operation: str, seconds: float, status: Optional[int], queries: Optional[int]):
+        # 5xx, 429 and transport errors are failures, other 4xx are expected outcomes (event full, already
+        # registered). A rate limited or shed request only times the rejection, not the operation
+        self.latencies[operation].append(seconds)
+        self.statuses[operation][str(status) if status is not None else "error"] += 1
+        if status is None or status >= 500 or status == 429:
+            self.errors[operation] += 1
+        if queries is not None:
+            self.queries[operation].append(queries)
+
+    def summary(self, elapsed: float) -> dict:
+        operations = {
+            name: _summarize(self.latencies[name], self.errors[name], self.statuses[name], self.queries[name], elapsed)
+            for name in sorted(self.latencies)
+        }
+        total = _summarize(
+            [value for values in self.latencies.values() for value in values],
+            sum(self.errors.values()),
+            sum(self.statuses.values(), Counter()),
+            [value for values in self.queries.values() for value in values],
+            elapsed,
+        )
+        return {"elapsed_seconds": round(elapsed, 3), "total": total, "operations": operations}
@@ -0,0 +1,153 @@
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+import httpx
+from bench.stats import Recorder
+from db.queries import track_queries
+from db.seed import SEED_PASSWORD
+
+# Operations the workloads are made of. Each one sends one request (the registration rush sends the
+# register and the unregister as two operations so the pair leaves the data as it was) and records
+# its latency, status and query count under the operation name.
+
+
+@dataclass
+class BenchContext:
+    client: httpx.AsyncClient
+    admin_token: str
+    # One token per member, worker i acts as member i % len(member_tokens)
+    member_tokens: List[str]
+    member_emails: List[str]
+    user_ids: List[int]
+    event_ids: List[int]
+    class_ids: List[int]
+    # Few small events and classes everybody registers for at the same time
+    hot_event_ids: List[int]
+    hot_class_ids: List[int]
+    count_queries: bool
+    recorder: Recorder = field(default_factory=Recorder)
+
+
+async def request(ctx: BenchContext, operation: str, method: str, url: str, token: Optional[str] = None, **kwargs):
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    response = None
+    with track_queries() as stats:
+        start = time.perf_counter()
+        try:
+            # The whole body is read, so streamed exports are timed until their last byte
+            response = await ctx.client.request(method, url, headers=headers, **kwargs)
+        except httpx.HTTPError:
+            pass
+        elapsed = time.perf_counter() - start
+    queries = stats.count if ctx.count_queries else None
+    if queries is None and response is not None and "x-db-queries" in response.headers:
+        # A server started with QUERY_DEBUG_HEADER=true reports its own count
+        queries = int(response.headers["x-db-queries"].split(";")[0].split("=")[1])
+    ctx.recorder.record(operation, elapsed, response.status_code if response is not None else None, queries)
+    return response
+
+def _member(ctx, worker):
+    return ctx.member_tokens[worker % len(ctx.member_tokens)]
+
+
+# --- auth ---
+
+async def login(ctx, worker, rng):
+    email = ctx.member_emails[rng.randrange(len(ctx.member_emails))]
+    await request(ctx, "login", "POST", "/auth/login", data={"username": email, "password": SEED_PASSWORD})
+
+# --- home ---
+
+async def home_summary(ctx, worker, rng):
+    await request(ctx, "home_summary", "GET", "/home/summary", _member(ctx, worker))
+
+# --- events, classes, announcements ---
+
+async def _list_pages(ctx, operation, url, token, pages):
+    # Follows next_cursor like a client scrolling the list
+    cursor = None
+    for _ in range(pages):
+        response = await request(ctx, operation, "GET", url, token, params={"cursor": cursor} if cursor else None)
+        if response is None or response.status_code != 200:
+            return
+        cursor = response.json().get("next_cursor")
+        if not cursor:
+            return
+
+async def list_events(ctx, worker, rng):
+    await _list_pages(ctx, "list_events", "/events", _member(ctx, worker), rng.randint(1, 3))
+
+async def list_classes(ctx, worker, rng):
+    await _list_pages(ctx, "list_classes", "/classes", _member(ctx, worker), rng.randint(1, 3))
+
+async def list_announcements(ctx, worker, rng):
+    await _list_pages(ctx, "list_announcements", "/announcements", _member(ctx, worker), rng.randint(1, 3))
+
+async def event_roster(ctx, worker, rng):
+    await request(ctx, "event_roster", "GET", f"/events/{rng.choice(ctx.event_ids)}/get_users", _member(ctx, worker))
+
+async def event_registration(ctx, worker, rng):
+    token = _member(ctx, worker)
+    event_id = rng.choice(ctx.hot_event_ids)
+    await request(ctx, "event_register", "POST", f"/events/{event_id}/register", token)
+    await request(ctx, "event_unregister", "DELETE", f"/events/{event_id}/unregister", token, params={"user_id": 0})
+
+async def class_registration(ctx, worker, rng):
+    token = _member(ctx, worker)
+    class_id = rng.choice(ctx.hot_class_ids)
+    await request(ctx, "class_register", "POST", f"/classes/{class_id}/register", token)
+    await request(ctx, "class_unregister", "DELETE", f"/classes/{class_id}/unregister", token)
+
+async def event_waitlist(ctx, worker, rng):
+    token = _member(ctx, worker)
+    event_id = rng.choice(ctx.hot_event_ids)
+    await request(ctx, "event_waitlist_join", "POST", f"/events/{event_id}/waitlist", token)
+    await request(ctx, "event_waitlist_leave", "DELETE", f"/events/{event_id}/waitlist", token)
+
+# --- users and admin ---
+
+async def get_user(ctx, worker, rng):
+    await request(ctx, "get_user", "GET", f"/users/{rng.choice(ctx.user_ids)}", _member(ctx, worker))
+
+async def list_users(ctx, worker, rng):
+    await _list_pages(ctx, "list_users", "/users", ctx.admin_token, rng.randint(1, 5))
+
+async def export_users(ctx, worker, rng):
+    await request(ctx, "export_users", "GET", "/users/export", ctx.admin_token, params={"format": rng.choice(["csv", "ndjson"])})
+
+async def export_event(ctx, worker, rng):
+    await request(ctx, "export_event", "GET", f"/events/{rng.choice(ctx.event_ids)}/export", ctx.admin_token)
+
+async def export_class(ctx, worker, rng):
+    await request(ctx, "export_class", "GET", f"/classes/{rng.choice(ctx.class_ids)}/export", ctx.admin_token)
+
+async def admin_status(ctx, worker, rng):
+    url = rng.choice(["/admin/pool", "/admin/hashing", "/admin/caches"])
+    await request(ctx, "admin_status", "GET", url, ctx.admin_token)
+
+
+# Scenario name -> (weight, operation). Every worker of a scenario picks its next operation by weight
+SCENARIOS = {
+    "login_storm": [(1, login)],
+    "home_polling": [(1, home_summary)],
+    "registration_rush": [(4, event_registration), (4, class_registration), (1, event_waitlist)],
+    "browsing": [(3, list_events), (2, list_classes), (2, list_announcements), (1, event_roster), (1, get_user)],
+    "admin_exports": [(2, export_users), (3, export_event), (3, export_class), (1, list_users), (1, admin_status)],
+}
+
+# Everything at once, with the proportions of a normal club evening
+SCENARIOS["mixed"] = [
+    (1, login),
+    (10, home_summary),
+    (2, event_registration),
+    (2, class_registration),
+    (6, list_events),
+    (3, list_classes),
+    (3, list_announcements),
+    (1, event_roster),
+    (1, get_user),
+    (1, export_event),
+    (1, admin_status),
+]
+
+DEFAULT_SCENARIOS = ["login_storm", "home_polling", "registration_rush", "browsing", "admin_exports", "mixed"]
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import NamedTuple
+from sqlalchemy import delete, func, insert, literal, select, update
+from loguru import logger
+from db.replicas import RoutingSession
+from models.models import (
+    Event, Class, UserEventLink, UserClassLink, EventWaitlist, ClassWaitlist, CalendarFeed,
+    ArchivedEvent, ArchivedClass, ArchivedUserEventLink, ArchivedUserClassLink,
+)
+from api.calendar import CALENDAR_PAST_DAYS
+
+# Moves events and classes that started before the archive horizon, with their participants, from the
+# live tables to the archive tables, so the listings and the user.events / user.classes loads stop
+# scanning the whole history. Waitlist rows of those events and classes are dropped.
+#
+#   python -m db.archive              archive everything older than ARCHIVE_AFTER_DAYS
+#   python -m db.archive --dry-run    only count what would move
+#
+# Meant to run from cron. Each batch is its own short transaction (rows of the batch locked, copied,
+# deleted, committed) with a pause in between, so the routes are never held back for long. The run
+# reports the size of the tables before and after.
+#
+# Archived rows keep their ids, so the live tables must never hand an id out twice: sequences on
+# Postgres, AUTOINCREMENT on SQLite (migration 0011).
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+ARCHIVE_BATCH_PAUSE_SECONDS = float(os.getenv("ARCHIVE_BATCH_PAUSE_SECONDS", "0.2"))
+
+
+class _Kind(NamedTuple):
+    model: type
+    start: object
+    link: type
+    link_key: str
+    waitlist: type
+    archive: type
+    archive_link: type
+
+KINDS = {
+    "event": _Kind(Event, Event.date, UserEventLink, "event_id", EventWaitlist, ArchivedEvent, ArchivedUserEventLink),
+    "class": _Kind(Class, Class.schedule, UserClassLink, "class_id", ClassWaitlist, ArchivedClass, ArchivedUserClassLink),
+}
+
+REPORT_TABLES = [
+    model.__table__ for kind in KINDS.values()
+    for model in (kind.model, kind.link, kind.waitlist, kind.archive, kind.archive_link)
+]
+
+
+def table_sizes(session) -> dict:
+    # table -> rows, plus bytes on disk (indexes and TOAST included) on Postgres
+    postgres = session.get_bind().dialect.name == "postgresql"
+    sizes = {}
+    for table in REPORT_TABLES:
+        sizes[table.name] = {"rows": session.execute(select(func.count()).select_from(table)).scalar()}
+        if postgres:
+            sizes[table.name]["bytes"] = session.execute(select(func.pg_total_relation_size(table.name))).scalar()
+    return sizes
+
+def pending(session, cutoff: datetime) -> dict:
+    # What a run with this cutoff would move
+    counts = {}
+    for name, kind in KINDS.items():
+        old = select(kind.model.id).where(kind.start < cutoff)
+        counts[name] = session.execute(select(func.count()).select_from(old.subquery())).scalar()
+        counts[kind.link.__tablename__] = session.execute(
+            select(func.count()).select_from(kind.link).where(getattr(kind.link, kind.link_key).in_(old))
+        ).scalar()
+    return counts
+
+def _move_batch(session, kind: _Kind, cutoff: datetime, batch_size: int) -> tuple:
+    # Moves up to batch_size rows of kind and their links, returns (rows, links). The caller commits.
+    # Locks follow the route order: the event / class rows first, then their link rows
+    ids = session.execute(
+        select(kind.model.id)
+        .where(kind.start < cutoff)
+        .order_by(kind.model.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not ids:
+        return 0, 0
+    link_key = getattr(kind.link, kind.link_key)
+
+    # Feeds still showing these entries are rebuilt without them
+    if cutoff > datetime.utcnow() - timedelta(days=CALENDAR_PAST_DAYS):
+        session.execute(
+            update(CalendarFeed)
+            .where(CalendarFeed.user_id.in_(select(kind.link.user_id).where(link_key.in_(ids))))
+            .values(version=CalendarFeed.version + 1)
+        )
+
+    columns = [column for column in kind.model.__table__.columns]
+    session.execute(insert(kind.archive).from_select(
+        [column.name for column in columns] + ["archived_at"],
+        select(*columns, literal(datetime.utcnow())).where(kind.model.id.in_(ids)),
+    ))
+    links = session.execute(insert(kind.archive_link).from_select(
+        ["user_id", kind.link_key],
+        select(kind.link.user_id, link_key).where(link_key.in_(ids)),
+    )).rowcount
+    session.execute(delete(kind.waitlist).where(getattr(kind.waitlist, kind.link_key).in_(ids)))
+    session.execute(delete(kind.link).where(link_key.in_(ids)))
+    session.execute(delete(kind.model).where(kind.model.id.in_(ids)))
+    return len(ids), links
+
+def archive(engine, days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE, dry_run: bool = False) -> dict:
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    # Commits go through RoutingSession, so the change markers of the tables are bumped and the
+    # ETags of the listings change
+    with RoutingSession(engine) as session:
+        report = {"cutoff": cutoff.isoformat(), "dry_run": dry_run, "before": table_sizes(session)}
+        if dry_run:
+            report["pending"] = pending(session, cutoff)
+            session.rollback()
+            return report
+        session.commit()
+
+        moved = {}
+        started = time.perf_counter()
+        for name, kind in KINDS.items():
+            rows = links = 0
+            while True:
+                batch_rows, batch_links = _move_batch(session, kind, cutoff, batch_size)
+                session.commit()
+                if not batch_rows:
+                    break
+                rows += batch_rows
+                links += batch_links
+                logger.debug("Archived {} {} rows ({} so far)", batch_rows, name, rows)
+                time.sleep(ARCHIVE_BATCH_PAUSE_SECONDS)
+            moved[name] = {"rows": rows, "links": links}
+        report["moved"] = moved
+        report["seconds"] = round(time.perf_counter() - started, 2)
+        report["after"] = table_sizes(session)
+        session.commit()
+    logger.info("Archived rows older than {}: {}", cutoff, moved)
+    return report
+
+
+def main():
+    from db.session import engine
+    parser = argparse.ArgumentParser(description="Move past events and classes to the archive tables")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="Archive what started more than this many days ago")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="Only report the sizes and what would move")
+    args = parser.parse_args()
+    if args.days < 1 or args.batch_size < 1:
+        parser.error("--days and --batch-size must be positive")
+    report = archive(engine, days=args.days, batch_size=args.batch_size, dry_run=args.dry_run)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from datetime import datetime
+from typing import Iterable, Optional
+from sqlalchemy import event, update
+from sqlmodel import select
+from db.replicas import RoutingSession
+from models.models import ChangeMarker
+
+# Change markers: every commit that writes a table bumps its row in changemarker, in the same
+# transaction, so the versions are exact across workers and replicas. The read endpoints build their
+# ETags from them (see api/http_cache.py) with one primary key lookup instead of running the query.
+#
+# Writes are collected per session from the flushes and from the UPDATE/DELETE/INSERT statements run
+# through it. Only TRACKED_TABLES have a marker, others cost nothing. The marker rows are the last ones
+# a transaction locks and are held only until its commit.
+#
+# A marker row is a single hot row, so tables written by every registration must not have one: the
+# link tables are not tracked, and the participant counters are updated with track_changes=False
+# (api/registration.py, api/waitlist.py). Responses built from a user's own registrations are tagged
+# with User.schedule_version instead, and the listings showing the counters with a time window.
+
+TRACKED_TABLES = frozenset({
+    "announcement", "announcementimage", "event", "class", "match", "matchresult", "teamstanding",
+    "archivedevent", "archivedclass",
+})
+# Execution option, False keeps a statement out of the markers
+TRACK_CHANGES = "track_changes"
+
+_CHANGED = "changed_tables"
+
+
+def _changed(session) -> set:
+    return session.info.setdefault(_CHANGED, set())
+
+@event.listens_for(RoutingSession, "after_flush")
+def _collect_flushed(session, flush_context):
+    changed = _changed(session)
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(instance, "__table__", None)
+        if table is not None and table.name in TRACKED_TABLES:
+            changed.add(table.name)
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _collect_statement(state):
+    if (state.is_update or state.is_delete or state.is_insert) and state.execution_options.get(TRACK_CHANGES, True):
+        table = getattr(state.statement, "table", None)
+        if table is not None and table.name in TRACKED_TABLES:
+            _changed(state.session).add(table.name)
+
+@event.listens_for(RoutingSession, "before_commit")
+def _bump_markers(session):
+    # Pending ORM changes are flushed first so they are part of the set
+    session.flush()
+    changed = session.info.pop(_CHANGED, None)
+    if changed:
+        session.execute(
+            update(ChangeMarker)
+            .where(ChangeMarker.name.in_(sorted(changed)))
+            .values(version=ChangeMarker.version + 1, updated_at=datetime.utcnow())
+        )
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _forget_changes(session):
+    session.info.pop(_CHANGED, None)
+
+
+async def marker_versions(session, names: Iterable[str]) -> Optional[dict]:
+    # name -> version, None when a marker row is missing (database not migrated): callers then skip
+    # conditional responses rather than risk a 304 that never changes
+    names = list(names)
+    rows = (await session.exec(select(ChangeMarker.name, ChangeMarker.version).where(ChangeMarker.name.in_(names)))).all()
+    versions = {name: version for name, version in rows}
+    return versions if len(versions) == len(set(names)) else None
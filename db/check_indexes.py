@@ -0,0 +1,123 @@
+import argparse
+import json
+import re
+import sys
+from datetime import datetime
+from sqlalchemy import tuple_
+from sqlmodel import select
+from loguru import logger
+from models.models import (
+    User, Event, Class, Match, Announcement,
+    UserEventLink, UserClassLink, UserTeamLink, EventWaitlist, ClassWaitlist,
+)
+
+# Runs EXPLAIN on the queries the routers issue and checks that each one uses the index
+# created for it in migrations/versions/0003_query_indexes.py.
+#
+#   alembic upgrade head && python -m db.seed && python -m db.check_indexes
+#
+# Exits with status 1 if any query is planned without its index.
+
+def router_queries():
+    # name, statement (same shape as in the routers), indexes that satisfy the check
+    now = datetime.utcnow()
+    level = 3.0
+    return [
+        ("login / token fallback", select(User).where(User.email == "member1@example.com"),
+         {"ix_user_email"}),
+        ("list_events first page",
+         select(Event).where(Event.min_level <= level).order_by(Event.date, Event.id).limit(101),
+         {"ix_event_date_id", "ix_event_min_level"}),
+        ("list_events next page",
+         select(Event).where(Event.min_level <= level, tuple_(Event.date, Event.id) > tuple_(now, 1))
+         .order_by(Event.date, Event.id).limit(101),
+         {"ix_event_date_id"}),
+        ("list_classes first page",
+         select(Class).where(Class.level_required <= level).order_by(Class.schedule, Class.id).limit(101),
+         {"ix_class_schedule_id", "ix_class_level_required"}),
+        ("list_announcements",
+         select(Announcement).order_by(Announcement.created_at.desc(), Announcement.id.desc()).limit(101),
+         {"ix_announcement_created_at_id"}),
+        ("home upcoming events",
+         select(Event).join(UserEventLink, UserEventLink.event_id == Event.id)
+         .where(UserEventLink.user_id == 1, Event.date >= now).order_by(Event.date, Event.id).limit(5),
+         {"usereventlink_pkey", "sqlite_autoindex_usereventlink_1"}),
+        ("home recent results",
+         select(Match).join(UserTeamLink, UserTeamLink.team_id == Match.team_id)
+         .where(UserTeamLink.user_id == 1).order_by(Match.date.desc()).limit(3),
+         {"ix_match_team_id_date"}),
+        ("event roster",
+         select(User).join(UserEventLink, UserEventLink.user_id == User.id).where(UserEventLink.event_id == 1),
+         {"ix_usereventlink_event_id_user_id"}),
+        ("class roster",
+         select(User).join(UserClassLink, UserClassLink.user_id == User.id).where(UserClassLink.class_id == 1),
+         {"ix_userclasslink_class_id_user_id"}),
+        ("team roster",
+         select(User).join(UserTeamLink, UserTeamLink.user_id == User.id).where(UserTeamLink.team_id == 1),
+         {"ix_userteamlink_team_id_user_id"}),
+        ("event waitlist promotion",
+         select(EventWaitlist.user_id).where(EventWaitlist.event_id == 1).order_by(EventWaitlist.id).limit(5),
+         {"ix_eventwaitlist_event_id_id", "uq_eventwaitlist_event_id_user_id"}),
+        ("class waitlist promotion",
+         select(ClassWaitlist.user_id).where(ClassWaitlist.class_id == 1).order_by(ClassWaitlist.id).limit(5),
+         {"ix_classwaitlist_class_id_id", "uq_classwaitlist_class_id_user_id"}),
+    ]
+
+
+def _json_index_names(node) -> set:
+    names = set()
+    if isinstance(node, dict):
+        if "Index Name" in node:
+            names.add(node["Index Name"])
+        for value in node.values():
+            names |= _json_index_names(value)
+    elif isinstance(node, list):
+        for value in node:
+            names |= _json_index_names(value)
+    return names
+
+def explain(connection, statement):
+    # Returns (index names used by the plan, plan text)
+    compiled = statement.compile(dialect=connection.dialect)
+    params = tuple(compiled.params[key] for key in compiled.positiontup) if compiled.positional else compiled.params
+    if connection.dialect.name == "postgresql":
+        rows = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params).all()
+        plan = rows[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return _json_index_names(plan), json.dumps(plan, indent=1)
+    if connection.dialect.name == "sqlite":
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+        text = "\n".join(row[-1] for row in rows)
+        return set(re.findall(r"USING (?:COVERING )?INDEX (\w+)", text)), text
+    raise RuntimeError(f"EXPLAIN check not supported on {connection.dialect.name}")
+
+def check(engine, no_seqscan: bool = False, verbose: bool = False) -> bool:
+    ok = True
+    with engine.connect() as connection:
+        if no_seqscan and connection.dialect.name == "postgresql":
+            # Small seeds can make a sequential scan cheaper, this checks the index is usable at all
+            connection.exec_driver_sql("SET enable_seqscan = off")
+        for name, statement, expected in router_queries():
+            used, plan = explain(connection, statement)
+            if used & expected:
+                logger.success("{}: uses {}", name, ', '.join(sorted(used & expected)))
+            else:
+                ok = False
+                logger.error("{}: expected one of {}, plan uses {}", name, sorted(expected), sorted(used) or 'no index')
+            if verbose or not used & expected:
+                logger.info(plan)
+    return ok
+
+
+def main():
+    from db.session import engine
+    parser = argparse.ArgumentParser(description="Check that the router queries use their indexes")
+    parser.add_argument("--no-seqscan", action="store_true", help="disable sequential scans (PostgreSQL)")
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+    sys.exit(0 if check(engine, no_seqscan=args.no_seqscan, verbose=args.verbose) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+# Pool configuration, same defaults as SQLAlchemy except pre-ping
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+# Seconds after which a connection is replaced, -1 keeps connections forever
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "-1"))
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Server side statement_timeout in milliseconds, 0 disables it
+DATABASE_STATEMENT_TIMEOUT_MS = int(os.getenv("DATABASE_STATEMENT_TIMEOUT_MS", "0"))
+
+# Upper bounds (seconds) of the checkout wait histogram
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class PoolStats:
+    # Counters for one pool. Updated from the pool internals, so they are protected by a lock
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wait_buckets = [0] * len(WAIT_BUCKETS)
+        self.wait_count = 0
+        self.wait_sum = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+
+    def observe_wait(self, seconds: float):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_sum += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.wait_buckets[i] += 1
+                    break
+
+    def incr(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            cumulative = 0
+            histogram = []
+            for bound, count in zip(WAIT_BUCKETS, self.wait_buckets):
+                cumulative += count
+                histogram.append({"le": "+Inf" if bound == float("inf") else bound, "count": cumulative})
+            return {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "closes": self.closes,
+                "invalidations": self.invalidations,
+                "wait": {
+                    "count": self.wait_count,
+                    "sum_seconds": self.wait_sum,
+                    "max_seconds": self.wait_max,
+                    "histogram": histogram,
+                },
+            }
+
+
+class _InstrumentedPoolMixin:
+    # Times how long a caller waits for a connection. SQLAlchemy has no event for the start of a checkout
+    stats: PoolStats
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.stats.incr("timeouts")
+            raise
+        finally:
+            self.stats.observe_wait(time.perf_counter() - start)
+
+    def recreate(self):
+        # engine.dispose() replaces the pool, keep the counters
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+# name -> engine, for the admin pool endpoint
+_engines = {}
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    # Keyword arguments for create_engine / create_async_engine built from the DATABASE_POOL_* settings
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        # SQLite uses its own pool classes, none of the settings apply
+        return {}
+
+    options = {
+        "poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        "pool_size": DATABASE_POOL_SIZE,
+        "max_overflow": DATABASE_MAX_OVERFLOW,
+        "pool_timeout": DATABASE_POOL_TIMEOUT,
+        "pool_recycle": DATABASE_POOL_RECYCLE,
+        "pool_pre_ping": DATABASE_POOL_PRE_PING,
+    }
+    if DATABASE_STATEMENT_TIMEOUT_MS > 0 and url.get_backend_name() == "postgresql":
+        if url.get_driver_name() == "asyncpg":
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DATABASE_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DATABASE_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+def instrument_engine(engine, name: str):
+    # Attaches the counters to the engine pool. Accepts sync engines and AsyncEngine.sync_engine
+    pool = engine.pool
+    if not isinstance(pool, _InstrumentedPoolMixin):
+        return engine
+    pool.stats = PoolStats()
+
+    event.listen(engine, "checkout", lambda *args: engine.pool.stats.incr("checkouts"))
+    event.listen(engine, "checkin", lambda *args: engine.pool.stats.incr("checkins"))
+    event.listen(engine, "connect", lambda *args: engine.pool.stats.incr("connects"))
+    event.listen(engine, "close", lambda *args: engine.pool.stats.incr("closes"))
+    event.listen(engine, "invalidate", lambda *args: engine.pool.stats.incr("invalidations"))
+
+    _engines[name] = engine
+    return engine
+
+def pool_status() -> dict:
+    # Live view of every instrumented pool
+    status = {}
+    for name, engine in _engines.items():
+        pool = engine.pool
+        status[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow_in_use": max(pool.overflow(), 0),
+            "max_overflow": DATABASE_MAX_OVERFLOW,
+            "timeout": DATABASE_POOL_TIMEOUT,
+            "recycle": DATABASE_POOL_RECYCLE,
+            "pre_ping": DATABASE_POOL_PRE_PING,
+            "statement_timeout_ms": DATABASE_STATEMENT_TIMEOUT_MS,
+            **pool.stats.snapshot(),
+        }
+    return status
@@ -0,0 +1,70 @@
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+
+# Statement accounting per request. The engine hooks add every statement to the QueryStats of the
+# request being served, found through a context variable (run_in_threadpool copies it into the
+# worker threads of the sync session, so both session modes are covered)
+
+_current: ContextVar = ContextVar("query_stats", default=None)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryStats:
+    def __init__(self, parent: Optional["QueryStats"] = None):
+        # Blocks can be nested (the benchmark client around a request), statements count for both
+        self.parent = parent
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+        # Normalized statement -> executions. Statements are parameterized, so the same
+        # statement repeated with different ids is one pattern
+        self.patterns = Counter()
+
+    def observe(self, statement: str, seconds: float):
+        self.count += 1
+        self.total_time += seconds
+        statement = _WHITESPACE.sub(" ", statement).strip()
+        self.patterns[statement] += 1
+        if seconds >= self.slowest_time:
+            self.slowest_time = seconds
+            self.slowest_statement = statement
+        if self.parent is not None:
+            self.parent.observe(statement, seconds)
+
+    def repeated(self, threshold: int) -> list:
+        # (statement, executions) run at least threshold times, the usual shape of an N+1
+        return [(statement, count) for statement, count in self.patterns.most_common() if count >= threshold]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is not None and conn.info.get("query_start"):
+        stats.observe(statement, time.perf_counter() - conn.info["query_start"].pop())
+
+def install(engine):
+    # Accepts sync engines and AsyncEngine.sync_engine
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+@contextmanager
+def track_queries():
+    # Everything executed inside the block (and in tasks or threads started from it) is counted
+    stats = QueryStats(parent=_current.get())
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
@@ -0,0 +1,227 @@
+import asyncio
+import os
+import time
+from http.cookies import SimpleCookie
+from typing import List, Optional
+from sqlalchemy import event, text
+from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from loguru import logger
+
+# Read replica routing. GET and HEAD requests read from a replica, everything else (and any
+# statement that writes or locks rows) goes to the primary. After a user writes, their reads stay
+# on the primary for READ_YOUR_WRITES_SECONDS so they see their own change despite replication lag.
+#
+# The pin is kept in this worker and in a cookie, so it also holds when the next request lands on
+# another worker (for clients that keep cookies). The cookie is set by PrimaryPinMiddleware, since
+# the routes often return their own Response object.
+#
+# Local check with two databases, no replication needed: migrate and seed both, then run with
+#   DATABASE_URL=sqlite:///primary.db DATABASE_REPLICA_URLS=sqlite:///replica.db
+# Writes land in primary.db, lists come from replica.db except for the user who just wrote,
+# and removing replica.db makes the reads fail over to the primary (see GET /admin/replicas).
+
+# Seconds a user reads from the primary after writing
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+# A replica that fails is skipped for this long before it is tried again
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+# A replica further behind than this is skipped (PostgreSQL only), 0 disables the check
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))
+# Seconds between health checks of the replicas
+REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", "5"))
+
+PIN_COOKIE = "db_primary_until"
+# request.state attribute holding the pin cookie value of a request that wrote
+PIN_STATE = "primary_until"
+
+READ_METHODS = ("GET", "HEAD")
+
+_LAG_QUERY = text("SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)")
+
+
+class Replica:
+    def __init__(self, name: str, engine, async_engine=None):
+        self.name = name
+        # Sync engine, the one Session.get_bind returns (AsyncEngine.sync_engine in async mode)
+        self.engine = async_engine.sync_engine if async_engine is not None else engine
+        self.async_engine = async_engine
+        self.sync_engine = engine
+        self.down_until = 0.0
+        self.lag: Optional[float] = None
+        self.failures = 0
+        event.listen(self.engine, "handle_error", self._on_error)
+
+    @property
+    def healthy(self) -> bool:
+        return self.down_until <= time.monotonic()
+
+    def mark_down(self, reason: str):
+        if self.healthy:
+            logger.warning("Replica {} marked down for {}s: {}", self.name, REPLICA_RETRY_SECONDS, reason)
+        self.failures += 1
+        self.down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+
+    def _on_error(self, context):
+        # Lost or refused connections take the replica out right away, the health check brings it back
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(str(context.original_exception)[:200])
+
+    async def check(self):
+        try:
+            if self.async_engine is not None:
+                async with self.async_engine.connect() as connection:
+                    lag = await self._measure(connection)
+            else:
+                lag = await run_in_threadpool(self._check_sync)
+        except Exception as exc:
+            self.mark_down(str(exc)[:200])
+            return
+        self.lag = lag
+        if REPLICA_MAX_LAG_SECONDS > 0 and lag > REPLICA_MAX_LAG_SECONDS:
+            self.mark_down(f"replication lag {lag:.1f}s")
+        elif not self.healthy:
+            logger.info("Replica {} is back", self.name)
+            self.down_until = 0.0
+
+    def _check_sync(self):
+        with self.sync_engine.connect() as connection:
+            if connection.dialect.name != "postgresql":
+                connection.execute(text("SELECT 1"))
+                return 0.0
+            return float(connection.execute(_LAG_QUERY).scalar())
+
+    async def _measure(self, connection):
+        if connection.dialect.name != "postgresql":
+            await connection.execute(text("SELECT 1"))
+            return 0.0
+        return float((await connection.execute(_LAG_QUERY)).scalar())
+
+    def status(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "failures": self.failures,
+            "retry_in_seconds": max(0.0, round(self.down_until - time.monotonic(), 1)),
+        }
+
+
+class ReplicaSet:
+    def __init__(self, replicas: List[Replica]):
+        self.replicas = replicas
+        self._next = 0
+        # user id -> monotonic time until which the user reads from the primary
+        self._pins = {}
+
+    def pick(self) -> Optional[Replica]:
+        # Round robin over the healthy replicas, None fails over to the primary
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[self._next % len(self.replicas)]
+            self._next += 1
+            if replica.healthy:
+                return replica
+        return None
+
+    def pin(self, user_id: int):
+        self._pins[user_id] = time.monotonic() + READ_YOUR_WRITES_SECONDS
+        if len(self._pins) > 10000:
+            now = time.monotonic()
+            self._pins = {key: until for key, until in self._pins.items() if until > now}
+
+    def is_pinned(self, user_id: Optional[int]) -> bool:
+        return user_id is not None and self._pins.get(user_id, 0.0) > time.monotonic()
+
+    async def monitor(self):
+        # Background health check, started by api/main.py
+        while True:
+            await asyncio.gather(*(replica.check() for replica in self.replicas))
+            await asyncio.sleep(REPLICA_CHECK_INTERVAL_SECONDS)
+
+    def status(self) -> dict:
+        return {replica.name: replica.status() for replica in self.replicas}
+
+
+class ReadRouting:
+    # Routing state of one request session, kept in session.info["routing"]
+    def __init__(self, replicas: ReplicaSet, request):
+        self.replicas = replicas
+        self.request = request
+        self.read_only = request.method in READ_METHODS
+        self.wrote = False
+        self._read_bind = None
+
+    def _pinned(self) -> bool:
+        # get_current_user stores the user id before its first query
+        if self.replicas.is_pinned(getattr(self.request.state, "user_id", None)):
+            return True
+        try:
+            return float(self.request.cookies.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def read_bind(self, primary):
+        if self.wrote or not self.read_only:
+            return primary
+        if self._read_bind is None:
+            # Chosen once, so every read of the request sees the same database
+            replica = None if self._pinned() else self.replicas.pick()
+            self._read_bind = replica.engine if replica is not None else primary
+        return self._read_bind
+
+    def after_commit(self):
+        if not self.wrote:
+            return
+        user_id = getattr(self.request.state, "user_id", None)
+        if user_id is not None:
+            self.replicas.pin(user_id)
+        setattr(self.request.state, PIN_STATE, int(time.time() + READ_YOUR_WRITES_SECONDS) + 1)
+
+
+class PrimaryPinMiddleware:
+    # Adds the pin cookie to the response of a request that wrote, whatever Response the route
+    # returned (headers set on the injected Response are dropped when the route returns its own)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message):
+            until = scope.get("state", {}).get(PIN_STATE)
+            if message["type"] == "http.response.start" and until is not None:
+                cookie = SimpleCookie()
+                cookie[PIN_COOKIE] = str(until)
+                cookie[PIN_COOKIE].update({"max-age": int(READ_YOUR_WRITES_SECONDS) + 1, "path": "/", "httponly": True, "samesite": "lax"})
+                headers = MutableHeaders(raw=list(message.get("headers", [])))
+                headers.append("set-cookie", cookie.output(header="").strip())
+                message = {**message, "headers": headers.raw}
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
+
+
+class RoutingSession(Session):
+    # Picks the engine per statement. Without session.info["routing"] it behaves as a plain Session
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        primary = super().get_bind(mapper, clause=clause, **kwargs)
+        routing = self.info.get("routing")
+        if routing is None:
+            return primary
+        if self._flushing or (clause is not None and getattr(clause, "is_dml", False)):
+            routing.wrote = True
+            return primary
+        if clause is not None and (
+            getattr(clause, "_for_update_arg", None) is not None
+            or getattr(clause, "get_execution_options", dict)().get("use_primary")
+        ):
+            return primary
+        return routing.read_bind(primary)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _pin_after_commit(session):
+    routing = session.info.get("routing")
+    if routing is not None:
+        routing.after_commit()
@@ -0,0 +1,173 @@
+import argparse
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select, update
+from loguru import logger
+from api.hashing_worker import make_context
+from db.standings import recompute as recompute_standings
+from models.models import (
+    User, Event, Class, Team, Match, Announcement,
+    UserEventLink, UserClassLink, UserTeamLink,
+)
+
+# Generates a local dataset with realistic proportions, for the index check and the benchmarks.
+# Meant for an empty, migrated database: python -m db.seed --users 5000
+
+SEED_PASSWORD = "password"
+LEVELS = [1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0]
+BATCH_SIZE = 5000
+
+
+def _insert(connection, model, rows):
+    # Batched multi-row inserts, returns the generated ids in the order of the rows
+    ids = []
+    for start in range(0, len(rows), BATCH_SIZE):
+        chunk = rows[start:start + BATCH_SIZE]
+        if hasattr(model, "id"):
+            result = connection.execute(insert(model).returning(model.id, sort_by_parameter_order=True), chunk)
+            ids.extend(result.scalars().all())
+        else:
+            connection.execute(insert(model), chunk)
+    return ids
+
+def _random_score(rng) -> str:
+    # Finished best of three, sometimes decided by a match tiebreak
+    sets, won, lost = [], 0, 0
+    while won < 2 and lost < 2:
+        if won == lost == 1 and rng.random() < 0.3:
+            sets.append(rng.choice([(10, 8), (8, 10), (10, 6), (11, 13)]))
+        else:
+            sets.append(rng.choice([(6, 4), (4, 6), (6, 3), (7, 5), (3, 6), (6, 2), (7, 6), (5, 7)]))
+        won += sets[-1][0] > sets[-1][1]
+        lost += sets[-1][0] < sets[-1][1]
+    return " ".join(f"{a}-{b}" for a, b in sets)
+
+def seed(engine, users=5000, events=500, classes=500, teams=100, matches=5000, announcements=2000,
+         events_per_user=5, classes_per_user=5, years=3, rng_seed=42):
+    rng = random.Random(rng_seed)
+    now = datetime.utcnow()
+    start = now - timedelta(days=365 * (years - 1))
+    span = (now + timedelta(days=365) - start).total_seconds()
+    random_date = lambda: start + timedelta(seconds=rng.random() * span)
+    # Every seeded user shares one hash, hashing thousands of passwords would dominate the run
+    hashed_password = make_context().hash(SEED_PASSWORD)
+
+    with engine.begin() as connection:
+        if connection.execute(select(func.count()).select_from(User)).scalar():
+            raise RuntimeError("The database already has users, seed an empty database")
+
+        user_ids = _insert(connection, User, [
+            {
+                "name": f"Member {i}",
+                "email": f"member{i}@example.com",
+                "hashed_password": hashed_password,
+                "level": rng.choice(LEVELS),
+                "is_admin": i == 0,
+                "classes_to_recover": rng.randint(0, 4),
+                "token_version": 0,
+            }
+            for i in range(users)
+        ])
+        logger.info("Seeded {} users", len(user_ids))
+
+        event_ids = _insert(connection, Event, [
+            {
+                "name": f"Event {i}",
+                "type": rng.choice(["tournament", "social", "clinic"]),
+                "date": random_date(),
+                "min_level": rng.choice(LEVELS),
+                "max_slots": rng.randint(8, 64),
+                "price": float(rng.choice([0, 10, 15, 25])),
+                "participant_count": 0,
+            }
+            for i in range(events)
+        ])
+        class_ids = _insert(connection, Class, [
+            {
+                "coach_id": rng.choice(user_ids[:20]),
+                "schedule": random_date(),
+                "level_required": rng.choice(LEVELS),
+                "max_students": rng.randint(4, 8),
+                "student_count": 0,
+            }
+            for i in range(classes)
+        ])
+        team_ids = _insert(connection, Team, [
+            {"name": f"Team {i}", "competition_name": f"League {i % 5}"}
+            for i in range(teams)
+        ])
+        logger.info("Seeded {} events, {} classes, {} teams", len(event_ids), len(class_ids), len(team_ids))
+
+        event_links, class_links, team_links = [], [], []
+        for user_id in user_ids:
+            for event_id in rng.sample(event_ids, min(events_per_user, len(event_ids))):
+                event_links.append({"user_id": user_id, "event_id": event_id})
+            for class_id in rng.sample(class_ids, min(classes_per_user, len(class_ids))):
+                class_links.append({"user_id": user_id, "class_id": class_id})
+            if team_ids:
+                team_links.append({"user_id": user_id, "team_id": rng.choice(team_ids)})
+        _insert(connection, UserEventLink, event_links)
+        _insert(connection, UserClassLink, class_links)
+        _insert(connection, UserTeamLink, team_links)
+        logger.info("Seeded {} event, {} class and {} team registrations", len(event_links), len(class_links), len(team_links))
+
+        # Counters match the links, capacity is raised where the random links overbooked
+        for model, link, link_key, counter, capacity in (
+            (Event, UserEventLink, UserEventLink.event_id, Event.participant_count, Event.max_slots),
+            (Class, UserClassLink, UserClassLink.class_id, Class.student_count, Class.max_students),
+        ):
+            count = select(func.count()).select_from(link).where(link_key == model.id).scalar_subquery()
+            connection.execute(update(model).values({counter.key: count}))
+            connection.execute(update(model).where(capacity < counter).values({capacity.key: counter}))
+
+        _insert(connection, Match, [
+            {
+                "team_id": rng.choice(team_ids) if team_ids else None,
+                "date": random_date(),
+                "opponent_name": f"Rival {rng.randint(1, 200)}",
+                "score": _random_score(rng),
+            }
+            for i in range(matches)
+        ])
+        _insert(connection, Announcement, [
+            {
+                "title": f"Announcement {i}",
+                "content": "Club news " * 20,
+                "created_at": random_date(),
+                "images": "",
+                "author_id": user_ids[0],
+            }
+            for i in range(announcements)
+        ])
+        logger.info("Seeded {} matches and {} announcements", matches, announcements)
+
+    recompute_standings(engine)
+
+    with engine.connect() as connection:
+        # Fresh statistics so the planner sees the real table sizes
+        connection.exec_driver_sql("ANALYZE")
+        connection.commit()
+
+
+def main():
+    from db.session import engine
+    parser = argparse.ArgumentParser(description="Seed an empty database with generated club data")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--classes", type=int, default=500)
+    parser.add_argument("--teams", type=int, default=100)
+    parser.add_argument("--matches", type=int, default=5000)
+    parser.add_argument("--announcements", type=int, default=2000)
+    parser.add_argument("--events-per-user", type=int, default=5)
+    parser.add_argument("--classes-per-user", type=int, default=5)
+    parser.add_argument("--years", type=int, default=3)
+    args = parser.parse_args()
+    seed(
+        engine, users=args.users, events=args.events, classes=args.classes, teams=args.teams,
+        matches=args.matches, announcements=args.announcements, events_per_user=args.events_per_user,
+        classes_per_user=args.classes_per_user, years=args.years,
+    )
+
+
+if __name__ == "__main__":
+    main()
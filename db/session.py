@@ -1,7 +1,17 @@
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from sqlmodel import create_engine, Session, SQLModel
+from fastapi import Request
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 from loguru import logger
+from db.pool import engine_options, instrument_engine
+from db.queries import install as install_query_tracking
+from db.replicas import Replica, ReplicaSet, ReadRouting, RoutingSession
+# Registers the change marker listeners on RoutingSession
+import db.changes  # noqa: F401
 
 load_dotenv()
 
@@ -14,19 +24,161 @@ DATABASE_NAME=os.getenv("DATABASE_NAME")
 # Fallback URI if individual variables are missing
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
-    DATABASE_URL = f"postgresql+psycopg2://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}" 
+    DATABASE_URL = f"postgresql+psycopg2://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
 
-engine = create_engine(DATABASE_URL)
+# Async mode runs the routers on an async driver (asyncpg / aiosqlite).
+# With DATABASE_ASYNC=false the same routers run on the blocking driver inside the threadpool,
+# which keeps both modes available for benchmarking
+DATABASE_ASYNC = os.getenv("DATABASE_ASYNC", "true").lower() in ("1", "true", "yes")
 
+def _async_url(url: str) -> str:
+    #Maps a sync driver URL to its async driver
+    for sync_prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("sqlite+pysqlite://", "sqlite+aiosqlite://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
 
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
 
-def init_db(): 
-    SQLModel.metadata.create_all(engine)
+# The sync engine is always available for scripts and maintenance jobs
+# Pool size, overflow, timeouts and statement_timeout come from the DATABASE_POOL_* variables (see db/pool.py)
+# Every statement is also counted against the request that issued it (see db/queries.py)
+engine = instrument_engine(create_engine(DATABASE_URL, **engine_options(DATABASE_URL)), "sync")
+install_query_tracking(engine)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True)) if DATABASE_ASYNC else None
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine, "async")
+    install_query_tracking(async_engine.sync_engine)
 
-def get_session():
-    with Session(engine) as session:
+# Optional read replicas, comma separated URLs with the same driver as DATABASE_URL.
+# GET requests read from them, see db/replicas.py
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+def _replica(index: int, url: str) -> Replica:
+    name = f"replica{index}"
+    sync_engine = instrument_engine(create_engine(url, **engine_options(url)), name)
+    install_query_tracking(sync_engine)
+    replica_async_engine = None
+    if DATABASE_ASYNC:
+        async_url = _async_url(url)
+        replica_async_engine = create_async_engine(async_url, **engine_options(async_url, is_async=True))
+        instrument_engine(replica_async_engine.sync_engine, f"{name}_async")
+        install_query_tracking(replica_async_engine.sync_engine)
+    return Replica(name, sync_engine, replica_async_engine)
+
+replicas = ReplicaSet([_replica(index, url) for index, url in enumerate(DATABASE_REPLICA_URLS)]) if DATABASE_REPLICA_URLS else None
+
+
+class ThreadedSession:
+    # Exposes the subset of the AsyncSession interface used by the routers on top of a blocking Session.
+    # Every call that talks to the database runs in the threadpool, and results are buffered there
+    # so iterating them afterwards does not touch the connection from the event loop
+    _BUFFERED = {"prebuffer_rows": True}
+
+    def __init__(self, session: Session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def exec(self, statement, **kwargs):
+        options = {**self._BUFFERED, **kwargs.pop("execution_options", {})}
+        return await run_in_threadpool(self.sync_session.exec, statement, execution_options=options, **kwargs)
+
+    async def execute(self, statement, *args, **kwargs):
+        options = {**self._BUFFERED, **kwargs.pop("execution_options", {})}
+        return await run_in_threadpool(self.sync_session.execute, statement, *args, execution_options=options, **kwargs)
+
+    async def scalar(self, statement, *args, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, *args, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self):
+        await run_in_threadpool(self.sync_session.flush)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+# Schema changes are versioned in migrations/ and applied as a deployment step, not at app startup
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+def init_db():
+    # Same as `alembic upgrade head`
+    from alembic import command
+    from alembic.config import Config
+    command.upgrade(Config(ALEMBIC_INI), "head")
+
+@asynccontextmanager
+async def open_session(info: dict = None):
+    # Objects stay usable after commit, there is no implicit refresh (it would be lazy IO under asyncio).
+    # Without routing info every statement goes to the primary, as background jobs need
+    if async_engine is not None:
+        async with AsyncSession(async_engine, expire_on_commit=False, sync_session_class=RoutingSession, info=info or {}) as session:
+            yield session
+    else:
+        session = ThreadedSession(RoutingSession(engine, expire_on_commit=False, info=info or {}))
+        try:
+            yield session
+        finally:
+            await session.close()
+
+async def get_session(request: Request):
+    # With replicas configured, RoutingSession sends each statement to the primary or a replica
+    info = {"routing": ReadRouting(replicas, request)} if replicas is not None else {}
+    async with open_session(info) as session:
         yield session
 
 
+async def stream_partitions(statement, chunk_size: int):
+    # Yields the rows of a statement in lists of chunk_size, read through a server side cursor on a
+    # dedicated connection, so it can outlive the request session (e.g. inside a StreamingResponse).
+    # Exports only read, so they run on a replica when one is healthy
+    replica = replicas.pick() if replicas is not None else None
+    if async_engine is not None:
+        source = replica.async_engine if replica is not None else async_engine
+        async with source.connect() as connection:
+            result = await connection.stream(statement.execution_options(yield_per=chunk_size))
+            async for partition in result.partitions():
+                yield partition
+        return
+
+    def sync_partitions():
+        source = replica.sync_engine if replica is not None else engine
+        with source.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(statement)
+            yield from result.partitions()
+
+    partitions = sync_partitions()
+    try:
+        async for partition in iterate_in_threadpool(partitions):
+            yield partition
+    finally:
+        # Releases the connection when the client goes away mid export
+        await run_in_threadpool(partitions.close)
+
+
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    init_db()
@@ -0,0 +1,106 @@
+import argparse
+import sys
+from sqlalchemy import delete, insert, select
+from loguru import logger
+from db.replicas import RoutingSession
+from models.models import Team, Match, MatchResult, TeamStanding
+from api.standings import TOTAL_FIELDS, parse_score, totals
+
+# Full recompute of matchresult and teamstanding from the match history, with the parser and totals
+# the match routes use incrementally, so both paths give the same tables.
+#
+#   python -m db.standings           rebuild (also loads the matches recorded before migration 0007)
+#   python -m db.standings --check   compare the stored tables with a recompute, exit 1 on differences
+#
+# Team rows are locked for the whole run, which holds back the match routes meanwhile.
+
+BATCH_SIZE = 5000
+
+
+def compute(session) -> tuple:
+    # (match id -> result, team id -> standing values, matches with an invalid score)
+    teams = dict(session.execute(select(Team.id, Team.competition_name)).all())
+    results, standings, invalid = {}, {}, 0
+    matches = session.execute(
+        select(Match.id, Match.team_id, Match.score)
+        .where(Match.team_id.is_not(None))
+        .order_by(Match.id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    for match_id, team_id, score in matches:
+        if team_id not in teams or score is None:
+            continue
+        try:
+            result = parse_score(score)
+        except ValueError:
+            invalid += 1
+            continue
+        results[match_id] = result
+        standing = standings.setdefault(team_id, {"competition_name": teams[team_id], **{name: 0 for name in TOTAL_FIELDS}})
+        for name, value in totals(result).items():
+            standing[name] += value
+    return results, standings, invalid
+
+def _stored(session) -> tuple:
+    results = {
+        row.match_id: (row.won, row.sets_won, row.sets_lost, row.games_won, row.games_lost)
+        for row in session.execute(select(MatchResult)).scalars()
+    }
+    # Rows emptied by deletions are not part of the table
+    standings = {
+        row.team_id: {"competition_name": row.competition_name, **{name: getattr(row, name) for name in TOTAL_FIELDS}}
+        for row in session.execute(select(TeamStanding).where(TeamStanding.played > 0)).scalars()
+    }
+    return results, standings
+
+def recompute(engine, check: bool = False) -> int:
+    # Returns the number of differences found (check) or 0
+    with RoutingSession(engine) as session:
+        session.execute(select(Team.id).order_by(Team.id).with_for_update()).all()
+        results, standings, invalid = compute(session)
+        if invalid:
+            logger.warning("{} matches have a score that is not a finished match and are not counted", invalid)
+
+        if check:
+            stored_results, stored_standings = _stored(session)
+            expected_results = {match_id: tuple(result)[1:] for match_id, result in results.items()}
+            differences = 0
+            for match_id in sorted(set(expected_results) | set(stored_results)):
+                if expected_results.get(match_id) != stored_results.get(match_id):
+                    differences += 1
+                    logger.warning("Match {}: stored {}, recomputed {}", match_id, stored_results.get(match_id), expected_results.get(match_id))
+            for team_id in sorted(set(standings) | set(stored_standings)):
+                if standings.get(team_id) != stored_standings.get(team_id):
+                    differences += 1
+                    logger.warning("Team {}: stored {}, recomputed {}", team_id, stored_standings.get(team_id), standings.get(team_id))
+            session.rollback()
+            logger.info("{} matches and {} teams checked, {} differences", len(results), len(standings), differences)
+            return differences
+
+        session.execute(delete(TeamStanding))
+        session.execute(delete(MatchResult))
+        rows = [
+            {"match_id": match_id, **{name: getattr(result, name) for name in ("won", "sets_won", "sets_lost", "games_won", "games_lost")}}
+            for match_id, result in results.items()
+        ]
+        for start in range(0, len(rows), BATCH_SIZE):
+            session.execute(insert(MatchResult), rows[start:start + BATCH_SIZE])
+        if standings:
+            session.execute(insert(TeamStanding), [{"team_id": team_id, **values} for team_id, values in standings.items()])
+        # Commits through RoutingSession, so the change markers of both tables are bumped
+        session.commit()
+    logger.info("Standings rebuilt: {} results, {} teams", len(results), len(standings))
+    return 0
+
+
+def main():
+    from db.session import engine
+    parser = argparse.ArgumentParser(description="Rebuild the team standings from the match history")
+    parser.add_argument("--check", action="store_true", help="Only compare the stored tables with a recompute")
+    args = parser.parse_args()
+    differences = recompute(engine, check=args.check)
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == "__main__":
+    main()
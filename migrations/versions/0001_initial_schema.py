@@ -0,0 +1,93 @@
+"""Initial schema, as created by SQLModel.metadata.create_all before migrations existed
+
+Databases created by the old startup hook are already at this revision: alembic stamp 0001
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "user",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.Column("level", sa.Float(), nullable=False),
+        sa.Column("is_admin", sa.Boolean(), nullable=False),
+        sa.Column("classes_to_recover", sa.Integer(), nullable=False),
+    )
+    op.create_index("ix_user_email", "user", ["email"], unique=True)
+
+    op.create_table(
+        "event",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("date", sa.DateTime(), nullable=False),
+        sa.Column("min_level", sa.Float(), nullable=False),
+        sa.Column("max_slots", sa.Integer(), nullable=False),
+        sa.Column("price", sa.Float(), nullable=False),
+    )
+    op.create_table(
+        "class",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("coach_id", sa.Integer(), nullable=False),
+        sa.Column("schedule", sa.DateTime(), nullable=False),
+        sa.Column("level_required", sa.Float(), nullable=False),
+        sa.Column("max_students", sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        "team",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("competition_name", sa.String(), nullable=False),
+    )
+    op.create_table(
+        "match",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("team_id", sa.Integer(), sa.ForeignKey("team.id"), nullable=True),
+        sa.Column("date", sa.DateTime(), nullable=False),
+        sa.Column("opponent_name", sa.String(), nullable=True),
+        sa.Column("score", sa.String(), nullable=True),
+    )
+    op.create_table(
+        "announcement",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("content", sa.String(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("images", sa.String(), nullable=False),
+        sa.Column("author_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False),
+    )
+    op.create_table(
+        "userclasslink",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), primary_key=True),
+        sa.Column("class_id", sa.Integer(), sa.ForeignKey("class.id"), primary_key=True),
+    )
+    op.create_table(
+        "usereventlink",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), primary_key=True),
+        sa.Column("event_id", sa.Integer(), sa.ForeignKey("event.id"), primary_key=True),
+    )
+    op.create_table(
+        "userteamlink",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), primary_key=True),
+        sa.Column("team_id", sa.Integer(), sa.ForeignKey("team.id"), primary_key=True),
+    )
+
+
+def downgrade():
+    for table in ("userteamlink", "usereventlink", "userclasslink", "announcement", "match", "team", "class", "event"):
+        op.drop_table(table)
+    op.drop_index("ix_user_email", table_name="user")
+    op.drop_table("user")
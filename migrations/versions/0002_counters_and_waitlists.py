@@ -0,0 +1,60 @@
+"""Token versions, participant counters and waitlists
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("user") as batch:
+        batch.add_column(sa.Column("token_version", sa.Integer(), nullable=False, server_default="0"))
+    with op.batch_alter_table("event") as batch:
+        batch.add_column(sa.Column("participant_count", sa.Integer(), nullable=False, server_default="0"))
+    with op.batch_alter_table("class") as batch:
+        batch.add_column(sa.Column("student_count", sa.Integer(), nullable=False, server_default="0"))
+
+    # Counters start from the existing registrations
+    op.execute(
+        'UPDATE event SET participant_count = '
+        '(SELECT count(*) FROM usereventlink WHERE usereventlink.event_id = event.id)'
+    )
+    op.execute(
+        'UPDATE "class" SET student_count = '
+        '(SELECT count(*) FROM userclasslink WHERE userclasslink.class_id = "class".id)'
+    )
+
+    op.create_table(
+        "eventwaitlist",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("event_id", sa.Integer(), sa.ForeignKey("event.id"), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.UniqueConstraint("event_id", "user_id", name="uq_eventwaitlist_event_id_user_id"),
+    )
+    op.create_table(
+        "classwaitlist",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("class_id", sa.Integer(), sa.ForeignKey("class.id"), nullable=False),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.UniqueConstraint("class_id", "user_id", name="uq_classwaitlist_class_id_user_id"),
+    )
+
+
+def downgrade():
+    op.drop_table("classwaitlist")
+    op.drop_table("eventwaitlist")
+    with op.batch_alter_table("class") as batch:
+        batch.drop_column("student_count")
+    with op.batch_alter_table("event") as batch:
+        batch.drop_column("participant_count")
+    with op.batch_alter_table("user") as batch:
+        batch.drop_column("token_version")
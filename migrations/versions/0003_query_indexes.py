@@ -0,0 +1,48 @@
+"""Index set derived from the router queries
+
+Every index names the query it serves. db/check_indexes.py runs EXPLAIN on those queries
+against a seeded database and fails if one of them does not use its index.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# name, table, columns
+INDEXES = [
+    # /events keyset pagination and upcoming events in /home/summary
+    ("ix_event_date_id", "event", ["date", "id"]),
+    # /events level filter
+    ("ix_event_min_level", "event", ["min_level"]),
+    # /classes keyset pagination and upcoming classes in /home/summary
+    ("ix_class_schedule_id", "class", ["schedule", "id"]),
+    # /classes level filter
+    ("ix_class_level_required", "class", ["level_required"]),
+    # recent results in /home/summary
+    ("ix_match_team_id_date", "match", ["team_id", "date"]),
+    # /announcements keyset pagination and /home/summary
+    ("ix_announcement_created_at_id", "announcement", ["created_at", "id"]),
+    # rosters (get_users, class_users) and participant lookups, the primary keys start with user_id
+    ("ix_usereventlink_event_id_user_id", "usereventlink", ["event_id", "user_id"]),
+    ("ix_userclasslink_class_id_user_id", "userclasslink", ["class_id", "user_id"]),
+    ("ix_userteamlink_team_id_user_id", "userteamlink", ["team_id", "user_id"]),
+    # waitlist promotion in FIFO order
+    ("ix_eventwaitlist_event_id_id", "eventwaitlist", ["event_id", "id"]),
+    ("ix_classwaitlist_class_id_id", "classwaitlist", ["class_id", "id"]),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
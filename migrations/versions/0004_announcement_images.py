@@ -0,0 +1,39 @@
+"""Announcement images
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "announcementimage",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("announcement_id", sa.Integer(), sa.ForeignKey("announcement.id"), nullable=False),
+        sa.Column("position", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("content_hash", sa.String(length=64), nullable=False),
+        sa.Column("extension", sa.String(length=8), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("width", sa.Integer(), nullable=True),
+        sa.Column("height", sa.Integer(), nullable=True),
+        sa.Column("status", sa.String(length=16), nullable=False, server_default="pending"),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    # Images of a page of announcements, in display order
+    op.create_index("ix_announcementimage_announcement_id_position", "announcementimage", ["announcement_id", "position"])
+    # Rows sharing a file, when its variants are ready or when the file can be deleted
+    op.create_index("ix_announcementimage_content_hash", "announcementimage", ["content_hash"])
+
+
+def downgrade():
+    op.drop_index("ix_announcementimage_content_hash", table_name="announcementimage")
+    op.drop_index("ix_announcementimage_announcement_id_position", table_name="announcementimage")
+    op.drop_table("announcementimage")
@@ -0,0 +1,41 @@
+"""Change markers
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+# Tables whose changes invalidate the ETags of the read endpoints
+TRACKED_TABLES = (
+    "announcement",
+    "announcementimage",
+    "event",
+    "class",
+    "match",
+    "usereventlink",
+    "userclasslink",
+    "userteamlink",
+)
+
+
+def upgrade():
+    changemarker = op.create_table(
+        "changemarker",
+        sa.Column("name", sa.String(length=64), primary_key=True),
+        sa.Column("version", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+    )
+    now = datetime.utcnow()
+    op.bulk_insert(changemarker, [{"name": name, "version": 0, "updated_at": now} for name in TRACKED_TABLES])
+
+
+def downgrade():
+    op.drop_table("changemarker")
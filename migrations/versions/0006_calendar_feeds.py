@@ -0,0 +1,33 @@
+"""Calendar feeds
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "calendarfeed",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), primary_key=True),
+        sa.Column("token", sa.String(length=64), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False, server_default="1"),
+        sa.Column("built_version", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("body", sa.Text(), nullable=True),
+        sa.Column("etag", sa.String(length=64), nullable=True),
+        sa.Column("last_modified", sa.DateTime(), nullable=True),
+    )
+    # Feed lookup by the token in the URL
+    op.create_index("ix_calendarfeed_token", "calendarfeed", ["token"], unique=True)
+
+
+def downgrade():
+    op.drop_index("ix_calendarfeed_token", table_name="calendarfeed")
+    op.drop_table("calendarfeed")
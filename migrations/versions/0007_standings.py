@@ -0,0 +1,47 @@
+"""Match results and team standings
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "matchresult",
+        sa.Column("match_id", sa.Integer(), sa.ForeignKey("match.id"), primary_key=True),
+        sa.Column("won", sa.Boolean(), nullable=False),
+        sa.Column("sets_won", sa.Integer(), nullable=False),
+        sa.Column("sets_lost", sa.Integer(), nullable=False),
+        sa.Column("games_won", sa.Integer(), nullable=False),
+        sa.Column("games_lost", sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        "teamstanding",
+        sa.Column("team_id", sa.Integer(), sa.ForeignKey("team.id"), primary_key=True),
+        sa.Column("competition_name", sa.String(), nullable=False),
+        *(sa.Column(name, sa.Integer(), nullable=False, server_default="0") for name in (
+            "played", "won", "lost", "sets_won", "sets_lost", "games_won", "games_lost",
+        )),
+    )
+    # League table of a competition
+    op.create_index("ix_teamstanding_competition_name", "teamstanding", ["competition_name"])
+    # ETags of the standings endpoints (see db/changes.py)
+    changemarker = sa.table("changemarker", sa.column("name"), sa.column("version"), sa.column("updated_at"))
+    op.bulk_insert(changemarker, [{"name": name, "version": 0, "updated_at": datetime.utcnow()} for name in ("matchresult", "teamstanding")])
+    # Existing matches are loaded with: python -m db.standings
+
+
+def downgrade():
+    op.execute("DELETE FROM changemarker WHERE name IN ('matchresult', 'teamstanding')")
+    op.drop_index("ix_teamstanding_competition_name", table_name="teamstanding")
+    op.drop_table("teamstanding")
+    op.drop_table("matchresult")
@@ -0,0 +1,31 @@
+"""Recovery class preferences
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "recoverywindow",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), nullable=False),
+        sa.Column("weekday", sa.Integer(), nullable=True),
+        sa.Column("start_time", sa.Time(), nullable=False),
+        sa.Column("end_time", sa.Time(), nullable=False),
+        sa.Column("max_level_gap", sa.Float(), nullable=True),
+    )
+    op.create_index("ix_recoverywindow_user_id", "recoverywindow", ["user_id"])
+
+
+def downgrade():
+    op.drop_index("ix_recoverywindow_user_id", table_name="recoverywindow")
+    op.drop_table("recoverywindow")
@@ -0,0 +1,66 @@
+"""Archive tables for past events and classes
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+ARCHIVE_TABLES = ("archivedevent", "archivedclass", "archivedusereventlink", "archiveduserclasslink")
+
+
+def upgrade():
+    op.create_table(
+        "archivedevent",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("date", sa.DateTime(), nullable=False),
+        sa.Column("min_level", sa.Float(), nullable=False),
+        sa.Column("max_slots", sa.Integer(), nullable=False),
+        sa.Column("price", sa.Float(), nullable=False),
+        sa.Column("participant_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_archivedevent_date_id", "archivedevent", ["date", "id"])
+    op.create_table(
+        "archivedclass",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("coach_id", sa.Integer(), nullable=False),
+        sa.Column("schedule", sa.DateTime(), nullable=False),
+        sa.Column("level_required", sa.Float(), nullable=False),
+        sa.Column("max_students", sa.Integer(), nullable=False),
+        sa.Column("student_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_archivedclass_schedule_id", "archivedclass", ["schedule", "id"])
+    op.create_table(
+        "archivedusereventlink",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), primary_key=True),
+        sa.Column("event_id", sa.Integer(), sa.ForeignKey("archivedevent.id"), primary_key=True),
+    )
+    op.create_table(
+        "archiveduserclasslink",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("user.id"), primary_key=True),
+        sa.Column("class_id", sa.Integer(), sa.ForeignKey("archivedclass.id"), primary_key=True),
+    )
+    # ETag of the history endpoint (see db/changes.py)
+    changemarker = sa.table("changemarker", sa.column("name"), sa.column("version"), sa.column("updated_at"))
+    op.bulk_insert(changemarker, [{"name": name, "version": 0, "updated_at": datetime.utcnow()} for name in ARCHIVE_TABLES])
+
+
+def downgrade():
+    op.execute("DELETE FROM changemarker WHERE name IN ({})".format(", ".join(f"'{name}'" for name in ARCHIVE_TABLES)))
+    op.drop_table("archiveduserclasslink")
+    op.drop_table("archivedusereventlink")
+    op.drop_index("ix_archivedclass_schedule_id", table_name="archivedclass")
+    op.drop_table("archivedclass")
+    op.drop_index("ix_archivedevent_date_id", table_name="archivedevent")
+    op.drop_table("archivedevent")
@@ -0,0 +1,30 @@
+"""Per user schedule versions instead of link table change markers
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+# Every registration wrote these markers, one hot row for the whole club (see db/changes.py)
+LINK_TABLES = ("usereventlink", "userclasslink", "userteamlink", "archivedusereventlink", "archiveduserclasslink")
+
+
+def upgrade():
+    with op.batch_alter_table("user") as batch:
+        batch.add_column(sa.Column("schedule_version", sa.Integer(), nullable=False, server_default="0"))
+    op.execute("DELETE FROM changemarker WHERE name IN ({})".format(", ".join(f"'{name}'" for name in LINK_TABLES)))
+
+
+def downgrade():
+    changemarker = sa.table("changemarker", sa.column("name"), sa.column("version"), sa.column("updated_at"))
+    op.bulk_insert(changemarker, [{"name": name, "version": 0, "updated_at": datetime.utcnow()} for name in LINK_TABLES])
+    with op.batch_alter_table("user") as batch:
+        batch.drop_column("schedule_version")
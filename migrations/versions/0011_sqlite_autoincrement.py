@@ -0,0 +1,40 @@
+"""Event and class ids never reused on SQLite
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+# Without AUTOINCREMENT SQLite hands out max(id) + 1, so once the newest rows are archived a new event
+# could get the id of an archived one and the next archive run would fail on the primary key.
+# Postgres sequences never go back, nothing to do there
+# table -> archive table
+TABLES = {"event": "archivedevent", "class": "archivedclass"}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    for name, archive in TABLES.items():
+        with op.batch_alter_table(name, recreate="always", table_kwargs={"sqlite_autoincrement": True}):
+            pass
+        # The counter starts above the ids already archived too
+        op.execute(f"DELETE FROM sqlite_sequence WHERE name = '{name}'")
+        op.execute(
+            f"INSERT INTO sqlite_sequence (name, seq) SELECT '{name}', "
+            f'max(coalesce((SELECT max(id) FROM "{name}"), 0), coalesce((SELECT max(id) FROM {archive}), 0))'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    for name in TABLES:
+        with op.batch_alter_table(name, recreate="always", table_kwargs={"sqlite_autoincrement": False}):
+            pass
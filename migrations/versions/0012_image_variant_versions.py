@@ -0,0 +1,27 @@
+"""Versioned image variants and worker claims
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows keep a null version: their variants live under the unversioned keys until the
+    # worker regenerates them
+    with op.batch_alter_table("announcementimage") as batch:
+        batch.add_column(sa.Column("variant_version", sa.String(length=16), nullable=True))
+        batch.add_column(sa.Column("claimed_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("announcementimage") as batch:
+        batch.drop_column("claimed_at")
+        batch.drop_column("variant_version")
@@ -1,19 +1,24 @@
-from datetime import datetime
+from datetime import datetime, time
 from typing import List, Optional
+from sqlalchemy import Index, UniqueConstraint
 from sqlmodel import Field, Relationship, SQLModel
 
 
 # --- Link Tables ---
+# The primary keys start with user_id, the extra indexes serve the lookups from the other side (rosters)
 
 class UserClassLink(SQLModel, table=True):
+    __table_args__ = (Index("ix_userclasslink_class_id_user_id", "class_id", "user_id"),)
     user_id: int = Field(foreign_key="user.id", primary_key=True)
     class_id: int = Field(foreign_key="class.id", primary_key=True)
 
 class UserEventLink(SQLModel, table=True):
+    __table_args__ = (Index("ix_usereventlink_event_id_user_id", "event_id", "user_id"),)
     user_id: int = Field(foreign_key="user.id", primary_key=True)
     event_id: int = Field(foreign_key="event.id", primary_key=True)
 
 class UserTeamLink(SQLModel, table=True):
+    __table_args__ = (Index("ix_userteamlink_team_id_user_id", "team_id", "user_id"),)
     user_id: int = Field(foreign_key="user.id", primary_key=True)
     team_id: int = Field(foreign_key="team.id", primary_key=True)
 
@@ -27,12 +32,23 @@ class User(SQLModel, table=True):
     level: float
     is_admin: bool = Field(default=False)
     classes_to_recover: int = Field(default=0)
+    #Bumped whenever the user is changed by an admin, tokens carrying an older version are rejected
+    token_version: int = Field(default=0)
+    #Bumped whenever the user's events, classes or teams change, the per user ETags are built from it
+    schedule_version: int = Field(default=0)
     
     classes: List["Class"] = Relationship(back_populates="students", link_model=UserClassLink)
     events: List["Event"] = Relationship(back_populates="participants", link_model=UserEventLink)
     teams: List["Team"] = Relationship(back_populates="members", link_model=UserTeamLink)
 
 class Event(SQLModel, table=True):
+    #Keyset pagination order of /events and upcoming events, level filter of /events
+    __table_args__ = (
+        Index("ix_event_date_id", "date", "id"),
+        Index("ix_event_min_level", "min_level"),
+        #Ids are never reused on SQLite either, archived rows keep theirs (see db/archive.py)
+        {"sqlite_autoincrement": True},
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     type: str
@@ -40,14 +56,24 @@ class Event(SQLModel, table=True):
     min_level: float
     max_slots: int
     price: float
+    #Denormalized number of UserEventLink rows, kept in sync by api/registration.py
+    participant_count: int = Field(default=0)
     participants: List[User] = Relationship(back_populates="events", link_model=UserEventLink)
 
 class Class(SQLModel, table=True):
+    #Keyset pagination order of /classes and upcoming classes, level filter of /classes
+    __table_args__ = (
+        Index("ix_class_schedule_id", "schedule", "id"),
+        Index("ix_class_level_required", "level_required"),
+        {"sqlite_autoincrement": True},
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     coach_id: int
     schedule: datetime
     level_required: float
     max_students: int
+    #Denormalized number of UserClassLink rows, kept in sync by api/registration.py
+    student_count: int = Field(default=0)
     
     students: List[User] = Relationship(back_populates="classes", link_model=UserClassLink)
 
@@ -56,11 +82,13 @@ class Team(SQLModel, table=True):
     name: str
     competition_name: str    
     members: List[User] = Relationship(back_populates="teams", link_model=UserTeamLink)
-    matches: List[Match] = Relationship(back_populates="team")
+    matches: List["Match"] = Relationship(back_populates="team")
 
 
 
 class Match(SQLModel, table=True):
+    #Latest results of a team
+    __table_args__ = (Index("ix_match_team_id_date", "team_id", "date"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     team_id: Optional[int] = Field(default=None, foreign_key="team.id")
     date: datetime
@@ -69,10 +97,160 @@ class Match(SQLModel, table=True):
     
     team: Optional[Team] = Relationship(back_populates="matches")
 
+class MatchResult(SQLModel, table=True):
+    #Parsed score of a match from its team's side (see api/standings.py). Matches without a valid
+    #score have no row and do not count in the standings
+    match_id: int = Field(foreign_key="match.id", primary_key=True)
+    won: bool
+    sets_won: int
+    sets_lost: int
+    games_won: int
+    games_lost: int
+
+class TeamStanding(SQLModel, table=True):
+    #Materialized totals of a team over its MatchResult rows, kept up to date by the match routes.
+    #db/standings.py rebuilds them from the match history
+    __table_args__ = (Index("ix_teamstanding_competition_name", "competition_name"),)
+    team_id: int = Field(foreign_key="team.id", primary_key=True)
+    competition_name: str
+    played: int = 0
+    won: int = 0
+    lost: int = 0
+    sets_won: int = 0
+    sets_lost: int = 0
+    games_won: int = 0
+    games_lost: int = 0
+
 class Announcement(SQLModel, table=True):
+    #Keyset pagination order of /announcements
+    __table_args__ = (Index("ix_announcement_created_at_id", "created_at", "id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
     content: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     images: str #Assign a bucket in S3 so every image in that bucket is associated with this announcement
     author_id: int = Field(foreign_key="user.id")
+
+class AnnouncementImage(SQLModel, table=True):
+    #Uploaded image of an announcement. Files are stored by content hash (see api/images.py),
+    #so the same file uploaded twice is stored and resized once
+    __table_args__ = (
+        Index("ix_announcementimage_announcement_id_position", "announcement_id", "position"),
+        Index("ix_announcementimage_content_hash", "content_hash"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    announcement_id: int = Field(foreign_key="announcement.id")
+    position: int = 0
+    content_hash: str = Field(max_length=64)
+    #Extension of the original: jpg, png, gif or webp
+    extension: str = Field(max_length=8)
+    size: int
+    width: Optional[int] = None
+    height: Optional[int] = None
+    #pending until the variants are generated, then ready or failed
+    status: str = Field(default="pending", max_length=16)
+    #VARIANT_VERSION of the settings the variants were made with, None for the unversioned first ones
+    variant_version: Optional[str] = Field(default=None, max_length=16)
+    #Set while a worker generates the variants, the others skip the file until the claim expires
+    claimed_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# --- Waitlists ---
+# Entries are served in id order (FIFO), see api/waitlist.py
+
+class EventWaitlist(SQLModel, table=True):
+    __table_args__ = (
+        UniqueConstraint("event_id", "user_id", name="uq_eventwaitlist_event_id_user_id"),
+        Index("ix_eventwaitlist_event_id_id", "event_id", "id"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    event_id: int = Field(foreign_key="event.id")
+    user_id: int = Field(foreign_key="user.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ClassWaitlist(SQLModel, table=True):
+    __table_args__ = (
+        UniqueConstraint("class_id", "user_id", name="uq_classwaitlist_class_id_user_id"),
+        Index("ix_classwaitlist_class_id_id", "class_id", "id"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    class_id: int = Field(foreign_key="class.id")
+    user_id: int = Field(foreign_key="user.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# --- Recovery class preferences ---
+
+class RecoveryWindow(SQLModel, table=True):
+    #When a user wants their recovery classes, used by the batch allocation (see api/allocation.py).
+    #A class qualifies if it matches any window of the user, users without windows take any class
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id", index=True)
+    #0 = Monday ... 6 = Sunday, None for every day
+    weekday: Optional[int] = None
+    start_time: time
+    end_time: time
+    #Classes whose level_required is further below the user's level than this are skipped
+    max_level_gap: Optional[float] = None
+
+
+# --- Calendar feeds ---
+
+class CalendarFeed(SQLModel, table=True):
+    #Rendered .ics feed of a user, served at /calendar/{token}.ics (see api/calendar.py).
+    #version is bumped when the user's registrations or their events / classes change, the feed is
+    #rebuilt when built_version is behind it
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    token: str = Field(unique=True, index=True, max_length=64)
+    version: int = Field(default=1)
+    built_version: int = Field(default=0)
+    body: Optional[str] = None
+    etag: Optional[str] = Field(default=None, max_length=64)
+    last_modified: Optional[datetime] = None
+
+
+# --- Change markers ---
+
+class ChangeMarker(SQLModel, table=True):
+    #One row per table. version is bumped in the transaction of every commit that writes the table
+    #(see db/changes.py), the ETags of the read endpoints are built from it
+    name: str = Field(primary_key=True, max_length=64)
+    version: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# --- Archive ---
+# Events and classes past the archive horizon, with their participants, moved out of the live tables
+# by db/archive.py. Same ids as the live rows they come from
+
+class ArchivedEvent(SQLModel, table=True):
+    __table_args__ = (Index("ix_archivedevent_date_id", "date", "id"),)
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    name: str
+    type: str
+    date: datetime
+    min_level: float
+    max_slots: int
+    price: float
+    participant_count: int = Field(default=0)
+    archived_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ArchivedClass(SQLModel, table=True):
+    __table_args__ = (Index("ix_archivedclass_schedule_id", "schedule", "id"),)
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    coach_id: int
+    schedule: datetime
+    level_required: float
+    max_students: int
+    student_count: int = Field(default=0)
+    archived_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ArchivedUserEventLink(SQLModel, table=True):
+    #Member history reads by user_id, the primary key order
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    event_id: int = Field(foreign_key="archivedevent.id", primary_key=True)
+
+class ArchivedUserClassLink(SQLModel, table=True):
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    class_id: int = Field(foreign_key="archivedclass.id", primary_key=True)
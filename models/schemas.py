@@ -0,0 +1,263 @@
+from datetime import date, datetime, time
+from typing import Any, List, Literal, Optional
+from pydantic import AliasChoices, model_validator
+from sqlmodel import Field, SQLModel
+
+# Request and response bodies that are not tables.
+# Read schemas list exactly the columns a response exposes (never hashed_password or token_version),
+# write schemas the fields a client may set. Relationships are never part of a schema.
+
+
+# --- Users ---
+
+class UserRead(SQLModel):
+    id: int
+    name: str
+    email: str
+    level: float
+    is_admin: bool
+    classes_to_recover: int
+
+class ParticipantRead(SQLModel):
+    # What any member can see about the other participants of an event
+    id: int
+    name: str
+    level: float
+
+class UserCreate(SQLModel):
+    name: str
+    email: str
+    # Plain text password. Older clients send it as hashed_password
+    password: str = Field(validation_alias=AliasChoices("password", "hashed_password"))
+    level: float
+    is_admin: bool = False
+    classes_to_recover: int = 0
+
+class UserUpdate(SQLModel):
+    name: Optional[str] = None
+    email: Optional[str] = None
+    level: Optional[float] = None
+    is_admin: Optional[bool] = None
+    classes_to_recover: Optional[int] = None
+    # Plain text, hashed before it is stored
+    password: Optional[str] = None
+
+
+# --- Events ---
+
+class EventRead(SQLModel):
+    id: int
+    name: str
+    type: str
+    date: datetime
+    min_level: float
+    max_slots: int
+    price: float
+    participant_count: int
+
+class EventCreate(SQLModel):
+    name: str
+    type: str
+    date: datetime
+    min_level: float
+    max_slots: int
+    price: float
+
+class EventUpdate(SQLModel):
+    name: Optional[str] = None
+    type: Optional[str] = None
+    date: Optional[datetime] = None
+    min_level: Optional[float] = None
+    max_slots: Optional[int] = None
+    price: Optional[float] = None
+
+
+# --- Classes ---
+
+class ClassRead(SQLModel):
+    id: int
+    coach_id: int
+    schedule: datetime
+    level_required: float
+    max_students: int
+    student_count: int
+
+class ClassCreate(SQLModel):
+    coach_id: int
+    schedule: datetime
+    level_required: float
+    max_students: int
+
+class ClassUpdate(SQLModel):
+    coach_id: Optional[int] = None
+    schedule: Optional[datetime] = None
+    level_required: Optional[float] = None
+    max_students: Optional[int] = None
+
+class HistoryEntry(SQLModel):
+    # A past event or class of the member, live or archived
+    kind: str
+    id: int
+    start: datetime
+    # Events only
+    name: Optional[str] = None
+    type: Optional[str] = None
+    level: float
+    archived: bool
+
+
+# --- Announcements and matches ---
+
+class ImageRead(SQLModel):
+    # Content hashed URLs, see api/images.py. thumb and feed are None until the variants are ready
+    id: int
+    status: str
+    width: Optional[int]
+    height: Optional[int]
+    original: str
+    thumb: Optional[str]
+    feed: Optional[str]
+
+class AnnouncementRead(SQLModel):
+    id: int
+    title: str
+    content: str
+    created_at: datetime
+    author_id: int
+    images: List[ImageRead] = []
+
+class AnnouncementCreate(SQLModel):
+    title: str
+    content: str
+    # Defaults to the admin posting it. Images are uploaded to /announcements/{id}/images
+    author_id: Optional[int] = None
+
+class MatchRead(SQLModel):
+    id: int
+    team_id: Optional[int]
+    date: datetime
+    opponent_name: Optional[str]
+    score: Optional[str]
+
+class MatchCreate(SQLModel):
+    team_id: int
+    date: datetime
+    opponent_name: Optional[str] = None
+    # Sets from the team's side, e.g. "6-4 3-6 10-8". Required to be a finished match when given
+    score: Optional[str] = None
+
+class MatchUpdate(SQLModel):
+    team_id: Optional[int] = None
+    date: Optional[datetime] = None
+    opponent_name: Optional[str] = None
+    score: Optional[str] = None
+
+class StandingRead(SQLModel):
+    team_id: int
+    team_name: str
+    competition_name: str
+    played: int
+    won: int
+    lost: int
+    sets_won: int
+    sets_lost: int
+    games_won: int
+    games_lost: int
+    points: int
+
+class FormEntry(SQLModel):
+    match_id: int
+    date: datetime
+    opponent_name: Optional[str]
+    score: Optional[str]
+    won: bool
+    sets_won: int
+    sets_lost: int
+    games_won: int
+    games_lost: int
+
+class TeamForm(SQLModel):
+    team_id: int
+    # Latest first, e.g. "WWLW"
+    form: str
+    matches: List[FormEntry]
+
+
+# --- Batch reads ---
+
+class BatchQuery(SQLModel):
+    # Echoed back with the result
+    key: str = Field(max_length=64)
+    op: Literal["home_summary", "events", "classes", "announcements", "event", "class", "event_participants", "class_students"]
+    # id for the single row and roster ops, limit / cursor for the listings
+    id: Optional[int] = None
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+
+class BatchRequest(SQLModel):
+    queries: List[BatchQuery] = Field(min_length=1, max_length=50)
+
+class BatchResult(SQLModel):
+    key: str
+    status: int
+    body: Any
+
+class BatchResponse(SQLModel):
+    results: List[BatchResult]
+
+
+# --- Bulk admin operations ---
+
+class RecoveryWindowIn(SQLModel):
+    weekday: Optional[int] = Field(default=None, ge=0, le=6, description="0 = Monday ... 6 = Sunday, empty for every day")
+    start_time: time
+    end_time: time
+    max_level_gap: Optional[float] = Field(default=None, ge=0)
+
+    @model_validator(mode="after")
+    def check_times(self):
+        if self.end_time <= self.start_time:
+            raise ValueError("end_time must be after start_time")
+        return self
+
+class RecoveryPreferences(SQLModel):
+    # Replaces the user's windows, an empty list means any class
+    windows: List[RecoveryWindowIn] = Field(default=[], max_length=20)
+
+class RecoveryAllocation(SQLModel):
+    # Classes starting in [start, end) are allocated, start defaults to now
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    dry_run: bool = True
+    # Per user class ids in the report, can be large
+    include_assignments: bool = False
+
+class RecurringClasses(SQLModel):
+    # Weekly classes between start_date and end_date (both included) on the given weekdays
+    weekdays: List[int] = Field(description="0 = Monday ... 6 = Sunday")
+    start_time: time
+    start_date: date
+    end_date: date
+    coach_id: int
+    level_required: float
+    max_students: int = Field(gt=0)
+
+    @model_validator(mode="after")
+    def check_range(self):
+        if self.end_date < self.start_date:
+            raise ValueError("end_date is before start_date")
+        if not self.weekdays or any(day < 0 or day > 6 for day in self.weekdays):
+            raise ValueError("weekdays must be between 0 (Monday) and 6 (Sunday)")
+        return self
+
+class RecoveryCreditGrant(SQLModel):
+    # Credits for a list of users, or for every user with the given level
+    amount: int = Field(gt=0)
+    user_ids: Optional[List[int]] = None
+    level: Optional[float] = None
+
+    @model_validator(mode="after")
+    def check_target(self):
+        if (self.user_ids is None) == (self.level is None):
+            raise ValueError("Give either user_ids or level")
+        return self
@@ -0,0 +1,85 @@
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+from datetime import timedelta
+
+# The app reads its configuration when imported: a throwaway SQLite database and image storage, bcrypt
+# in the threadpool at the lowest cost and no read replicas
+_DATABASE_DIR = tempfile.mkdtemp(prefix="padel-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_DATABASE_DIR}/test.db"
+os.environ["IMAGE_STORAGE_ROOT"] = f"{_DATABASE_DIR}/media"
+os.environ["DATABASE_REPLICA_URLS"] = ""
+os.environ["PASSWORD_HASH_WORKERS"] = "0"
+os.environ["BCRYPT_ROUNDS"] = "4"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import pytest
+from sqlmodel import SQLModel, Session
+from db.session import engine, async_engine
+from models.models import ChangeMarker, User
+from api.security import create_access_token, user_token_claims
+from api.cache import caches
+
+
+@pytest.fixture
+def db():
+    # Fresh schema per test. The migrations seed the change markers, create_all does not. The marker
+    # versions start over, so the in-process caches of the previous test would match the new tags
+    for cache in caches.values():
+        cache.clear()
+    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(ChangeMarker(name=table.name) for table in SQLModel.metadata.sorted_tables)
+        session.commit()
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def run():
+    # Runs a coroutine on a new event loop. The async pool is disposed at the end, its connections
+    # belong to that loop
+    def runner(coroutine):
+        async def main():
+            try:
+                return await coroutine
+            finally:
+                if async_engine is not None:
+                    await async_engine.dispose()
+        return asyncio.run(main())
+    return runner
+
+@pytest.fixture
+def client():
+    # Factory, the client must be opened inside the loop of the test
+    from api.main import app
+    def create(address: str = "127.0.0.1", **kwargs):
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(address, 123)), base_url="http://test", **kwargs)
+    return create
+
+@pytest.fixture
+def add_rows(db):
+    # Inserts rows on the primary and returns them, ids loaded
+    def add(*rows):
+        with Session(db, expire_on_commit=False) as session:
+            session.add_all(rows)
+            session.commit()
+        return rows
+    return add
+
+@pytest.fixture
+def member(add_rows):
+    # Creates a user, returns it with the headers of a valid token
+    numbers = itertools.count()
+    def create(**fields):
+        number = next(numbers)
+        user, = add_rows(User(**{
+            "name": f"Member {number}", "email": f"member{number}@example.com", "hashed_password": "-", "level": 3.0,
+            **fields,
+        }))
+        token = create_access_token(user_token_claims(user), timedelta(minutes=30))
+        return user, {"Authorization": f"Bearer {token}"}
+    return create
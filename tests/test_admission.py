@@ -0,0 +1,121 @@
+import asyncio
+import pytest
+from api import admission as admission_module
+from api.admission import AdmissionController, RateLimiter
+
+
+def test_concurrent_logins_are_rate_limited(db, run, client, monkeypatch):
+    # No refill, a burst of 3 attempts for the account however they are spelled
+    limiter = RateLimiter("login", per_minute=0, burst=3)
+    monkeypatch.setattr(admission_module, "login_limiter", limiter)
+    usernames = ["member@example.com", "Member@Example.com", " MEMBER@example.com "]
+
+    async def scenario():
+        async with client() as http:
+            return await asyncio.gather(*(
+                http.post("/auth/login", data={"username": usernames[i % 3], "password": "wrong"})
+                for i in range(12)
+            ))
+
+    responses = run(scenario())
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [401] * 3 + [429] * 9
+    assert all(response.headers["retry-after"] for response in responses if response.status_code == 429)
+    assert (limiter.allowed, limiter.limited) == (3, 9)
+
+def test_login_attempts_from_another_address_are_not_locked_out(db, run, client, monkeypatch):
+    # Spamming an account from one address does not lock its owner out elsewhere
+    limiter = RateLimiter("login", per_minute=0, burst=1)
+    monkeypatch.setattr(admission_module, "login_limiter", limiter)
+    form = {"username": "member@example.com", "password": "wrong"}
+
+    async def scenario():
+        async with client("10.0.0.1") as attacker, client("10.0.0.2") as owner:
+            spam = [await attacker.post("/auth/login", data=form) for _ in range(3)]
+            return spam, await owner.post("/auth/login", data=form)
+
+    spam, owner = run(scenario())
+    assert [response.status_code for response in spam] == [401, 429, 429]
+    assert owner.status_code == 401
+
+def test_disabled_rate_limiter_never_limits():
+    limiter = RateLimiter("login", per_minute=0, burst=1, enabled=False)
+    for _ in range(3):
+        limiter.check("member@example.com")
+    assert limiter.limited == 0
+
+def test_rate_limiter_buckets_are_per_key():
+    limiter = RateLimiter("register", per_minute=0, burst=2, max_keys=2)
+    assert [limiter.take(1), limiter.take(1), limiter.take(2)] == [0, 0, 0]
+    assert limiter.take(1) > 0
+    # Dropping the least recently used bucket gives it a full burst again
+    limiter.take(2)
+    limiter.take(3)
+    assert limiter.take(1) == 0
+
+def test_shed_response_has_cors_headers(run, client, monkeypatch):
+    # CORS is the outermost middleware, browsers can read the 503 of admission control
+    lane = admission_module.admission.lanes["polling"]
+    monkeypatch.setattr(lane, "limit", 0)
+    monkeypatch.setattr(lane, "queue_size", 0)
+
+    async def scenario():
+        async with client() as http:
+            return await http.get("/events", headers={"Origin": "https://app.example.com"})
+
+    response = run(scenario())
+    assert response.status_code == 503
+    assert response.headers["retry-after"]
+    assert response.headers["access-control-allow-origin"]
+
+
+def _controller(**limits) -> AdmissionController:
+    controller = AdmissionController(max_concurrency=limits.pop("shared", 10))
+    for name, limit in limits.items():
+        controller.lanes[name].limit = limit
+    return controller
+
+def test_lane_at_its_own_limit_does_not_hold_lower_lanes():
+    async def scenario():
+        controller = _controller(auth=1)
+        auth, polling = controller.lanes["auth"], controller.lanes["polling"]
+        assert await controller.acquire(auth)
+        waiting = asyncio.create_task(controller.acquire(auth))
+        await asyncio.sleep(0)
+        assert len(auth.waiting) == 1
+        # The shared budget has room and the auth waiter could not use it
+        assert await asyncio.wait_for(controller.acquire(polling), timeout=0.1)
+        controller.release(auth)
+        assert await waiting
+        assert (auth.active, polling.active) == (1, 1)
+
+    asyncio.run(scenario())
+
+def test_freed_shared_slot_goes_to_the_highest_priority_lane():
+    async def scenario():
+        controller = _controller(shared=1)
+        auth, polling = controller.lanes["auth"], controller.lanes["polling"]
+        assert await controller.acquire(polling)
+        polling_waiter = asyncio.create_task(controller.acquire(polling))
+        auth_waiter = asyncio.create_task(controller.acquire(auth))
+        await asyncio.sleep(0)
+        controller.release(polling)
+        assert await auth_waiter
+        assert not polling_waiter.done()
+        controller.release(auth)
+        assert await polling_waiter
+
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("queue_size", [0, 1])
+def test_requests_are_shed_when_the_queue_is_full_or_the_deadline_passes(queue_size):
+    async def scenario():
+        controller = _controller(polling=1)
+        polling = controller.lanes["polling"]
+        polling.queue_size, polling.wait_seconds = queue_size, 0.01
+        assert await controller.acquire(polling)
+        assert not await controller.acquire(polling)
+        assert (polling.shed_full, polling.shed_deadline) == ((1, 0) if queue_size == 0 else (0, 1))
+        assert not polling.waiting
+
+    asyncio.run(scenario())
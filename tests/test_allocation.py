@@ -0,0 +1,94 @@
+from datetime import datetime, time, timedelta
+from sqlalchemy import update
+from sqlmodel import Session, select
+from models.models import Class, User, UserClassLink
+from api.allocation import FlowNetwork, plan_allocation
+from api.routers import recovery as recovery_router
+
+# 2030-01-07 is a Monday
+MONDAY = datetime(2030, 1, 7)
+
+
+def _at(days: int, hour: int) -> datetime:
+    return MONDAY + timedelta(days=days, hours=hour)
+
+def test_min_cost_flow_prefers_cheap_edges_up_to_capacity():
+    network = FlowNetwork(4)
+    cheap = network.add_edge(0, 1, 2, 1)
+    expensive = network.add_edge(0, 2, 5, 5)
+    network.add_edge(1, 3, 5, 0)
+    network.add_edge(2, 3, 5, 0)
+    assert network.min_cost_flow(0, 3) == (7, 2 + 25)
+    assert (network.flow(cheap), network.flow(expensive)) == (2, 5)
+
+def test_class_capacity_limits_the_assignments():
+    members = [(user_id, 3.0, 1) for user_id in (1, 2, 3)]
+    assignments, dropped = plan_allocation(members, [(10, _at(0, 19), 3.0, 2)], {}, {})
+    assert sum(len(class_ids) for class_ids in assignments.values()) == 2
+    assert all(class_ids == [10] for class_ids in assignments.values())
+    assert dropped == 0
+
+def test_credits_limit_the_assignments_and_a_class_is_taken_once():
+    classes = [(10, _at(0, 19), 3.0, 4), (11, _at(0, 19), 3.0, 4), (12, _at(1, 19), 3.0, 4)]
+    assignments, _ = plan_allocation([(1, 3.0, 2), (2, 3.0, 5)], classes, {}, {})
+    assert len(assignments[1]) == 2
+    # Three classes, each at most once
+    assert sorted(assignments[2]) == [10, 11, 12]
+
+def test_members_get_their_own_level_and_never_a_harder_class():
+    classes = [(10, _at(0, 19), 2.0, 4), (11, _at(0, 19), 3.0, 4), (12, _at(0, 19), 4.0, 4)]
+    assert plan_allocation([(1, 3.0, 1)], classes, {}, {})[0] == {1: [11]}
+    # More credits spill to the easier class, not the harder one
+    assert sorted(plan_allocation([(1, 3.0, 3)], classes, {}, {})[0][1]) == [10, 11]
+
+def test_windows_filter_weekday_time_and_level_gap():
+    classes = [
+        (10, _at(0, 19), 3.0, 4),  # Monday 19:00
+        (11, _at(1, 19), 3.0, 4),  # Tuesday
+        (12, _at(0, 21), 3.0, 4),  # Monday, after the window
+        (13, _at(0, 18), 2.0, 4),  # Monday, too easy for member 2
+    ]
+    windows = {
+        1: [(0, time(18), time(20), None)],
+        2: [(None, time(18), time(20), 0.5)],
+    }
+    assignments, _ = plan_allocation([(1, 3.0, 5), (2, 3.0, 5)], classes, windows, {})
+    assert sorted(assignments[1]) == [10, 13]
+    assert sorted(assignments[2]) == [10, 11]
+
+def test_members_are_not_assigned_classes_they_are_in():
+    classes = [(10, _at(0, 19), 3.0, 1), (11, _at(0, 19), 3.0, 1)]
+    assignments, dropped = plan_allocation([(1, 3.0, 1), (2, 3.0, 1)], classes, {}, {1: {10}})
+    assert assignments == {1: [11], 2: [10]}
+    assert dropped == 0
+
+def test_seats_taken_after_planning_are_dropped_before_writing(db, member, add_rows, run, client, monkeypatch):
+    _, headers = member(is_admin=True)
+    early, late = member(classes_to_recover=1)[0], member(classes_to_recover=1)[0]
+    lesson, = add_rows(Class(coach_id=1, schedule=datetime.utcnow() + timedelta(days=2), level_required=3.0, max_students=2))
+
+    def plan_then_register(*args):
+        # A registration takes a seat while the planner runs, nothing is locked meanwhile
+        planned = plan_allocation(*args)
+        with Session(db) as session:
+            session.add(UserClassLink(user_id=late.id, class_id=lesson.id))
+            session.exec(update(Class).where(Class.id == lesson.id).values(student_count=Class.student_count + 1))
+            session.exec(update(User).where(User.id == late.id).values(classes_to_recover=0))
+            session.commit()
+        return planned
+    monkeypatch.setattr(recovery_router, "plan_allocation", plan_then_register)
+
+    async def scenario():
+        async with client() as http:
+            return await http.post("/recovery/allocate", json={"dry_run": False, "include_assignments": True}, headers=headers)
+
+    response = run(scenario())
+    assert response.status_code == 200
+    report = response.json()
+    # Both members were planned, only one seat was left
+    assert report["stale_assignments"] == 1
+    assert report["assigned"] == 1
+    with Session(db) as session:
+        assert session.get(Class, lesson.id).student_count == 2
+        assert sorted(session.exec(select(UserClassLink.user_id)).all()) == sorted([early.id, late.id])
+        assert session.get(User, early.id).classes_to_recover == 0
@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from models.models import Event
+from api import loader as loader_module
+from api.loader import Loader
+
+
+def _event(**fields) -> Event:
+    return Event(**{
+        "name": "Americano", "type": "tournament", "date": datetime.utcnow() + timedelta(days=3),
+        "min_level": 1.0, "max_slots": 8, "price": 10.0, **fields,
+    })
+
+@pytest.fixture
+def fetch_calls(monkeypatch):
+    # kind -> keys of every fetch, the real fetchers still run
+    calls = {}
+    for kind, fetch in list(loader_module.FETCHERS.items()):
+        def counted(session, keys, kind=kind, fetch=fetch):
+            calls.setdefault(kind, []).append(sorted(keys))
+            return fetch(session, keys)
+        monkeypatch.setitem(loader_module.FETCHERS, kind, counted)
+    return calls
+
+def _batch(run, client, headers, queries):
+    async def scenario():
+        async with client() as http:
+            return await http.post("/batch", json={"queries": queries}, headers=headers)
+    response = run(scenario())
+    assert response.status_code == 200
+    return {result["key"]: result for result in response.json()["results"]}
+
+def test_identical_lookups_are_one_query(db, member, add_rows, run, client, fetch_calls):
+    _, headers = member()
+    first, second = add_rows(_event(), _event(name="Mexicano"))
+    queries = [{"key": f"event{number}", "op": "event", "id": first.id} for number in range(5)]
+    queries += [{"key": f"roster{number}", "op": "event_participants", "id": event.id} for number, event in enumerate((first, second, first))]
+
+    results = _batch(run, client, headers, queries)
+    assert all(result["status"] == 200 for result in results.values())
+    assert results["event0"]["body"]["name"] == "Americano"
+    # The rosters also load their events, second is fetched in the same IN query as first
+    assert fetch_calls["event"] == [sorted([first.id, second.id])]
+    assert fetch_calls["event_participants"] == [sorted([first.id, second.id])]
+
+def test_each_query_gets_its_own_status(db, member, add_rows, run, client):
+    _, headers = member()
+    event, = add_rows(_event())
+    results = _batch(run, client, headers, [
+        {"key": "found", "op": "event", "id": event.id},
+        {"key": "missing", "op": "event", "id": event.id + 100},
+        {"key": "no_id", "op": "event"},
+        {"key": "admins_only", "op": "class_students", "id": 1},
+    ])
+    assert {key: result["status"] for key, result in results.items()} == {"found": 200, "missing": 404, "no_id": 422, "admins_only": 403}
+
+def test_failed_lookup_is_a_500_for_its_queries_only(db, member, add_rows, run, client, monkeypatch):
+    _, headers = member()
+    event, = add_rows(_event())
+
+    async def broken(session, keys):
+        raise RuntimeError("lookup failed")
+    monkeypatch.setitem(loader_module.FETCHERS, "class", broken)
+
+    results = _batch(run, client, headers, [
+        {"key": "event", "op": "event", "id": event.id},
+        {"key": "class1", "op": "class", "id": 1},
+        {"key": "class2", "op": "class", "id": 2},
+    ])
+    assert results["event"]["status"] == 200
+    assert [results[key]["status"] for key in ("class1", "class2")] == [500, 500]
+    assert results["class1"]["body"] == {"detail": "Internal server error"}
+
+def test_failed_loads_are_not_cached():
+    attempts = []
+
+    async def flaky(session, keys):
+        attempts.append(keys)
+        if len(attempts) == 1:
+            raise RuntimeError("lookup failed")
+        return {key: key * 10 for key in keys}
+
+    async def scenario():
+        loader = Loader(None, {"thing": flaky})
+        with pytest.raises(RuntimeError):
+            await loader.load("thing", 1)
+        assert await loader.load_many("thing", [1, 2, 1]) == [10, 20, 10]
+        # Resolved keys are cached for the request
+        assert await loader.load("thing", 2) == 20
+
+    asyncio.run(scenario())
+    assert attempts == [[1], [1, 2]]
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from email.utils import format_datetime, parsedate_to_datetime
+from models.models import Event
+from api.cache import calendar_feed_cache, calendar_token_cache
+from api.calendar import _escape, _fold
+
+
+def test_escape_text_values():
+    assert _escape("a,b;c\\d") == "a\\,b\\;c\\\\d"
+    # Every kind of line break becomes one escaped newline
+    assert _escape("one\ntwo\r\nthree\rfour") == "one\\ntwo\\nthree\\nfour"
+
+def test_fold_keeps_lines_within_75_octets_without_splitting_characters():
+    line = "SUMMARY:" + "Pádel ñ 🎾 " * 20
+    folded = _fold(line)
+    physical = folded.split("\r\n")
+    assert len(physical) > 1
+    assert all(len(part.encode()) <= 75 for part in physical)
+    assert all(part.startswith(" ") for part in physical[1:])
+    # Unfolding gives the line back
+    assert physical[0] + "".join(part[1:] for part in physical[1:]) == line
+
+def test_short_lines_are_not_folded():
+    assert _fold("SUMMARY:" + "x" * 67) == "SUMMARY:" + "x" * 67
+
+def test_feed_conditional_requests(db, member, add_rows, run, client):
+    calendar_feed_cache.clear()
+    calendar_token_cache.clear()
+    _, headers = member()
+    event, later = add_rows(
+        Event(name="Americano, night; edition", type="tournament", date=datetime.utcnow() + timedelta(days=3), min_level=1.0, max_slots=8, price=10.0),
+        Event(name="Mexicano", type="tournament", date=datetime.utcnow() + timedelta(days=5), min_level=1.0, max_slots=8, price=10.0),
+    )
+
+    async def scenario():
+        async with client() as http:
+            await http.post(f"/events/{event.id}/register", headers=headers)
+            url = (await http.get("/calendar/link", headers=headers)).json()["url"]
+            first = await http.get(url)
+            etag, last_modified = first.headers["etag"], first.headers["last-modified"]
+            responses = {
+                "etag": await http.get(url, headers={"If-None-Match": etag}),
+                "other_etag": await http.get(url, headers={"If-None-Match": 'W/"other"'}),
+                "same_date": await http.get(url, headers={"If-Modified-Since": last_modified}),
+                "older_date": await http.get(url, headers={"If-Modified-Since": format_datetime(parsedate_to_datetime(last_modified) - timedelta(hours=1), usegmt=True)}),
+                # If-None-Match wins over If-Modified-Since
+                "both": await http.get(url, headers={"If-None-Match": 'W/"other"', "If-Modified-Since": last_modified}),
+            }
+            await http.post(f"/events/{later.id}/register", headers=headers)
+            changed = await http.get(url, headers={"If-None-Match": etag})
+            return first, responses, changed
+
+    first, responses, changed = run(scenario())
+    assert first.status_code == 200
+    assert first.headers["content-type"].startswith("text/calendar")
+    assert "SUMMARY:Americano\\, night\\; edition\r\n" in first.text
+    assert {name: response.status_code for name, response in responses.items()} == {
+        "etag": 304, "other_etag": 200, "same_date": 304, "older_date": 200, "both": 200,
+    }
+    assert responses["etag"].content == b""
+    # A registration changes the feed and its tag
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != first.headers["etag"]
+    assert "SUMMARY:Mexicano" in changed.text
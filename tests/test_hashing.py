@@ -0,0 +1,50 @@
+import asyncio
+import os
+import signal
+import pytest
+from fastapi import HTTPException
+from api import hashing
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # One spawned worker, shut down at the end
+    monkeypatch.setattr(hashing, "PASSWORD_HASH_WORKERS", 1)
+    hashing.shutdown()
+    yield
+    hashing.shutdown()
+
+def test_calls_over_max_pending_get_a_503(monkeypatch):
+    monkeypatch.setattr(hashing, "PASSWORD_HASH_MAX_PENDING", 1)
+    rejected = hashing.stats.rejected
+
+    async def scenario():
+        return await asyncio.gather(hashing.hash_password("first"), hashing.hash_password("second"), return_exceptions=True)
+
+    hashed, error = asyncio.run(scenario())
+    assert hashed.startswith("$2b$")
+    assert isinstance(error, HTTPException) and error.status_code == 503
+    assert error.headers["Retry-After"]
+    assert hashing.stats.rejected == rejected + 1
+    assert hashing._pending == 0
+
+def test_broken_pool_is_replaced(pool):
+    async def scenario():
+        hashed = await hashing.hash_password("secret")
+        broken = hashing._executor
+        # A worker killed by the OOM killer breaks the whole pool
+        for process in list(broken._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+        for _ in range(100):
+            if broken._broken:
+                break
+            await asyncio.sleep(0.05)
+        with pytest.raises(HTTPException) as failed:
+            await hashing.verify_password("secret", hashed)
+        assert failed.value.status_code == 503
+        assert hashing._executor is None
+        # The next call runs on a new pool
+        assert await hashing.verify_password("secret", hashed) == (True, None)
+        assert hashing._executor is not broken
+
+    asyncio.run(scenario())
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+import pytest
+from api import http_cache
+from api.http_cache import _pick_encoding
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate, br", "br"),
+    ("br;q=0.1, gzip;q=1.0", "gzip"),
+    ("gzip;q=0.5, br;q=0.5", "br"),
+    ("gzip", "gzip"),
+    ("br;q=0, gzip;q=0", None),
+    ("identity", None),
+    ("", None),
+    ("*;q=0.2, gzip;q=0.8", "gzip"),
+    ("*", "br"),
+    ("gzip;level=1;q=0.3, br;q=0.2", "gzip"),
+    ("br;q=bad, gzip", "gzip"),
+])
+def test_pick_encoding_by_quality(header, expected):
+    assert _pick_encoding(header) == expected
+
+def test_pick_encoding_without_brotli(monkeypatch):
+    monkeypatch.setattr(http_cache, "brotli", None)
+    assert _pick_encoding("br, gzip;q=0.1") == "gzip"
+    assert _pick_encoding("br") is None
+
+def test_unchanged_listing_is_a_304(db, member, run, client):
+    _, headers = member(level=5.0)
+    _, admin_headers = member(is_admin=True)
+    event = {"name": "Night league", "type": "league", "date": (datetime.utcnow() + timedelta(days=2)).isoformat(), "min_level": 1.0, "max_slots": 4, "price": 5.0}
+
+    async def scenario():
+        async with client() as http:
+            first = await http.get("/events", headers=headers)
+            tag = first.headers["etag"]
+            revalidated = await http.get("/events", headers={**headers, "If-None-Match": tag})
+            await http.post("/events/", json=event, headers=admin_headers)
+            changed = await http.get("/events", headers={**headers, "If-None-Match": tag})
+            return first, revalidated, changed
+
+    first, revalidated, changed = run(scenario())
+    assert first.status_code == 200
+    assert first.headers["cache-control"] == http_cache.TAGGED_CACHE_CONTROL
+    assert revalidated.status_code == 304
+    assert revalidated.headers["etag"] == first.headers["etag"]
+    assert revalidated.content == b""
+    # A write to the table changes the tag
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != first.headers["etag"]
+    assert [item["name"] for item in changed.json()["items"]] == ["Night league"]
@@ -0,0 +1,161 @@
+import hashlib
+import io
+import os
+import pytest
+from PIL import Image
+from sqlmodel import Session, select
+from models.models import AnnouncementImage
+from api.images import VARIANT_VERSION, image_worker, original_key, sniff_extension, variant_key
+from api.routers.images import _parse_range
+from api.storage import Storage, storage
+
+
+def _png(width: int = 640, height: int = 480) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 40, 40)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+def _stored_files() -> set:
+    return {
+        os.path.relpath(os.path.join(folder, name), storage.root)
+        for folder, _, names in os.walk(storage.root) for name in names
+        if not os.path.relpath(folder, storage.root).startswith("tmp")
+    }
+
+@pytest.fixture
+def announcement(db, member, run, client):
+    # (announcement id, admin headers)
+    _, headers = member(is_admin=True)
+
+    async def create():
+        async with client() as http:
+            return (await http.post("/announcements", json={"title": "Courts", "content": "New courts"}, headers=headers)).json()["id"]
+    return run(create()), headers
+
+def _upload(run, client, announcement_id, headers, files):
+    async def scenario():
+        async with client() as http:
+            return await http.post(f"/announcements/{announcement_id}/images", files=files, headers=headers)
+    return run(scenario())
+
+def test_incomplete_storage_backend_fails_when_constructed():
+    class NoRanges(Storage):
+        async def open_upload(self): ...
+        async def save(self, key, data): ...
+        async def read(self, key): ...
+        async def size(self, key): ...
+        async def delete(self, key): ...
+
+    with pytest.raises(TypeError):
+        NoRanges()
+
+@pytest.mark.parametrize("head, expected", [
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF", "jpg"),
+    (b"\x89PNG\r\n\x1a\n\x00\x00", "png"),
+    (b"GIF89a\x01\x00", "gif"),
+    (b"GIF87a\x01\x00", "gif"),
+    (b"RIFF\x10\x00\x00\x00WEBPVP8 ", "webp"),
+    (b"RIFF\x10\x00\x00\x00WAVEfmt ", None),
+    (b"<svg xmlns=", None),
+    (b"", None),
+])
+def test_sniff_extension(head, expected):
+    assert sniff_extension(head) == expected
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-3", (0, 3)),
+    ("bytes=4-", (4, 9)),
+    ("bytes=-3", (7, 9)),
+    ("bytes=-30", (0, 9)),
+    ("bytes=5-100", (5, 9)),
+    ("bytes=10-", None),
+    ("bytes=5-2", None),
+    ("bytes=-", None),
+    ("bytes=0-1,4-5", None),
+    ("items=0-3", None),
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, 10) == expected
+
+def test_range_requests(db, run, client):
+    data = bytes(range(10))
+    content_hash = hashlib.sha256(data).hexdigest()
+    run(storage.save(original_key(content_hash, "png"), data))
+    url = f"/images/{content_hash}/original.png"
+    etag = f'"{content_hash}-original.png"'
+
+    async def scenario():
+        async with client() as http:
+            return {
+                "full": await http.get(url),
+                "range": await http.get(url, headers={"Range": "bytes=2-5"}),
+                "suffix": await http.get(url, headers={"Range": "bytes=-3"}),
+                "unsatisfiable": await http.get(url, headers={"Range": "bytes=20-"}),
+                "same_file": await http.get(url, headers={"Range": "bytes=2-5", "If-Range": etag}),
+                "other_file": await http.get(url, headers={"Range": "bytes=2-5", "If-Range": '"other"'}),
+                "cached": await http.get(url, headers={"If-None-Match": etag}),
+                "missing": await http.get(f"/images/{'0' * 64}/original.png"),
+                "bad_name": await http.get(f"/images/{content_hash}/original.exe"),
+            }
+
+    responses = run(scenario())
+    assert (responses["full"].status_code, responses["full"].content) == (200, data)
+    assert responses["full"].headers["accept-ranges"] == "bytes"
+    assert (responses["range"].status_code, responses["range"].content) == (206, data[2:6])
+    assert responses["range"].headers["content-range"] == "bytes 2-5/10"
+    assert (responses["suffix"].status_code, responses["suffix"].content) == (206, data[7:])
+    assert responses["unsatisfiable"].status_code == 416
+    assert responses["unsatisfiable"].headers["content-range"] == "bytes */10"
+    assert responses["same_file"].status_code == 206
+    assert (responses["other_file"].status_code, responses["other_file"].content) == (200, data)
+    assert responses["cached"].status_code == 304
+    assert responses["missing"].status_code == 404
+    assert responses["bad_name"].status_code == 404
+
+def test_uploaded_image_gets_versioned_variants(announcement, run, client, db):
+    announcement_id, headers = announcement
+    data = _png()
+    content_hash = hashlib.sha256(data).hexdigest()
+
+    response = _upload(run, client, announcement_id, headers, [("files", ("court.png", data, "text/plain"))])
+    assert response.status_code == 200
+    image, = response.json()
+    # The type comes from the bytes, not from the declared content type
+    assert image["original"].endswith(f"{content_hash}/original.png")
+    assert (image["status"], image["thumb"]) == ("pending", None)
+
+    run(image_worker.process(content_hash, "png"))
+    with Session(db) as session:
+        row = session.exec(select(AnnouncementImage)).one()
+    assert (row.status, row.width, row.height, row.variant_version, row.claimed_at) == ("ready", 640, 480, VARIANT_VERSION, None)
+
+    async def fetch():
+        async with client() as http:
+            page = (await http.get("/announcements", headers=headers)).json()
+            thumb_url = page["items"][0]["images"][0]["thumb"]
+            return thumb_url, await http.get(thumb_url)
+
+    thumb_url, thumb = run(fetch())
+    assert thumb_url.endswith(f"thumb-{VARIANT_VERSION}.webp")
+    assert thumb.status_code == 200 and thumb.headers["content-type"] == "image/webp"
+    with Image.open(io.BytesIO(thumb.content)) as rendered:
+        assert rendered.size == (320, 240)
+    # A second run finds nothing to claim
+    run(image_worker.process(content_hash, "png"))
+    assert variant_key(content_hash, "thumb", VARIANT_VERSION) in _stored_files()
+
+def test_rejected_upload_leaves_no_files(announcement, run, client):
+    announcement_id, headers = announcement
+    before = _stored_files()
+    # An image no other test stores, files are shared by content
+    response = _upload(run, client, announcement_id, headers, [
+        ("files", ("court.png", _png(64, 48), "image/png")),
+        ("files", ("notes.txt", b"not an image at all", "image/png")),
+    ])
+    assert response.status_code == 415
+    assert _stored_files() == before
+
+def test_upload_to_a_missing_announcement_is_a_404(db, member, run, client):
+    _, headers = member(is_admin=True)
+    response = _upload(run, client, 999, headers, [("files", ("court.png", _png(), "image/png"))])
+    assert response.status_code == 404
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from models.models import Event
+from api.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    date = datetime(2030, 1, 7, 18, 30)
+    assert decode_cursor(encode_cursor(date, 42), datetime, int) == (date, 42)
+
+@pytest.mark.parametrize("cursor", [
+    "garbage!", "", encode_cursor(1), encode_cursor("not a date", 1), encode_cursor(None, 1), encode_cursor([1], 2), "eyJh",
+])
+def test_malformed_cursor_is_a_400(cursor):
+    with pytest.raises(HTTPException) as failed:
+        decode_cursor(cursor, datetime, int)
+    assert failed.value.status_code == 400
+
+def test_pages_walk_ties_on_the_sort_key(db, member, add_rows, run, client):
+    _, headers = member()
+    date = datetime.utcnow() + timedelta(days=3)
+    # Five events at the same time, ordered by id within it, and one later
+    events = add_rows(*(
+        Event(name=f"Event {number}", type="tournament", date=date + timedelta(days=number // 5), min_level=1.0, max_slots=8, price=10.0)
+        for number in range(6)
+    ))
+
+    async def scenario():
+        async with client() as http:
+            pages, cursor = [], None
+            while True:
+                response = await http.get("/events", params={"limit": 2, **({"cursor": cursor} if cursor else {})}, headers=headers)
+                assert response.status_code == 200
+                pages.append(response.json())
+                cursor = response.json()["next_cursor"]
+                if cursor is None:
+                    return pages, await http.get("/events", params={"cursor": "not-a-cursor"}, headers=headers)
+
+    pages, malformed = run(scenario())
+    assert [[item["id"] for item in page["items"]] for page in pages] == [[event.id for event in events[i:i + 2]] for i in range(0, 6, 2)]
+    assert pages[-1]["next_cursor"] is None
+    assert malformed.status_code == 400
@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime, timedelta
+from sqlmodel import Session, func, select
+from models.models import Event, Class, User, UserEventLink, UserClassLink
+
+
+def _event(**fields) -> Event:
+    return Event(**{
+        "name": "Americano", "type": "tournament", "date": datetime.utcnow() + timedelta(days=3),
+        "min_level": 1.0, "max_slots": 8, "price": 10.0, **fields,
+    })
+
+def _class(**fields) -> Class:
+    return Class(**{"coach_id": 1, "schedule": datetime.utcnow() + timedelta(days=2), "level_required": 3.0, "max_students": 4, **fields})
+
+def _register_all(run, client, path, members):
+    async def scenario():
+        async with client() as http:
+            return await asyncio.gather(*(http.post(path, headers=headers) for _, headers in members))
+    return run(scenario())
+
+def test_concurrent_registrations_never_overbook_an_event(db, member, add_rows, run, client):
+    event, = add_rows(_event(max_slots=3))
+    members = [member() for _ in range(8)]
+
+    responses = _register_all(run, client, f"/events/{event.id}/register", members)
+    assert sorted(response.status_code for response in responses) == [200] * 3 + [400] * 5
+    assert all(response.json()["detail"] == "Event is full" for response in responses if response.status_code == 400)
+    with Session(db) as session:
+        assert session.get(Event, event.id).participant_count == 3
+        assert session.exec(select(func.count()).select_from(UserEventLink)).one() == 3
+
+def test_concurrent_class_registrations_spend_credits_of_the_winners_only(db, member, add_rows, run, client):
+    lesson, = add_rows(_class(max_students=2))
+    members = [member(classes_to_recover=1) for _ in range(5)]
+
+    responses = _register_all(run, client, f"/classes/{lesson.id}/register", members)
+    assert sorted(response.status_code for response in responses) == [200] * 2 + [400] * 3
+    winners = {user.id for (user, _), response in zip(members, responses) if response.status_code == 200}
+    with Session(db) as session:
+        assert session.get(Class, lesson.id).student_count == 2
+        assert set(session.exec(select(UserClassLink.user_id)).all()) == winners
+        credits = {user.id: session.get(User, user.id).classes_to_recover for user, _ in members}
+    assert credits == {user.id: 0 if user.id in winners else 1 for user, _ in members}
+
+def test_duplicate_class_registration_rolls_back_slot_and_credit(db, member, add_rows, run, client):
+    lesson, = add_rows(_class())
+    user, headers = member(classes_to_recover=2)
+
+    async def scenario():
+        async with client() as http:
+            first = await http.post(f"/classes/{lesson.id}/register", headers=headers)
+            second = await http.post(f"/classes/{lesson.id}/register", headers=headers)
+            return first, second
+
+    first, second = run(scenario())
+    assert first.status_code == 200 and first.json()["remaining_credits"] == 1
+    assert second.status_code == 400
+    assert second.json()["detail"] == "User is already registered for this class"
+    with Session(db) as session:
+        assert session.get(Class, lesson.id).student_count == 1
+        assert session.get(User, user.id).classes_to_recover == 1
+
+def test_class_registration_without_credits_leaves_the_slot(db, member, add_rows, run, client):
+    lesson, = add_rows(_class(max_students=1))
+    _, headers = member(classes_to_recover=0)
+
+    response, = _register_all(run, client, f"/classes/{lesson.id}/register", [(None, headers)])
+    assert response.status_code == 400
+    assert response.json()["detail"] == "User has no classes to recover"
+    with Session(db) as session:
+        assert session.get(Class, lesson.id).student_count == 0
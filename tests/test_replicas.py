@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel, create_engine
+import db.session as db_session
+from db.replicas import PIN_COOKIE, Replica, ReplicaSet
+from models.models import Event
+
+
+@pytest.fixture
+def replica_set(db, tmp_path, monkeypatch):
+    # An empty second database, a replica that has not seen any write yet
+    path = tmp_path / "replica.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(sync_engine)
+    replicas = ReplicaSet([Replica("replica0", sync_engine, create_async_engine(f"sqlite+aiosqlite:///{path}"))])
+    monkeypatch.setattr(db_session, "replicas", replicas)
+    yield replicas
+    sync_engine.dispose()
+
+def _event(**fields) -> Event:
+    return Event(**{
+        "name": "Americano", "type": "tournament", "date": datetime.utcnow() + timedelta(days=3),
+        "min_level": 1.0, "max_slots": 8, "price": 10.0, **fields,
+    })
+
+def _read_after_write(replica_set, run, client, write, read):
+    # Runs write, then read twice: once with the pin cookie only (as on another worker, which has no
+    # pin in memory) and once without it. Returns the write, pinned and unpinned responses
+    async def scenario():
+        try:
+            async with client() as http:
+                written = await write(http)
+                pin = written.cookies.get(PIN_COOKIE)
+                replica_set._pins.clear()
+                http.cookies.clear()
+                pinned = await read(http, {"Cookie": f"{PIN_COOKIE}={pin}"} if pin else {})
+                unpinned = await read(http, {})
+                return written, pinned, unpinned
+        finally:
+            await replica_set.replicas[0].async_engine.dispose()
+    return run(scenario())
+
+def test_route_returning_its_own_response_sets_the_pin(replica_set, member, run, client):
+    # create_event returns an ORJSONResponse, headers of the injected Response would be lost
+    admin, headers = member(is_admin=True)
+    payload = {"name": "Night league", "type": "league", "date": (datetime.utcnow() + timedelta(days=2)).isoformat(), "min_level": 1.0, "max_slots": 4, "price": 5.0}
+
+    written, pinned, unpinned = _read_after_write(
+        replica_set, run, client,
+        lambda http: http.post("/events/", json=payload, headers=headers),
+        lambda http, cookie: http.get("/events", headers={**headers, **cookie}),
+    )
+    assert written.status_code == 200
+    assert written.cookies.get(PIN_COOKIE)
+    assert [event["id"] for event in pinned.json()["items"]] == [written.json()["id"]]
+    # Without the pin the listing is read from the replica
+    assert unpinned.json()["items"] == []
+
+def test_registration_is_seen_by_the_next_home_summary(replica_set, member, add_rows, run, client):
+    user, headers = member()
+    event, = add_rows(_event())
+
+    written, pinned, unpinned = _read_after_write(
+        replica_set, run, client,
+        lambda http: http.post(f"/events/{event.id}/register", headers=headers),
+        lambda http, cookie: http.get("/home/summary", headers={**headers, **cookie}),
+    )
+    assert written.status_code == 200
+    assert [entry["id"] for entry in pinned.json()["upcoming_events"]] == [event.id]
+    assert unpinned.json()["upcoming_events"] == []
+
+def test_reads_without_writes_are_not_pinned(replica_set, member, run, client):
+    user, headers = member()
+
+    async def scenario():
+        try:
+            async with client() as http:
+                return await http.get("/home/summary", headers=headers)
+        finally:
+            await replica_set.replicas[0].async_engine.dispose()
+
+    response = run(scenario())
+    assert response.status_code == 200
+    assert PIN_COOKIE not in response.cookies
+    assert not replica_set.is_pinned(user.id)
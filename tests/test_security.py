@@ -0,0 +1,37 @@
+import asyncio
+from sqlalchemy import update
+from sqlmodel import Session
+from models.models import User
+from api.cache import token_version_cache
+
+
+def test_bumped_token_version_rejects_old_tokens_after_the_ttl(db, member, run, client, monkeypatch):
+    token_version_cache.clear()
+    monkeypatch.setattr(token_version_cache, "ttl", 0.2)
+    user, headers = member()
+
+    async def get(http):
+        return (await http.get("/home/summary", headers=headers)).status_code
+
+    async def scenario():
+        async with client() as http:
+            statuses = [await get(http)]
+            # Revoked through another worker, this one only sees it when its cached version expires
+            with Session(db) as session:
+                session.exec(update(User).where(User.id == user.id).values(token_version=User.token_version + 1))
+                session.commit()
+            statuses.append(await get(http))
+            await asyncio.sleep(0.3)
+            statuses.append(await get(http))
+            return statuses
+
+    assert run(scenario()) == [200, 200, 401]
+
+def test_token_version_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(token_version_cache, "maxsize", 3)
+    token_version_cache.clear()
+    for user_id in range(10):
+        token_version_cache.set(user_id, (0,))
+    assert token_version_cache.stats()["size"] == 3
+    assert token_version_cache.get(9) == (0,)
+    assert token_version_cache.get(0) is None
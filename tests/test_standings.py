@@ -0,0 +1,73 @@
+from datetime import datetime
+import pytest
+from sqlmodel import Session, select
+from models.models import Team, TeamStanding
+from api.standings import TOTAL_FIELDS, parse_score
+from db.standings import compute, recompute
+
+
+@pytest.mark.parametrize("score, expected", [
+    ("6-4 6-3", (True, 2, 0, 12, 7)),
+    ("4-6, 7-6(5) 6-2", (True, 2, 1, 17, 14)),
+    ("6-7(3) 3-6", (False, 0, 2, 9, 13)),
+    # The match tiebreak is one game for its winner
+    ("6-4 3-6 10-8", (True, 2, 1, 10, 10)),
+    ("3-6 6-4 8-10", (False, 1, 2, 9, 11)),
+    ("6-4 3-6 12-10", (True, 2, 1, 10, 10)),
+])
+def test_parse_score(score, expected):
+    assert tuple(parse_score(score))[1:] == expected
+
+@pytest.mark.parametrize("score", [
+    None, "", "6-4", "6-4 6-3 6-2", "6-4 x-3", "6-5 6-3", "8-6 6-3",
+    # A match tiebreak only decides the third set
+    "10-8 6-3",
+    "6-4 3-6 10-9", "6-4 3-6 13-10",
+    # Unfinished: one set each, or the deciding set still running
+    "6-4 3-6", "6-4 3-6 4-3",
+])
+def test_parse_score_rejects_invalid_and_unfinished_matches(score):
+    with pytest.raises(ValueError):
+        parse_score(score)
+
+def _standings(db) -> dict:
+    # Same shape as the recompute, emptied rows left out
+    with Session(db) as session:
+        return {
+            row.team_id: {"competition_name": row.competition_name, **{name: getattr(row, name) for name in TOTAL_FIELDS}}
+            for row in session.exec(select(TeamStanding).where(TeamStanding.played > 0))
+        }
+
+def test_incremental_standings_match_a_full_recompute(db, member, add_rows, run, client):
+    _, headers = member(is_admin=True)
+    first, second, other = add_rows(Team(name="A", competition_name="Liga"), Team(name="B", competition_name="Liga"), Team(name="C", competition_name="Copa"))
+    date = datetime(2026, 5, 1, 18).isoformat()
+
+    async def scenario():
+        async with client() as http:
+            created = []
+            for team, score in ((first, "6-4 6-3"), (first, "4-6 6-4 10-7"), (second, "3-6 2-6"), (second, None), (other, "7-5 6-7(4) 6-0")):
+                response = await http.post("/matches/", json={"team_id": team.id, "date": date, "score": score}, headers=headers)
+                assert response.status_code == 200
+                created.append(response.json()["id"])
+            invalid = await http.post("/matches/", json={"team_id": first.id, "date": date, "score": "6-4"}, headers=headers)
+            corrections = [
+                # Score corrected, result moved to another team, score added to a match without one
+                await http.patch(f"/matches/{created[0]}", json={"score": "4-6 3-6"}, headers=headers),
+                await http.patch(f"/matches/{created[2]}", json={"team_id": other.id}, headers=headers),
+                await http.patch(f"/matches/{created[3]}", json={"score": "6-1 6-1"}, headers=headers),
+            ]
+            deleted = await http.delete(f"/matches/{created[1]}", headers=headers)
+            return invalid, corrections, deleted
+
+    invalid, corrections, deleted = run(scenario())
+    assert invalid.status_code == 422
+    assert [response.status_code for response in corrections] == [200, 200, 200]
+    assert deleted.status_code == 200
+
+    with Session(db) as session:
+        _, expected, _ = compute(session)
+    assert _standings(db) == expected
+    assert expected[first.id]["played"] == 1 and expected[first.id]["lost"] == 1
+    assert expected[other.id]["played"] == 2
+    assert recompute(db, check=True) == 0
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlmodel import Session, select
+from db.session import open_session
+from models.models import Event, Class, User, UserEventLink, UserClassLink, EventWaitlist, ClassWaitlist
+from api.waitlist import promote_class_waitlist
+
+
+def _event(**fields) -> Event:
+    return Event(**{
+        "name": "Americano", "type": "tournament", "date": datetime.utcnow() + timedelta(days=3),
+        "min_level": 1.0, "max_slots": 1, "price": 10.0, **fields,
+    })
+
+def _class(**fields) -> Class:
+    return Class(**{"coach_id": 1, "schedule": datetime.utcnow() + timedelta(days=2), "level_required": 3.0, "max_students": 1, **fields})
+
+def _participants(db, event_id: int) -> set:
+    with Session(db) as session:
+        return set(session.exec(select(UserEventLink.user_id).where(UserEventLink.event_id == event_id)).all())
+
+def _waiting(db, model, key, item_id: int) -> list:
+    with Session(db) as session:
+        return list(session.exec(select(model.user_id).where(getattr(model, key) == item_id).order_by(model.id)).all())
+
+def test_unregistering_promotes_the_oldest_waiting_user(db, member, add_rows, run, client):
+    event, = add_rows(_event())
+    (first, first_headers), (second, second_headers), (third, third_headers) = member(), member(), member()
+
+    async def scenario():
+        async with client() as http:
+            registered = await http.post(f"/events/{event.id}/register", headers=first_headers)
+            joined = [await http.post(f"/events/{event.id}/waitlist", headers=headers) for headers in (second_headers, third_headers)]
+            await http.delete(f"/events/{event.id}/unregister", params={"user_id": first.id}, headers=first_headers)
+            position = await http.get(f"/events/{event.id}/waitlist", headers=third_headers)
+            return registered, joined, position
+
+    registered, joined, position = run(scenario())
+    assert registered.status_code == 200
+    assert [(response.json()["status"], response.json()["position"]) for response in joined] == [("waiting", 1), ("waiting", 2)]
+    assert _participants(db, event.id) == {second.id}
+    assert _waiting(db, EventWaitlist, "event_id", event.id) == [third.id]
+    assert position.json() == {"position": 1, "waiting": 1}
+    with Session(db) as session:
+        assert session.get(Event, event.id).participant_count == 1
+
+def test_raising_max_slots_promotes_in_order(db, member, add_rows, run, client):
+    event, = add_rows(_event())
+    _, admin_headers = member(is_admin=True)
+    waiting = [member() for _ in range(4)]
+
+    async def scenario():
+        async with client() as http:
+            for _, headers in waiting:
+                await http.post(f"/events/{event.id}/waitlist", headers=headers)
+            return await http.patch(f"/events/{event.id}", json={"max_slots": 3}, headers=admin_headers)
+
+    response = run(scenario())
+    assert response.status_code == 200
+    # The first one got the free slot on joining, the next two the new ones
+    assert _participants(db, event.id) == {user.id for user, _ in waiting[:3]}
+    assert _waiting(db, EventWaitlist, "event_id", event.id) == [waiting[3][0].id]
+    with Session(db) as session:
+        assert session.get(Event, event.id).participant_count == 3
+
+def test_class_promotion_skips_users_without_credits(db, member, add_rows, run, client):
+    lesson, = add_rows(_class())
+    (first, first_headers), (broke, broke_headers), (ready, ready_headers) = (
+        member(classes_to_recover=1), member(classes_to_recover=0), member(classes_to_recover=1),
+    )
+
+    async def scenario():
+        async with client() as http:
+            await http.post(f"/classes/{lesson.id}/register", headers=first_headers)
+            for headers in (broke_headers, ready_headers):
+                await http.post(f"/classes/{lesson.id}/waitlist", headers=headers)
+            return await http.delete(f"/classes/{lesson.id}/unregister", headers=first_headers)
+
+    response = run(scenario())
+    assert response.status_code == 200
+    with Session(db) as session:
+        assert set(session.exec(select(UserClassLink.user_id).where(UserClassLink.class_id == lesson.id)).all()) == {ready.id}
+        assert session.get(User, ready.id).classes_to_recover == 0
+        assert session.get(User, first.id).classes_to_recover == 1
+        assert session.get(Class, lesson.id).student_count == 1
+    # Keeps the place until a credit comes
+    assert _waiting(db, ClassWaitlist, "class_id", lesson.id) == [broke.id]
+
+def test_waitlist_rejects_users_below_the_class_level(db, member, add_rows, run, client):
+    lesson, = add_rows(_class(level_required=4.0))
+    _, headers = member(level=3.0, classes_to_recover=1)
+
+    async def scenario():
+        async with client() as http:
+            return await http.post(f"/classes/{lesson.id}/waitlist", headers=headers)
+
+    response = run(scenario())
+    assert response.status_code == 400
+    assert _waiting(db, ClassWaitlist, "class_id", lesson.id) == []
+
+class _SpendsCreditFirst:
+    # Session whose first credit UPDATE is preceded by the user spending their last credit elsewhere,
+    # between the candidate read and the UPDATE
+    def __init__(self, session, user_id: int):
+        self.session = session
+        self.user_id = user_id
+
+    async def exec(self, statement, **kwargs):
+        if self.user_id is not None and getattr(statement, "is_dml", False) and statement.table.name == User.__tablename__:
+            user_id, self.user_id = self.user_id, None
+            await self.session.exec(update(User).where(User.id == user_id).values(classes_to_recover=0))
+        return await self.session.exec(statement, **kwargs)
+
+def test_class_promotion_fills_slots_when_a_candidate_spends_their_credit(db, member, add_rows, run):
+    lesson, = add_rows(_class(max_students=2))
+    waiting = [member(classes_to_recover=1)[0] for _ in range(4)]
+    add_rows(*(ClassWaitlist(class_id=lesson.id, user_id=user.id) for user in waiting))
+
+    async def scenario():
+        async with open_session() as session:
+            promoted = await promote_class_waitlist(_SpendsCreditFirst(session, waiting[0].id), lesson.id)
+            await session.commit()
+            return promoted
+
+    promoted = run(scenario())
+    # The next users in line take the slot the first one could not
+    assert promoted == [waiting[1].id, waiting[2].id]
+    with Session(db) as session:
+        assert session.get(Class, lesson.id).student_count == 2
+    assert _waiting(db, ClassWaitlist, "class_id", lesson.id) == [waiting[0].id, waiting[3].id]